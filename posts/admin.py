@@ -1,13 +1,205 @@
-from django.contrib import admin
+from datetime import datetime
 
-from .models import Post, Group
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.core.paginator import Paginator
+from django.db import connections, transaction
+from django.db.models import F, Max, Min
+from django.utils import timezone
+from django.utils.dates import MONTHS
+from django.utils.functional import cached_property
 
+from . import cache, fulltext
+from .models import Comment, Follow, Group, Post
 
-class PostAdmin(admin.ModelAdmin):
-    list_display = ("pk", "text", "pub_date", "author") 
-    search_fields = ("text",) 
-    list_filter = ("pub_date",) 
-    empty_value_display = '-пусто-' 
+# строк в одной пачке массовых действий
+BATCH_SIZE = 1000
+# дальше этого числа отфильтрованный список не считается
+COUNT_LIMIT = 10000
+
+
+def estimated_count(queryset):
+    """Оценка числа строк таблицы без COUNT(*): в PostgreSQL по статистике,
+    в остальных базах - сверху, по разнице крайних id"""
+    connection = connections[queryset.db]
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT reltuples FROM pg_class WHERE relname = %s", [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+        if row and row[0] > 0:
+            return int(row[0])
+    bounds = queryset.model._default_manager.using(queryset.db).aggregate(first=Min("pk"), last=Max("pk"))
+    if bounds["last"] is None:
+        return 0
+    return bounds["last"] - bounds["first"] + 1
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator для больших таблиц: весь список оценивается по таблице,
+    отфильтрованный считается не дальше COUNT_LIMIT строк"""
+
+    @cached_property
+    def count(self):
+        if not self.object_list.query.where:
+            return estimated_count(self.object_list)
+        return self.object_list[:COUNT_LIMIT].count()
+
+    def validate_number(self, number):
+        # оценка бывает больше настоящего числа: последние страницы просто пустые
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            return super().validate_number(number)
+        return max(number, 1)
+
+
+def batches(queryset, size=BATCH_SIZE):
+    """Id выбранных строк пачками по возрастанию, курсором по id, а не OFFSET"""
+    last = None
+    queryset = queryset.order_by("pk").values_list("pk", flat=True)
+    while True:
+        page = queryset if last is None else queryset.filter(pk__gt=last)
+        ids = list(page[:size])
+        if not ids:
+            return
+        yield ids
+        last = ids[-1]
+
+
+class DateRangeFilter(admin.SimpleListFilter):
+    """Годы и месяцы вместо date_hierarchy: та строит ссылки запросом DISTINCT
+    по усечённой дате через всю таблицу. Здесь годы берутся из MIN/MAX по
+    индексу поля, месяцы выбранного года - без запроса, а выбор фильтрует
+    диапазоном __gte/__lt по тому же индексу"""
+    field_name = None
+
+    def lookups(self, request, model_admin):
+        bounds = model_admin.model._default_manager.aggregate(first=Min(self.field_name), last=Max(self.field_name))
+        if bounds["last"] is None:
+            return []
+        selected = (self.value() or "")[:4]
+        choices = []
+        for year in range(timezone.localtime(bounds["last"]).year, timezone.localtime(bounds["first"]).year - 1, -1):
+            choices.append((str(year), str(year)))
+            if str(year) == selected:
+                choices.extend((f"{year}-{month:02}", f"{MONTHS[month]} {year}") for month in range(1, 13))
+        return choices
+
+    def queryset(self, request, queryset):
+        if not self.value():
+            return queryset
+        try:
+            year, month = (self.value().split("-") + [None])[:2]
+            start = datetime(int(year), int(month or 1), 1)
+        except ValueError:
+            raise IncorrectLookupParameters(self.value())
+        if month is None:
+            end = start.replace(year=start.year + 1)
+        elif start.month == 12:
+            end = start.replace(year=start.year + 1, month=1)
+        else:
+            end = start.replace(month=start.month + 1)
+        return queryset.filter(**{f"{self.field_name}__gte": timezone.make_aware(start),
+                                  f"{self.field_name}__lt": timezone.make_aware(end)})
+
+
+class PubDateRangeFilter(DateRangeFilter):
+    title = "год и месяц публикации"
+    parameter_name = "published"
+    field_name = "pub_date"
+
+
+class CreatedRangeFilter(DateRangeFilter):
+    title = "год и месяц"
+    parameter_name = "written"
+    field_name = "created"
+
+
+class ConfirmActionForm(ActionForm):
+    confirm = forms.BooleanField(required=False, label="Подтверждаю")
+
+
+class PostActionForm(ConfirmActionForm):
+    group = forms.ModelChoiceField(Group.objects.all(), required=False, label="Группа")
+    # пустой выбор группы - скорее забытый, поэтому убрать группу нужно явно
+    without_group = forms.BooleanField(required=False, label="Без группы")
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    action_form = ConfirmActionForm
+    actions = ["delete_in_batches"]
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        # стандартное удаление грузит все выбранные объекты ради страницы подтверждения
+        actions.pop("delete_selected", None)
+        return actions
+
+    def delete_in_batches(self, request, queryset):
+        if not request.POST.get("confirm"):
+            self.message_user(request, "Отметьте «Подтверждаю» рядом с действием", messages.WARNING)
+            return
+        deleted = 0
+        for ids in batches(queryset):
+            with transaction.atomic():
+                # delete() по пачке: сигналы и каскады работают, в памяти не больше пачки
+                deleted += self.model.objects.filter(pk__in=ids).delete()[1].get(self.model._meta.label, 0)
+        self.message_user(request, f"Удалено: {deleted}")
+    delete_in_batches.short_description = "Удалить выбранные (пачками)"
+
+
+class PostAdmin(LargeTableAdmin):
+    list_display = ("pk", "text", "pub_date", "author", "group")
+    list_select_related = ("author", "group")
+    search_fields = ("text",)
+    # фильтры по дате - готовые ссылки на диапазоны, COUNT они не выполняют
+    list_filter = ("pub_date", PubDateRangeFilter)
+    raw_id_fields = ("author", "group")
+    empty_value_display = '-пусто-'
+    action_form = PostActionForm
+    actions = ["move_to_group", "delete_in_batches"]
+
+    def get_search_results(self, request, queryset, search_term):
+        # поиск по FTS5-индексу вместо LIKE '%...%' по всей таблице
+        if not search_term or not fulltext.available(queryset.db):
+            return super().get_search_results(request, queryset, search_term)
+        return fulltext.filter_posts(queryset, search_term), False
+
+    def move_to_group(self, request, queryset):
+        group_id = request.POST.get("group") or None
+        if bool(group_id) == bool(request.POST.get("without_group")):
+            self.message_user(request, "Выберите группу или отметьте «Без группы»", messages.WARNING)
+            return
+        moved = 0
+        for ids in batches(queryset):
+            with transaction.atomic():
+                posts = Post.objects.filter(pk__in=ids)
+                feeds = {cache.group_feed(group_id)} if group_id else set()
+                for author_id, previous_group_id in posts.values_list("author_id", "group_id"):
+                    feeds.update(cache.post_feeds(Post(author_id=author_id, group_id=previous_group_id)))
+                # update() идёт без сигналов: версию карточки и ленты сбрасываем сами
+                moved += posts.update(group_id=group_id, version=F("version") + 1)
+            cache.bump(*feeds)
+        self.message_user(request, f"Перенесено: {moved}")
+    move_to_group.short_description = "Перенести выбранные в группу"
+
+
+class CommentAdmin(LargeTableAdmin):
+    list_display = ("pk", "text", "created", "author", "post")
+    list_select_related = ("author", "post")
+    search_fields = ("text",)
+    list_filter = (CreatedRangeFilter,)
+    raw_id_fields = ("author", "post")
+
+
+class FollowAdmin(LargeTableAdmin):
+    list_display = ("pk", "user", "author")
+    list_select_related = ("user", "author")
+    raw_id_fields = ("user", "author")
 
 
 class GroupAdmin(admin.ModelAdmin):
@@ -16,3 +208,5 @@ class GroupAdmin(admin.ModelAdmin):
 
 admin.site.register(Post, PostAdmin)
 admin.site.register(Group, GroupAdmin)
+admin.site.register(Comment, CommentAdmin)
+admin.site.register(Follow, FollowAdmin)
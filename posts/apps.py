@@ -1,5 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class PostsConfig(AppConfig):
     name = 'posts'
+
+    def ready(self):
+        from . import signals
+        # миграции, пересоздающие таблицу постов в SQLite, теряют триггеры поиска;
+        # триггер, снятый прерванным импортом, возвращают migrate и следующий импорт
+        post_migrate.connect(signals.install_search, sender=self)
@@ -0,0 +1,110 @@
+"""Поколения лент для кеширования фрагментов.
+
+У каждой ленты (главная, группа, профиль, подписки пользователя) есть
+номер поколения в кеше. Он входит в ключ фрагмента, поэтому фрагменты не
+нужно искать и удалять: сохранение, правка или удаление поста
+увеличивает поколения только затронутых лент. Кеш общий для всех
+процессов (settings.CACHES), так что сброс из одного воркера или
+команды manage.py сразу видят остальные. Лента подписок складывается из
+поколений профилей всех авторов, на которых подписан пользователь.
+Рядом с поколением хранится время его последней смены - для
+Last-Modified, с точностью до секунды; точный валидатор - поколение.
+"""
+import time
+from datetime import datetime, timezone
+
+from django.core.cache import cache
+from django.db import transaction
+
+from . import follows
+
+INDEX = "index"
+
+
+def group_feed(group_id):
+    return f"group:{group_id}"
+
+
+def profile_feed(author_id):
+    return f"profile:{author_id}"
+
+
+def following_feed(user_id):
+    return f"following:{user_id}"
+
+
+def author_stats(user_id):
+    """Счётчики постов и подписок в шапке профиля и страницы поста"""
+    return f"stats:{user_id}"
+
+
+def _key(feed):
+    return f"feed_generation:{feed}"
+
+
+def _modified_key(feed):
+    return f"feed_modified:{feed}"
+
+
+def _initial():
+    # после вытеснения ключа поколение не должно совпасть со старым
+    return int(time.time() * 1000)
+
+
+def generations(*feeds):
+    keys = {_key(feed): feed for feed in feeds}
+    found = cache.get_many(list(keys))
+    result = {}
+    for key, feed in keys.items():
+        if key not in found:
+            found[key] = _initial()
+            if cache.add(key, found[key], None):
+                cache.add(_modified_key(feed), time.time(), None)
+            else:
+                found[key] = cache.get(key, found[key])
+        result[feed] = found[key]
+    return result
+
+
+def feed_version(*feeds):
+    """Строка для {% cache %}: меняется, когда меняется любая из лент"""
+    current = generations(*feeds)
+    return ".".join(str(current[feed]) for feed in feeds)
+
+
+def last_modified(*feeds):
+    """Время последней смены любой из лент или None, если оно неизвестно"""
+    found = cache.get_many([_modified_key(feed) for feed in feeds])
+    if len(found) < len(feeds):
+        return None
+    return datetime.fromtimestamp(max(found.values()), tz=timezone.utc)
+
+
+def follow_feed_version(user):
+    authors = sorted(follows.followees(user.pk))
+    return feed_version(following_feed(user.pk), *(profile_feed(author_id) for author_id in authors))
+
+
+def bump(*feeds):
+    for feed in feeds:
+        try:
+            cache.incr(_key(feed))
+        except ValueError:
+            cache.add(_key(feed), _initial(), None)
+    cache.set_many({_modified_key(feed): time.time() for feed in feeds}, None)
+
+
+def bump_on_commit(*feeds):
+    """bump() сейчас и ещё раз после фиксации транзакции: читатель, который
+    до фиксации увидел новое поколение, но старые данные, не оставит их в кеше"""
+    bump(*feeds)
+    transaction.on_commit(lambda: bump(*feeds))
+
+
+def post_feeds(post, *group_ids):
+    """Ленты, в которых виден пост; group_ids - прежние группы при правке"""
+    feeds = {INDEX, profile_feed(post.author_id)}
+    for group_id in (post.group_id,) + group_ids:
+        if group_id is not None:
+            feeds.add(group_feed(group_id))
+    return sorted(feeds)
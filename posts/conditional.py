@@ -0,0 +1,72 @@
+"""Условный GET для публичных страниц.
+
+Для анонима страница зависит только от данных, поэтому валидатором
+служат поколения лент из posts.cache: ETag - их номера, Last-Modified -
+время последней смены. Они считаются до тяжёлых запросов представления,
+и на If-None-Match / If-Modified-Since Django отвечает 304 без отрисовки.
+Анонимам отдаётся Cache-Control: public для обратного прокси, остальным -
+private: у них на странице свои ссылки и формы.
+"""
+from functools import wraps
+
+from django.conf import settings
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+from . import cache
+from .models import Group, User
+
+
+def page_feeds(request, feeds, *args, **kwargs):
+    """feeds(*args, **kwargs), посчитанные один раз за запрос"""
+    if not hasattr(request, "_page_feeds"):
+        request._page_feeds = feeds(*args, **kwargs)
+    return request._page_feeds
+
+
+def public_page(feeds):
+    """Декоратор представления; feeds(**kwargs) - ленты, из которых собрана
+    страница, или None, если её нет (тогда представление ответит само)"""
+    def anonymous_feeds(request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return None
+        return page_feeds(request, feeds, *args, **kwargs)
+
+    def etag(request, *args, **kwargs):
+        found = anonymous_feeds(request, *args, **kwargs)
+        return cache.feed_version(*found) if found else None
+
+    def last_modified(request, *args, **kwargs):
+        found = anonymous_feeds(request, *args, **kwargs)
+        return cache.last_modified(*found) if found else None
+
+    def decorator(view):
+        conditional_view = condition(etag_func=etag, last_modified_func=last_modified)(view)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            if response.status_code in (200, 304):
+                if request.user.is_authenticated:
+                    patch_cache_control(response, private=True)
+                else:
+                    patch_cache_control(response, public=True, max_age=settings.PUBLIC_CACHE_MAX_AGE)
+            return response
+        return wrapper
+    return decorator
+
+
+def index_feeds():
+    return [cache.INDEX]
+
+
+def group_feeds(slug):
+    group_id = Group.objects.filter(slug=slug).values_list("pk", flat=True).first()
+    return group_id and [cache.group_feed(group_id)]
+
+
+def profile_feeds(username, post_id=None):
+    # страница поста показывает те же счётчики автора, а его посты и
+    # комментарии к ним сбрасывают поколение профиля
+    author_id = User.objects.filter(username=username).values_list("pk", flat=True).first()
+    return author_id and [cache.profile_feed(author_id), cache.author_stats(author_id)]
@@ -0,0 +1,6 @@
+from django.conf import settings
+
+
+def fragment_cache(request):
+    """Срок жизни фрагментов {% cache %} в шаблонах лент"""
+    return {'fragment_timeout': settings.FRAGMENT_CACHE_TIMEOUT}
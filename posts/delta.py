@@ -0,0 +1,117 @@
+"""Новые записи ленты после курсора, в JSON, для живого обновления.
+
+Клиент передаёт ?since= - курсор последней записи, которую он видел
+(page.previous_cursor страницы или cursor прошлого ответа), и получает
+только более новые записи, а с ?count=1 - только их число. Без since
+ответ содержит лишь курсор самой новой записи, с него и начинают.
+
+С ?wait=N (не больше DELTA_MAX_WAIT секунд) ответ без новых записей
+откладывается до их появления: ожидание опрашивает поколения лент из
+posts.cache раз в DELTA_POLL_INTERVAL секунд и идёт в базу, только
+когда поколение сменилось. Правки, удаления и комментарии тоже меняют
+поколение, поэтому повторных запросов за ожидание может быть сколько
+угодно: в бюджет запроса (@query_budget) входит только первый, повторы
+идут под querybudget.unmetered().
+"""
+import time
+
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.views.decorators.cache import never_cache
+
+from yatube.querybudget import query_budget, unmetered
+
+from . import cache, follows, timeline
+from .models import Group, Post
+from .pagination import count_newer, decode_cursor, encode_cursor, newer, newest
+
+# записей в одном ответе; остальное клиент заберёт следующим запросом
+DELTA_LIMIT = 50
+
+
+def _post(post):
+    return {
+        "id": post.pk,
+        "url": reverse("post", kwargs={"username": post.author.username, "post_id": post.pk}),
+        "author": post.author.username,
+        "author_name": post.author.get_full_name(),
+        "group": post.group.slug if post.group else None,
+        "text": post.text,
+        "pub_date": post.pub_date.isoformat(),
+        "comments": post.comment_count,
+        "image": post.image.url if post.image else None,
+    }
+
+
+def _wait(request):
+    try:
+        wait = float(request.GET.get("wait") or 0)
+    except ValueError:
+        return 0
+    return min(max(wait, 0), settings.DELTA_MAX_WAIT)
+
+
+def _changes(since, sources, count_only):
+    if count_only:
+        total = count_newer(*sources, since=since, limit=DELTA_LIMIT)
+        return {"count": min(total, DELTA_LIMIT), "more": total > DELTA_LIMIT}
+    posts, more = newer(*sources, since=since, limit=DELTA_LIMIT)
+    return {"count": len(posts), "more": more, "posts": [_post(post) for post in posts],
+            "cursor": encode_cursor(posts[-1]) if posts else None}
+
+
+def delta_response(request, sources, feeds):
+    """Ответ для ленты из источников sources, которую меняют поколения feeds"""
+    token = request.GET.get("since")
+    if not token:
+        return JsonResponse({"cursor": newest(*sources), "count": 0, "posts": []})
+    since = decode_cursor(token)
+    if since is None:
+        return JsonResponse({"error": "некорректный курсор since"}, status=400)
+    count_only = request.GET.get("count") in ("1", "true")
+    deadline = time.monotonic() + _wait(request)
+    # поколение читается до запроса: пост, опубликованный между ними, сменит его
+    version = cache.feed_version(*feeds)
+    result = _changes(since, sources, count_only)
+    while True:
+        if result["count"] or time.monotonic() >= deadline:
+            break
+        while cache.feed_version(*feeds) == version and time.monotonic() < deadline:
+            time.sleep(min(settings.DELTA_POLL_INTERVAL, max(deadline - time.monotonic(), 0)))
+        current = cache.feed_version(*feeds)
+        if current == version:
+            break
+        # правка или удаление тоже меняют поколение: тогда ждём дальше
+        version = current
+        with unmetered():
+            result = _changes(since, sources, count_only)
+    # без новых записей клиент продолжает с прежнего курсора
+    result["cursor"] = result.get("cursor") or token
+    return JsonResponse(result, json_dumps_params={"ensure_ascii": False})
+
+
+@query_budget(3)
+@never_cache
+def index_delta(request):
+    return delta_response(request, [Post.objects.for_feed()], [cache.INDEX])
+
+
+@query_budget(4)
+@never_cache
+def group_delta(request, slug):
+    group = get_object_or_404(Group, slug=slug)
+    return delta_response(request, [Post.objects.for_feed().filter(group=group)],
+                          [cache.group_feed(group.pk)])
+
+
+@query_budget(7)
+@never_cache
+@login_required
+def follow_delta(request):
+    user = request.user
+    authors = sorted(follows.followees(user.pk))
+    feeds = [cache.following_feed(user.pk)] + [cache.profile_feed(author_id) for author_id in authors]
+    return delta_response(request, timeline.follow_feed_sources(user), feeds)
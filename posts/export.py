@@ -0,0 +1,79 @@
+"""Выгрузка постов пользователя с комментариями в JSON Lines или CSV.
+
+Строки отдаются генератором: посты и комментарии читаются двумя
+курсорами QuerySet.iterator(chunk_size=CHUNK_SIZE), оба по возрастанию
+id поста, и сливаются на ходу. В памяти одна порция строк каждого
+курсора и комментарии одного поста, сколько бы постов ни было у автора.
+"""
+import csv
+import json
+from itertools import groupby
+from operator import attrgetter
+
+from .models import Comment, Post
+
+FORMATS = {"jsonl": "application/x-ndjson", "csv": "text/csv"}
+CHUNK_SIZE = 500
+CSV_HEADER = ("type", "id", "post_id", "date", "author", "group", "image", "text")
+
+
+def posts_with_comments(author):
+    """(пост, [комментарии]) по возрастанию id поста"""
+    posts = Post.objects.filter(author=author).select_related("group").order_by("pk")
+    comments = (Comment.objects.filter(post__author=author).select_related("author")
+                .order_by("post_id", "pk").only("post_id", "text", "created", "author__username"))
+    grouped = groupby(comments.iterator(chunk_size=CHUNK_SIZE), key=attrgetter("post_id"))
+    pending = next(grouped, None)
+    for post in posts.iterator(chunk_size=CHUNK_SIZE):
+        own = []
+        # комментарии поста, удалённого между запросами двух курсоров
+        while pending is not None and pending[0] < post.pk:
+            pending = next(grouped, None)
+        if pending is not None and pending[0] == post.pk:
+            own = list(pending[1])
+            pending = next(grouped, None)
+        yield post, own
+
+
+def _image_url(post, absolute_url):
+    return absolute_url(post.image.url) if post.image else None
+
+
+def jsonl_lines(author, absolute_url=str):
+    for post, comments in posts_with_comments(author):
+        yield json.dumps({
+            "id": post.pk,
+            "text": post.text,
+            "pub_date": post.pub_date.isoformat(),
+            "group": {"slug": post.group.slug, "title": post.group.title} if post.group else None,
+            "image": _image_url(post, absolute_url),
+            "comments": [{
+                "id": comment.pk,
+                "author": comment.author.username,
+                "text": comment.text,
+                "created": comment.created.isoformat(),
+            } for comment in comments],
+        }, ensure_ascii=False) + "\n"
+
+
+class _Line:
+    """Файл для csv.writer, который возвращает строку вместо записи"""
+    def write(self, value):
+        return value
+
+
+def csv_lines(author, absolute_url=str):
+    writer = csv.writer(_Line())
+    yield writer.writerow(CSV_HEADER)
+    for post, comments in posts_with_comments(author):
+        yield writer.writerow(("post", post.pk, post.pk, post.pub_date.isoformat(), author.username,
+                               post.group.slug if post.group else "", _image_url(post, absolute_url) or "",
+                               post.text))
+        for comment in comments:
+            yield writer.writerow(("comment", comment.pk, post.pk, comment.created.isoformat(),
+                                   comment.author.username, "", "", comment.text))
+
+
+def lines(author, fmt, absolute_url=str):
+    """Строки выгрузки в формате fmt; absolute_url делает ссылки на изображения полными"""
+    return (jsonl_lines if fmt == "jsonl" else csv_lines)(author, absolute_url)
@@ -0,0 +1,155 @@
+"""RSS и Atom для главной ленты, групп и авторов.
+
+Готовый XML хранится в кеше под ключом с поколением ленты из
+posts.cache и устаревает сам, когда пост в ленте сохраняют, правят или
+удаляют; FRAGMENT_CACHE_TIMEOUT лишь ограничивает срок его жизни. Опрос без изменений обходится одним
+чтением кеша, а с If-None-Match - ответом 304 (posts.conditional).
+"""
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.syndication.views import Feed
+from django.core.cache import cache as django_cache
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.feedgenerator import Atom1Feed
+from django.utils.text import Truncator
+
+from yatube.querybudget import query_budget
+
+from . import cache
+from .conditional import group_feeds, index_feeds, page_feeds, public_page
+from .models import Group, Post, User
+
+ITEMS = 20
+
+
+def cached_feed(feeds):
+    """Декоратор: ответ представления в кеше, пока не сменится поколение лент feeds(**kwargs)"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            found = page_feeds(request, feeds, *args, **kwargs)
+            if not found:
+                return view(request, *args, **kwargs)
+            key = f"syndication:{request.path}:{cache.feed_version(*found)}"
+            cached = django_cache.get(key)
+            if cached is not None:
+                content, content_type = cached
+                return HttpResponse(content, content_type=content_type)
+            response = view(request, *args, **kwargs)
+            # Feed ставит Last-Modified по дате свежего поста; валидатор, как и
+            # у страниц, - время смены поколения, его добавит public_page
+            del response["Last-Modified"]
+            if response.status_code == 200:
+                django_cache.set(key, (response.content, response["Content-Type"]), settings.FRAGMENT_CACHE_TIMEOUT)
+            return response
+        return wrapper
+    return decorator
+
+
+def author_feeds(username):
+    # в отличие от страницы профиля, счётчики подписок в ленте не видны
+    author_id = User.objects.filter(username=username).values_list("pk", flat=True).first()
+    return author_id and [cache.profile_feed(author_id)]
+
+
+def feed_view(feed, feeds, budget):
+    """Представление ленты: условный GET, кеш XML и бюджет запросов"""
+    return query_budget(budget)(public_page(feeds)(cached_feed(feeds)(feed)))
+
+
+class PostsFeed(Feed):
+    def items(self, obj):
+        return self.posts(obj).order_by("-pub_date", "-pk")[:ITEMS]
+
+    def item_title(self, post):
+        return Truncator(post.text).chars(60)
+
+    def item_description(self, post):
+        return post.text
+
+    def item_link(self, post):
+        return reverse("post", kwargs={"username": post.author.username, "post_id": post.pk})
+
+    def item_author_name(self, post):
+        return post.author.get_full_name() or post.author.username
+
+    def item_pubdate(self, post):
+        return post.pub_date
+
+    def item_categories(self, post):
+        return [post.group.title] if post.group else []
+
+
+class IndexFeed(PostsFeed):
+    title = "Yatube: последние записи"
+    description = "Новые записи всех авторов"
+
+    def link(self):
+        return reverse("index")
+
+    def posts(self, obj):
+        return Post.objects.for_feed()
+
+
+class GroupFeed(PostsFeed):
+    def get_object(self, request, slug):
+        return get_object_or_404(Group, slug=slug)
+
+    def title(self, group):
+        return f"Yatube: {group.title}"
+
+    def description(self, group):
+        return group.description
+
+    def link(self, group):
+        return reverse("group", kwargs={"slug": group.slug})
+
+    def posts(self, group):
+        return Post.objects.for_feed().filter(group=group)
+
+
+class AuthorFeed(PostsFeed):
+    def get_object(self, request, username):
+        return get_object_or_404(User, username=username)
+
+    def title(self, author):
+        return f"Yatube: {author.get_full_name() or author.username}"
+
+    def description(self, author):
+        return f"Записи {author.username}"
+
+    def link(self, author):
+        return reverse("profile", kwargs={"username": author.username})
+
+    def posts(self, author):
+        return Post.objects.for_feed().filter(author=author)
+
+
+class AtomMixin:
+    feed_type = Atom1Feed
+
+    def subtitle(self, obj):
+        return self._get_dynamic_attr("description", obj)
+
+
+class IndexAtomFeed(AtomMixin, IndexFeed):
+    pass
+
+
+class GroupAtomFeed(AtomMixin, GroupFeed):
+    pass
+
+
+class AuthorAtomFeed(AtomMixin, AuthorFeed):
+    pass
+
+
+index_rss = feed_view(IndexFeed(), index_feeds, 3)
+index_atom = feed_view(IndexAtomFeed(), index_feeds, 3)
+group_rss = feed_view(GroupFeed(), group_feeds, 5)
+group_atom = feed_view(GroupAtomFeed(), group_feeds, 5)
+profile_rss = feed_view(AuthorFeed(), author_feeds, 5)
+profile_atom = feed_view(AuthorAtomFeed(), author_feeds, 5)
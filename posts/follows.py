@@ -0,0 +1,83 @@
+"""Граф подписок в кеше.
+
+Для каждого пользователя в общем кеше (одном на все воркеры) лежит
+множество id авторов, на которых он подписан (followees). Проверка
+«подписан ли» - одно чтение кеша и поиск во множестве, а
+following_map() проверяет всех авторов страницы ленты тем же одним
+чтением, без запроса на каждую карточку.
+
+Множество собирается из основной базы при первом обращении: снимок с
+отставшей реплики остался бы в кеше. Подписка и отписка (сигналы)
+сбрасывают множество подписчика сразу и ещё раз после фиксации
+транзакции - иначе параллельный запрос, прочитавший базу до фиксации,
+вернул бы в кеш старое множество. Массовая загрузка в обход сигналов
+сбрасывает весь граф через reset(). Если старое множество всё же
+попадёт в кеш, оно проживёт не дольше FOLLOW_GRAPH_TIMEOUT - нескольких
+минут.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from .models import Follow
+
+_VERSION = "follow_graph:version"
+
+
+def timeout():
+    return getattr(settings, "FOLLOW_GRAPH_TIMEOUT", 10 * 60)
+
+
+def _version():
+    version = cache.get(_VERSION)
+    if version is None:
+        # после вытеснения ключа версия не должна совпасть со старой
+        version = int(time.time() * 1000)
+        if not cache.add(_VERSION, version, None):
+            version = cache.get(_VERSION, version)
+    return version
+
+
+def _key(kind, user_id):
+    return f"follow_graph:{_version()}:{kind}:{user_id}"
+
+
+def _load(kind, user_id, rows):
+    key = _key(kind, user_id)
+    found = cache.get(key)
+    if found is None:
+        found = frozenset(rows.using(DEFAULT_DB_ALIAS))
+        cache.set(key, found, timeout())
+    return found
+
+
+def followees(user_id):
+    """id авторов, на которых подписан пользователь"""
+    return _load("followees", user_id, Follow.objects.filter(user_id=user_id).values_list("author_id", flat=True))
+
+
+def is_following(user_id, author_id):
+    return author_id in followees(user_id)
+
+
+def following_map(user_id, author_ids):
+    """{id автора: подписан ли пользователь} для всех авторов страницы"""
+    found = followees(user_id)
+    return {author_id: author_id in found for author_id in author_ids}
+
+
+def changed(user_id, author_id):
+    """Подписка user_id на author_id появилась или исчезла"""
+    key = _key("followees", user_id)
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+def reset():
+    """Сбросить весь граф: подписки загружены в обход сигналов"""
+    try:
+        cache.incr(_VERSION)
+    except ValueError:
+        cache.add(_VERSION, int(time.time() * 1000), None)
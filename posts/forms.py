@@ -1,4 +1,6 @@
+from django.core.files.uploadedfile import UploadedFile
 from django.forms import ModelForm
+from .images import ingest
 from .models import Post, Comment
 
 
@@ -11,6 +13,15 @@ class PostForm(ModelForm):
             'text': 'Текс записи',
         }
 
+    def clean_image(self):
+        image = self.cleaned_data.get('image')
+        if isinstance(image, UploadedFile):
+            # новая загрузка: сохраняем уменьшенную копию без метаданных
+            image, self.instance.image_width, self.instance.image_height = ingest(image)
+        elif not image:
+            self.instance.image_width = self.instance.image_height = None
+        return image
+
 
 class CommentForm(ModelForm):
     class Meta:
@@ -0,0 +1,207 @@
+"""Полнотекстовый поиск по постам на SQLite FTS5.
+
+Виртуальная таблица posts_post_search (rowid = id поста) хранит текст
+поста, имя автора и название группы. Её поддерживают триггеры SQLite на
+таблицах постов, пользователей и групп, поэтому индекс обновляется в той
+же транзакции при любом изменении, в том числе через bulk_create и
+update(). SQLite теряет триггеры, когда миграция пересоздаёт таблицу,
+поэтому install() повторяется после каждого migrate (см. apps.py) и в
+начале и конце каждого импорта. Если install() пришлось вернуть триггер
+вставки (импорт выключил его и был прерван), посты, вставленные без
+него, дописываются в индекс.
+Выдача сортируется по bm25 и листается курсором (bm25, id) без OFFSET.
+"""
+import base64
+import binascii
+import re
+from contextlib import contextmanager
+
+from django.core.paginator import Page, Paginator
+from django.db import connections
+from django.db.models.expressions import RawSQL
+
+from .models import Group, Post, User
+from .pagination import POSTS_PER_PAGE
+
+TABLE = "posts_post_search"
+# веса bm25 для текста, имени автора и названия группы
+WEIGHTS = (1.0, 0.5, 0.5)
+_WORDS = re.compile(r"\w+")
+
+
+def _tables():
+    return {
+        "search": TABLE,
+        "post": Post._meta.db_table,
+        "user": User._meta.db_table,
+        "group": Group._meta.db_table,
+    }
+
+
+def _row(alias):
+    # колонки строки индекса для поста alias (new или old в триггере)
+    return ("{alias}.id, {alias}.text, "
+            "(SELECT username FROM {user} WHERE id = {alias}.author_id), "
+            "(SELECT title FROM {group} WHERE id = {alias}.group_id)").format(alias=alias, **_tables())
+
+
+def _statements():
+    return [statement.format(**_tables()) for statement in (
+        "CREATE VIRTUAL TABLE IF NOT EXISTS {search} USING fts5(text, username, group_title)",
+        "CREATE TRIGGER IF NOT EXISTS {search}_insert AFTER INSERT ON {post} BEGIN "
+        "INSERT INTO {search}(rowid, text, username, group_title) SELECT " + _row("new") + "; END",
+        "CREATE TRIGGER IF NOT EXISTS {search}_update AFTER UPDATE OF text, author_id, group_id ON {post} BEGIN "
+        "DELETE FROM {search} WHERE rowid = old.id; "
+        "INSERT INTO {search}(rowid, text, username, group_title) SELECT " + _row("new") + "; END",
+        "CREATE TRIGGER IF NOT EXISTS {search}_delete AFTER DELETE ON {post} BEGIN "
+        "DELETE FROM {search} WHERE rowid = old.id; END",
+        "CREATE TRIGGER IF NOT EXISTS {search}_username AFTER UPDATE OF username ON {user} BEGIN "
+        "UPDATE {search} SET username = new.username "
+        "WHERE rowid IN (SELECT id FROM {post} WHERE author_id = new.id); END",
+        "CREATE TRIGGER IF NOT EXISTS {search}_group AFTER UPDATE OF title ON {group} BEGIN "
+        "UPDATE {search} SET group_title = new.title "
+        "WHERE rowid IN (SELECT id FROM {post} WHERE group_id = new.id); END",
+    )]
+
+
+def available(using="default"):
+    return connections[using].vendor == "sqlite"
+
+
+def install(using="default", after_id=0):
+    """Создаёт таблицу индекса и недостающие триггеры; повторный вызов безопасен.
+    Без триггера вставки посты с id > after_id дописываются в индекс"""
+    if not available(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE name IN (%s, %s)", [TABLE, f"{TABLE}_insert"])
+        restored = {name for name, in cursor.fetchall()} == {TABLE}
+        for statement in _statements():
+            cursor.execute(statement)
+    if restored:
+        index_missing(after_id, using)
+
+
+def rebuild(using="default"):
+    """Заполняет индекс заново из таблицы постов, возвращает число записей"""
+    install(using)
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLE}")
+        cursor.execute(f"INSERT INTO {TABLE}(rowid, text, username, group_title) "
+                       f"SELECT {_row('p')} FROM {Post._meta.db_table} p")
+        cursor.execute(f"INSERT INTO {TABLE}({TABLE}) VALUES ('optimize')")
+        cursor.execute(f"SELECT count(*) FROM {TABLE}")
+        return cursor.fetchone()[0]
+
+
+def index_missing(after_id=0, using="default"):
+    """Дописывает в индекс посты с id > after_id, которых в нём нет; возвращает их число"""
+    if not available(using):
+        return 0
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"INSERT INTO {TABLE}(rowid, text, username, group_title) "
+                       f"SELECT {_row('p')} FROM {Post._meta.db_table} p WHERE p.id > %s "
+                       f"AND NOT EXISTS (SELECT 1 FROM {TABLE} WHERE rowid = p.id)", [after_id])
+        return cursor.rowcount
+
+
+@contextmanager
+def insert_trigger_suspended(after_id=0, using="default"):
+    """Массовая вставка постов без построчного триггера индекса.
+
+    Триггер делает вставку в FTS5 на каждую строку и замедляет импорт в
+    несколько раз. На выходе, в том числе по ошибке, триггер возвращается,
+    а посты с id > after_id - и импортированные, и опубликованные на сайте
+    за это время - дописываются в индекс одним index_missing(). Триггер,
+    потерянный прежним прерванным импортом, возвращается на входе.
+    """
+    if not available(using):
+        yield
+        return
+    install(using)
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"DROP TRIGGER IF EXISTS {TABLE}_insert")
+    try:
+        yield
+    finally:
+        install(using, after_id)
+
+
+def match_expression(query):
+    """Запрос пользователя -> выражение MATCH: все слова, каждое как префикс.
+
+    Синтаксис FTS5 (кавычки, NEAR, OR) из ввода не пропускаем.
+    """
+    words = _WORDS.findall(query.lower())
+    return " ".join(f'"{word}"*' for word in words) or None
+
+
+def filter_posts(queryset, query):
+    """Посты queryset, подходящие под запрос, без ранжирования: подзапрос к индексу"""
+    expression = match_expression(query)
+    if expression is None:
+        return queryset.none()
+    return queryset.filter(pk__in=RawSQL(f"SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s", [expression]))
+
+
+def encode_cursor(score, pk):
+    raw = f"{score!r}|{pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode()
+        score, pk = raw.split("|")
+        return float(score), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def find(query, after=None, before=None, limit=POSTS_PER_PAGE, using="default"):
+    """[(bm25, id поста), ...] по возрастанию bm25 (лучшие первыми)"""
+    expression = match_expression(query)
+    if expression is None:
+        return []
+    sql = (f"SELECT id, score FROM (SELECT rowid AS id, bm25({TABLE}, %s, %s, %s) AS score "
+           f"FROM {TABLE} WHERE {TABLE} MATCH %s)")
+    params = [*WEIGHTS, expression]
+    if before is not None:
+        sql += " WHERE score < %s OR (score = %s AND id < %s) ORDER BY score DESC, id DESC"
+        params += [before[0], before[0], before[1]]
+    else:
+        if after is not None:
+            sql += " WHERE score > %s OR (score = %s AND id > %s)"
+            params += [after[0], after[0], after[1]]
+        sql += " ORDER BY score, id"
+    sql += " LIMIT %s"
+    with connections[using].cursor() as cursor:
+        cursor.execute(sql, params + [limit])
+        rows = [(score, pk) for pk, score in cursor.fetchall()]
+    if before is not None:
+        rows.reverse()
+    return rows
+
+
+def paginate(request, query, per_page=POSTS_PER_PAGE):
+    """Страница выдачи в том же виде, что posts.pagination.paginate"""
+    after = decode_cursor(request.GET.get("after"))
+    before = decode_cursor(request.GET.get("before"))
+    rows = find(query, after, before, per_page + 1)
+    has_more = len(rows) > per_page
+    if before is not None:
+        rows = rows[-per_page:]
+        has_next, has_previous = True, has_more
+    else:
+        rows = rows[:per_page]
+        has_next, has_previous = has_more, after is not None
+    by_id = Post.objects.for_feed().in_bulk([pk for _, pk in rows])
+    posts = [by_id[pk] for _, pk in rows if pk in by_id]
+
+    paginator = Paginator(Post.objects.none(), per_page)
+    page = Page(posts, 1, paginator)
+    page.next_cursor = encode_cursor(*rows[-1]) if has_next and rows else None
+    page.previous_cursor = encode_cursor(*rows[0]) if has_previous and rows else None
+    return paginator, page
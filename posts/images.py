@@ -0,0 +1,64 @@
+"""Приём изображений постов с ограниченной памятью.
+
+Загрузка пишется во временный файл (TemporaryFileUploadHandler), а не в
+память. Pillow открывает её в режиме draft: JPEG сразу декодируется в
+уменьшенном масштабе, близком к IMAGE_MAX_SIDE. Затем изображение
+уменьшается до IMAGE_MAX_SIDE по большей стороне и перекодируется без
+метаданных (EXIF, ICC), поэтому sorl и читатели получают уже небольшой
+файл. Одновременно в процессе декодируется не больше
+IMAGE_INGEST_CONCURRENCY изображений: пик памяти ограничен их числом,
+умноженным на IMAGE_MAX_PIXELS.
+"""
+import os
+import tempfile
+import threading
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from PIL import Image, ImageOps
+
+Ingested = namedtuple("Ingested", "file width height")
+
+_slots = None
+_slots_lock = threading.Lock()
+
+
+def _semaphore():
+    global _slots
+    with _slots_lock:
+        if _slots is None:
+            _slots = threading.BoundedSemaphore(settings.IMAGE_INGEST_CONCURRENCY)
+        return _slots
+
+
+def _has_alpha(image):
+    return image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+
+
+def ingest(upload):
+    """Уменьшенная копия загрузки без метаданных: PNG, если есть прозрачность, иначе JPEG"""
+    max_side = settings.IMAGE_MAX_SIDE
+    with _semaphore():
+        upload.seek(0)
+        with Image.open(upload) as source:
+            source.draft("RGB", (max_side, max_side))
+            if source.width * source.height > settings.IMAGE_MAX_PIXELS:
+                raise ValidationError("Изображение слишком большое", code="image_too_large")
+            image = ImageOps.exif_transpose(source)
+            alpha = _has_alpha(image)
+            image = image.convert("RGBA" if alpha else "RGB")
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        # convert() копирует info, а PNG берёт оттуда ICC-профиль
+        image.info = {}
+        output = tempfile.TemporaryFile()
+        if alpha:
+            image.save(output, "PNG", optimize=True)
+        else:
+            image.save(output, "JPEG", quality=settings.IMAGE_JPEG_QUALITY, optimize=True, progressive=True)
+        width, height = image.size
+        image.close()
+    output.seek(0)
+    stem = os.path.splitext(os.path.basename(upload.name))[0]
+    return Ingested(File(output, name=stem + (".png" if alpha else ".jpg")), width, height)
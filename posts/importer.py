@@ -0,0 +1,248 @@
+"""Потоковый импорт пользователей, групп, постов, подписок и комментариев.
+
+Каждый вид записей читается из своего файла JSONL или CSV (можно .gz)
+построчно и пишется пачками, каждая пачка - в своей транзакции. В
+памяти держится только текущая пачка кортежей.
+
+Пачка вставляется одним подготовленным INSERT через executemany, а не
+bulk_create: bulk_create создаёт экземпляр модели на строку и заново
+собирает многострочный INSERT на каждые ~100 строк (лимит параметров
+SQLite), и на этом уходит больше времени, чем на саму запись.
+Значения готовятся теми же методами бэкенда, что и в ORM.
+
+Внешние id переводятся во внутренние сдвигом: id = внешний id + offset,
+где offset - наибольший id таблицы перед импортом этого вида. Такая
+карта id занимает одно число на вид и сразу даёт первичные ключи для
+ссылок из следующих видов. Ссылки на вид, который не импортировался с
+этим файлом состояния, считаются id существующих строк.
+
+Файл состояния хранит сдвиги и число уже записанных строк каждого вида
+и перезаписывается после каждой пачки, поэтому прерванный импорт можно
+продолжить. Первая пачка после продолжения вставляется с пропуском
+конфликтов: она могла успеть записаться до сбоя.
+
+Сигналы при такой записи не срабатывают: счётчики профилей, ленты
+подписок и кеш лент пересчитываются один раз в конце (finish). Триггер
+поискового индекса на время вставки постов снимается, новые посты
+попадают в индекс одним запросом там же.
+"""
+import csv
+import gzip
+import io
+import json
+import os
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import cache, follows, fulltext, stats, timeline
+from .models import Comment, Follow, Group, Post, User
+
+# порядок важен: каждый вид ссылается только на предыдущие
+KINDS = ("users", "groups", "posts", "follows", "comments")
+# модель и колонки, в порядке которых строятся кортежи строк
+TABLES = {
+    "users": (User, ("id", "username", "email", "first_name", "last_name", "password",
+                     "date_joined", "is_superuser", "is_staff", "is_active")),
+    "groups": (Group, ("id", "title", "slug", "description")),
+    "posts": (Post, ("id", "text", "author_id", "group_id", "image", "pub_date", "version")),
+    "follows": (Follow, ("user_id", "author_id")),
+    "comments": (Comment, ("id", "post_id", "author_id", "text", "created")),
+}
+FORMATS = ("jsonl", "csv")
+# строк в одной транзакции
+BATCH_SIZE = 20000
+# кеш страниц SQLite на время импорта, КиБ: вставки в индексы идут в случайные места
+SQLITE_CACHE_KIB = 65536
+
+
+class InvalidRecord(ValueError):
+    """Строка или файл, которые нельзя импортировать"""
+
+
+def open_rows(path, fmt=None):
+    """Словари строк файла JSONL или CSV; формат по расширению, .gz распаковывается"""
+    name = path[:-3] if path.endswith(".gz") else path
+    fmt = fmt or os.path.splitext(name)[1].lstrip(".").lower()
+    if fmt not in FORMATS:
+        raise InvalidRecord(f"{path}: неизвестный формат, ожидается один из {', '.join(FORMATS)}")
+    binary = gzip.open(path) if path.endswith(".gz") else open(path, "rb")
+    stream = io.TextIOWrapper(binary, encoding="utf-8", newline="")
+    if fmt == "csv":
+        return stream, csv.DictReader(stream)
+    return stream, (json.loads(line) for line in stream if line.strip())
+
+
+def insert_sql(kind, ignore_conflicts=False):
+    model, columns = TABLES[kind]
+    quote = connection.ops.quote_name
+    return "{} {} ({}) VALUES ({}) {}".format(
+        connection.ops.insert_statement(ignore_conflicts=ignore_conflicts),
+        quote(model._meta.db_table),
+        ", ".join(quote(column) for column in columns),
+        ", ".join(["%s"] * len(columns)),
+        connection.ops.ignore_conflicts_suffix_sql(ignore_conflicts=ignore_conflicts),
+    )
+
+
+@contextmanager
+def sqlite_cache(kib=SQLITE_CACHE_KIB):
+    if connection.vendor != "sqlite":
+        yield
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA cache_size")
+        previous = cursor.fetchone()[0]
+        cursor.execute(f"PRAGMA cache_size = -{int(kib)}")
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute(f"PRAGMA cache_size = {int(previous)}")
+
+
+class Importer:
+    def __init__(self, state_path=None, batch_size=BATCH_SIZE, progress=None):
+        self.state_path = state_path
+        self.batch_size = batch_size
+        self.progress = progress or (lambda kind, done, rate: None)
+        self.state = {"offsets": {}, "done": {}}
+        if state_path and os.path.exists(state_path):
+            with open(state_path) as saved:
+                self.state = json.load(saved)
+        self.now = connection.ops.adapt_datetimefield_value(timezone.now())
+        self.password = make_password(None)
+
+    def _save_state(self):
+        if not self.state_path:
+            return
+        temp_path = self.state_path + ".tmp"
+        with open(temp_path, "w") as temp:
+            json.dump(self.state, temp)
+        os.replace(temp_path, self.state_path)
+
+    def _id(self, kind, value):
+        return int(value) + self.state["offsets"].get(kind, 0)
+
+    def _optional_id(self, kind, value):
+        return self._id(kind, value) if value not in (None, "") else None
+
+    def _date(self, value):
+        if not value:
+            return self.now
+        try:
+            # fromisoformat в разы быстрее регулярного выражения parse_datetime
+            parsed = datetime.fromisoformat(value)
+        except ValueError:
+            parsed = parse_datetime(value)
+        if parsed is None:
+            raise InvalidRecord(f"некорректная дата: {value!r}")
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed, timezone.utc)
+        return connection.ops.adapt_datetimefield_value(parsed)
+
+    def _build_users(self, row):
+        return (self._id("users", row["id"]), row["username"], row.get("email") or "",
+                row.get("first_name") or "", row.get("last_name") or "",
+                row.get("password") or self.password, self._date(row.get("date_joined")),
+                False, False, True)
+
+    def _build_groups(self, row):
+        return (self._id("groups", row["id"]), row["title"], row["slug"], row.get("description") or "")
+
+    def _build_posts(self, row):
+        return (self._id("posts", row["id"]), row["text"], self._id("users", row["author"]),
+                self._optional_id("groups", row.get("group")), row.get("image") or None,
+                self._date(row.get("pub_date")), 1)
+
+    def _build_follows(self, row):
+        return (self._id("users", row["user"]), self._id("users", row["author"]))
+
+    def _build_comments(self, row):
+        return (self._id("comments", row["id"]), self._id("posts", row["post"]),
+                self._id("users", row["author"]), row["text"], self._date(row.get("created")))
+
+    def _check_unique(self, kind, rows):
+        # существующие имена и slug дали бы IntegrityError посреди пачки без подсказки
+        if kind == "users":
+            field, values = "username", [row[1] for row in rows]
+        elif kind == "groups":
+            field, values = "slug", [row[2] for row in rows]
+        else:
+            return
+        taken = list(TABLES[kind][0].objects.exclude(pk__in=[row[0] for row in rows])
+                     .filter(**{f"{field}__in": values}).values_list(field, flat=True)[:5])
+        if taken:
+            raise InvalidRecord(f"{kind}: {field} уже заняты: {', '.join(taken)}")
+
+    def _write(self, kind, rows, resumed):
+        with transaction.atomic(), connection.cursor() as cursor:
+            self._check_unique(kind, rows)
+            # подписки идемпотентны за счёт unique_follow, повторы в файле пропускаются
+            cursor.executemany(insert_sql(kind, ignore_conflicts=resumed or kind == "follows"), rows)
+
+    def run(self, kind, rows):
+        """Импорт строк одного вида, возвращает число записанных за этот вызов"""
+        if kind not in KINDS:
+            raise InvalidRecord(f"неизвестный вид записей: {kind}")
+        resumed = kind in self.state["offsets"]
+        if not resumed:
+            # у подписок id не импортируются: запись только отмечает начатый вид
+            last = TABLES[kind][0].objects.order_by("-pk").values_list("pk", flat=True).first()
+            self.state["offsets"][kind] = last or 0
+            self.state["done"][kind] = 0
+            self._save_state()
+        skip = self.state["done"][kind]
+        build = getattr(self, f"_build_{kind}")
+        started = time.monotonic()
+        written = 0
+        # триггер поиска вернётся и допишет индекс за offset, даже если пачка упадёт
+        search = fulltext.insert_trigger_suspended(self.state["offsets"][kind]) if kind == "posts" else nullcontext()
+        with sqlite_cache(), search:
+            for batch in self._batches(kind, rows, build, skip):
+                self._write(kind, batch, resumed=resumed and written == 0)
+                written += len(batch)
+                self.state["done"][kind] = skip + written
+                self._save_state()
+                self.progress(kind, skip + written, written / max(time.monotonic() - started, 1e-9))
+        return written
+
+    def _batches(self, kind, rows, build, skip):
+        batch = []
+        for number, row in enumerate(rows):
+            if number < skip:
+                continue
+            try:
+                batch.append(build(row))
+            except (KeyError, TypeError, ValueError) as error:
+                raise InvalidRecord(f"{kind}, строка {number + 1}: {error!r}") from error
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def finish(self):
+        """Производные данные, которые при обычном сохранении ведут сигналы"""
+        self._reset_sequences()
+        if "posts" in self.state["offsets"]:
+            fulltext.index_missing(self.state["offsets"]["posts"])
+        stats.recount()
+        with transaction.atomic():
+            timeline.rebuild()
+        cache.bump(cache.INDEX)
+        follows.reset()
+
+    def _reset_sequences(self):
+        # в PostgreSQL явные id не двигают последовательность
+        statements = connection.ops.sequence_reset_sql(no_style(), [model for model, _ in TABLES.values()])
+        if statements:
+            with connection.cursor() as cursor:
+                for statement in statements:
+                    cursor.execute(statement)
@@ -0,0 +1,120 @@
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections, migrations
+from django.db.migrations.loader import MigrationLoader
+from django.db.models import Count, Q
+
+from posts.models import Comment, Follow, Post, TimelineEntry
+from posts.pagination import POSTS_PER_PAGE
+from posts.seed import seed, temporary_database
+
+# миграция, которая добавила составные индексы лент
+FEED_INDEXES_MIGRATION = "0009_feed_indexes"
+
+
+def drop_feed_indexes(connection):
+    """Убирает из полной схемы индексы и ограничения миграции с индексами лент.
+
+    Откат миграций до неё снёс бы и более поздние поля, без которых модели не работают.
+    """
+    loader = MigrationLoader(connection)
+    state = loader.project_state()
+    operations = []
+    for operation in loader.get_migration("posts", FEED_INDEXES_MIGRATION).operations:
+        if isinstance(operation, migrations.AddIndex):
+            operations.append(migrations.RemoveIndex(operation.model_name, operation.index.name))
+        elif isinstance(operation, migrations.AddConstraint):
+            operations.append(migrations.RemoveConstraint(operation.model_name, operation.constraint.name))
+    with connection.schema_editor() as editor:
+        for operation in operations:
+            new_state = state.clone()
+            operation.state_forwards("posts", new_state)
+            operation.database_forwards("posts", editor, state, new_state)
+            state = new_state
+
+
+def _page(queryset):
+    return queryset.order_by("-pub_date", "-pk")[:POSTS_PER_PAGE + 1]
+
+
+def view_queries(using):
+    """Запросы, которые выполняют представления posts, на данных базы using"""
+    posts = Post.objects.using(using).for_feed()
+    reader = (Follow.objects.using(using).values("user").annotate(total=Count("id"))
+              .order_by("-total").values_list("user", flat=True).first())
+    author = (Post.objects.using(using).values("author").annotate(total=Count("id"))
+              .order_by("-total").values_list("author", flat=True).first())
+    group = Post.objects.using(using).exclude(group=None).values_list("group", flat=True).first()
+    middle = Post.objects.using(using).order_by("-pub_date", "-pk")[Post.objects.using(using).count() // 2]
+    return [
+        ("index", _page(posts)),
+        ("index, страница из середины", _page(posts.filter(
+            Q(pub_date__lte=middle.pub_date), Q(pub_date__lt=middle.pub_date) | Q(pk__lt=middle.pk)))),
+        ("group_posts", _page(posts.filter(group_id=group))),
+        ("profile", _page(posts.filter(author_id=author))),
+        ("profile, подписан ли", Follow.objects.using(using).filter(author_id=author, user_id=reader)),
+        ("follow_index", TimelineEntry.objects.using(using).filter(user_id=reader)
+            .order_by("-pub_date", "-post_id").values_list("post_id", flat=True)[:POSTS_PER_PAGE + 1]),
+        ("post_view, комментарии", Comment.objects.using(using).filter(post_id=middle.pk)),
+    ]
+
+
+class Command(BaseCommand):
+    help = ("Наполняет две временные базы SQLite одинаковыми данными, до и после "
+            "составных индексов лент, и печатает EXPLAIN QUERY PLAN и время запросов представлений")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=2000)
+        parser.add_argument("--posts", type=int, default=100000)
+        parser.add_argument("--follows", type=int, default=20, help="подписок на пользователя")
+        parser.add_argument("--comments", type=int, default=20000)
+        parser.add_argument("--repeat", type=int, default=20, help="повторов каждого запроса")
+
+    def handle(self, *args, **options):
+        workdir = tempfile.mkdtemp(prefix="yatube-bench-")
+        try:
+            results = {}
+            for phase in ("before", "after"):
+                results[phase] = self.run_phase(phase, os.path.join(workdir, f"{phase}.sqlite3"), options)
+            self.stdout.write(self.style.MIGRATE_HEADING("Итог, медиана, мс"))
+            for name, (before, _) in results["before"].items():
+                after = results["after"][name][0]
+                self.stdout.write(f"{name:32} {before:9.3f} -> {after:9.3f}  x{before / max(after, 1e-6):.1f}")
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def run_phase(self, phase, path, options):
+        alias = f"bench_{phase}"
+        with temporary_database(alias, path) as connection:
+            if phase == "before":
+                drop_feed_indexes(connection)
+            seed(users=options["users"], posts=options["posts"], follows=options["follows"],
+                 comments=options["comments"], using=alias)
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE")
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                "До индексов" if phase == "before" else "После индексов"))
+            return {name: self.measure(alias, name, queryset, options["repeat"])
+                    for name, queryset in view_queries(alias)}
+
+    def measure(self, alias, name, queryset, repeat):
+        sql, params = queryset.query.sql_with_params()
+        with connections[alias].cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            plan = [row[-1] for row in cursor.fetchall()]
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                cursor.execute(sql, params)
+                cursor.fetchall()
+                timings.append((time.perf_counter() - start) * 1000)
+        median = statistics.median(timings)
+        self.stdout.write(f"{name}: {median:.3f} мс")
+        for line in plan:
+            self.stdout.write(f"    {line}")
+        return median, plan
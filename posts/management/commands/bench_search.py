@@ -0,0 +1,57 @@
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts import fulltext
+from posts.models import Post
+from posts.pagination import POSTS_PER_PAGE
+from posts.seed import VOCABULARY, seed, temporary_database
+
+ALIAS = "bench_search"
+
+
+class Command(BaseCommand):
+    help = ("Наполняет временную базу SQLite синтетическими постами и сравнивает "
+            "первую страницу поиска через LIKE '%...%' и через FTS5")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--posts", type=int, default=1000000)
+        parser.add_argument("--repeat", type=int, default=5, help="повторов каждого запроса")
+
+    def handle(self, *args, **options):
+        workdir = tempfile.mkdtemp(prefix="yatube-bench-")
+        try:
+            with temporary_database(ALIAS, os.path.join(workdir, "search.sqlite3")) as connection:
+                seed(users=options["users"], posts=options["posts"], follows=0, using=ALIAS)
+                with connection.cursor() as cursor:
+                    cursor.execute("ANALYZE")
+                self.stdout.write(self.style.MIGRATE_HEADING(
+                    f"Постов: {options['posts']}, медиана из {options['repeat']}, мс"))
+                # частое, среднее и редкое слово словаря и слово, которого нет
+                for word in (VOCABULARY[0], VOCABULARY[len(VOCABULARY) // 50], VOCABULARY[-1], "отсутствует"):
+                    self.compare(word, options["repeat"])
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def compare(self, word, repeat):
+        like = (Post.objects.using(ALIAS).filter(text__icontains=word)
+                .order_by("-pub_date", "-pk").values_list("pk", flat=True)[:POSTS_PER_PAGE + 1])
+        like_time, like_found = self.measure(lambda: list(like.all()), repeat)
+        fts_time, fts_found = self.measure(
+            lambda: fulltext.find(word, limit=POSTS_PER_PAGE + 1, using=ALIAS), repeat)
+        self.stdout.write(f"{word:14} LIKE {like_time:10.3f} ({len(like_found)})"
+                          f"   FTS5 {fts_time:8.3f} ({len(fts_found)})"
+                          f"   x{like_time / max(fts_time, 1e-6):.1f}")
+
+    def measure(self, query, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = query()
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings), result
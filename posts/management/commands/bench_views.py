@@ -0,0 +1,143 @@
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from django.test import Client
+from django.urls import resolve, reverse
+
+from posts import urls
+from posts.models import Follow, Group, Post, User
+from yatube.querybudget import QueryRecorder, budget_for
+
+# кем открывать страницы: аноним видит публичный кеш, читатель - свои ленты;
+# форму правки и выгрузку видит только автор
+ROLES = ("anonymous", "reader")
+EXTRA_ROLES = {"post_edit": ("author",), "profile_export": ("author",)}
+PERCENTILES = (50, 95, 99)
+
+
+def percentiles(timings):
+    cuts = statistics.quantiles(timings, n=100, method="inclusive") if len(timings) > 1 else timings * 99
+    return {f"p{p}": round(cuts[p - 1], 3) for p in PERCENTILES}
+
+
+def response_size(response):
+    if response.streaming:
+        return sum(len(chunk) for chunk in response.streaming_content)
+    return len(response.content)
+
+
+class Command(BaseCommand):
+    help = ("Прогоняет все адреса posts/urls.py через тестовый клиент на данных базы по умолчанию "
+            "(см. seed_load) и пишет в JSON задержки p50/p95/p99, число запросов и размер ответа")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repeat", type=int, default=20, help="замеров на адрес и роль")
+        parser.add_argument("--output", default="bench_views.json", help="куда записать результат")
+        parser.add_argument("--compare", metavar="JSON", help="результат прошлого прогона для сравнения")
+
+    def handle(self, *args, repeat, output, compare, **options):
+        samples = self.samples()
+        results = {}
+        # у каждого запроса своя транзакция, как в бою: фиксация и работа после
+        # неё (on_commit) входят в замер. Из данных прогон меняет только подписку
+        # читателя на автора, в конце она возвращается как была
+        following = self.follow(samples).exists()
+        clients = self.clients(samples)
+        try:
+            for pattern in urls.urlpatterns:
+                url = reverse(pattern.name, kwargs={name: samples[name] for name in pattern.pattern.converters})
+                if pattern.name == "search":
+                    url += f"?q={samples['word']}"
+                for role in ROLES + EXTRA_ROLES.get(pattern.name, ()):
+                    key = f"{pattern.name}[{role}]"
+                    results[key] = self.measure(clients[role], url, repeat)
+                    self.stdout.write(self.line(key, results[key]))
+        finally:
+            for client in clients.values():
+                client.logout()
+            self.restore_following(samples, following)
+        report = {"repeat": repeat, "rows": self.rows(), "views": results}
+        with open(output, "w") as saved:
+            json.dump(report, saved, ensure_ascii=False, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Результат: {output}"))
+        if compare:
+            self.compare(compare, results)
+
+    def samples(self):
+        """Самые нагруженные объекты: автор с наибольшим числом постов, его пост с
+        наибольшим числом комментариев, крупнейшая группа, самый подписанный читатель"""
+        author = (User.objects.annotate(total=Count("author_posts")).order_by("-total").first())
+        post = (Post.objects.filter(author=author).annotate(total=Count("comments"))
+                .order_by("-total", "-pk").first())
+        group = Group.objects.annotate(total=Count("post")).order_by("-total").first()
+        reader_id = (Follow.objects.values("user").annotate(total=Count("id"))
+                     .order_by("-total").values_list("user", flat=True).first())
+        if post is None or group is None or reader_id is None:
+            raise CommandError("В базе нет данных для замера, сначала выполните seed_load")
+        return {"username": author.username, "post_id": post.pk, "slug": group.slug,
+                "author": author, "reader": User.objects.get(pk=reader_id),
+                "word": post.text.split()[-1]}
+
+    def follow(self, samples):
+        return Follow.objects.filter(user=samples["reader"], author=samples["author"])
+
+    def restore_following(self, samples, following):
+        # через модель, а не откатом: сигналы поправят ленты, счётчики и кеши
+        if following and not self.follow(samples).exists():
+            Follow.objects.create(user=samples["reader"], author=samples["author"])
+        elif not following:
+            self.follow(samples).delete()
+
+    def clients(self, samples):
+        clients = {"anonymous": Client()}
+        for role in ("reader", "author"):
+            clients[role] = Client()
+            clients[role].force_login(samples[role])
+        return clients
+
+    def measure(self, client, url, repeat):
+        timings, queries = [], []
+        response = None
+        for _ in range(repeat + 1):
+            with QueryRecorder() as recorder:
+                start = time.perf_counter()
+                response = client.get(url)
+                size = response_size(response)
+                timings.append((time.perf_counter() - start) * 1000)
+            queries.append(len(recorder))
+        # первый запрос - с холодным кешем, он идёт отдельно
+        return {
+            "url": url,
+            "status": response.status_code,
+            "first_ms": round(timings[0], 3),
+            **percentiles(timings[1:]),
+            "queries": statistics.median(queries[1:]),
+            "first_queries": queries[0],
+            "budget": budget_for(resolve(url.split("?")[0]).func),
+            "bytes": size,
+        }
+
+    def line(self, key, result):
+        return (f"{key:32} {result['status']}  p50 {result['p50']:8.2f}  p95 {result['p95']:8.2f}  "
+                f"p99 {result['p99']:8.2f} мс  запросов {result['queries']:g}/{result['budget']}  "
+                f"{result['bytes']} байт")
+
+    def rows(self):
+        return {model.__name__: model.objects.count() for model in (User, Group, Post, Follow)}
+
+    def compare(self, path, results):
+        with open(path) as saved:
+            previous = json.load(saved)["views"]
+        self.stdout.write(self.style.MIGRATE_HEADING(f"Сравнение с {path}"))
+        for key, result in results.items():
+            before = previous.get(key)
+            if before is None:
+                continue
+            self.stdout.write(
+                f"{key:32} p50 {before['p50']:8.2f} -> {result['p50']:8.2f}  "
+                f"p95 {before['p95']:8.2f} -> {result['p95']:8.2f}  "
+                f"запросов {before['queries']:g} -> {result['queries']:g}  "
+                f"байт {before['bytes']} -> {result['bytes']}")
@@ -0,0 +1,59 @@
+import os
+
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+from sorl.thumbnail import delete as delete_thumbnails
+
+from posts import cache
+from posts.models import Post
+from posts.storage import HASHED_NAME, content_hash, hashed_name
+
+
+class Command(BaseCommand):
+    help = ("Переименовывает изображения постов в media/posts/ по хешу содержимого: "
+            "дубликаты сливаются в один файл, посты переводятся на него")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="только показать, что будет сделано")
+
+    def handle(self, *args, dry_run, **options):
+        storage = Post._meta.get_field("image").storage
+        root = storage.path("posts")
+        moved = merged = freed = 0
+        for directory, _, filenames in os.walk(root):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, storage.location).replace(os.sep, "/")
+                if filename.startswith(".") or HASHED_NAME.search(name):
+                    continue
+                with open(path, "rb") as content:
+                    target = hashed_name(name, content_hash(File(content)))
+                duplicate = storage.exists(target)
+                self.stdout.write(f"{name} -> {target}{' (дубликат)' if duplicate else ''}")
+                if dry_run:
+                    continue
+                if duplicate:
+                    freed += os.path.getsize(path)
+                    merged += 1
+                else:
+                    # жёсткая ссылка: пока посты переводятся, работают оба имени
+                    os.makedirs(os.path.dirname(storage.path(target)), exist_ok=True)
+                    os.link(path, storage.path(target))
+                    moved += 1
+                self.repoint(name, target)
+                delete_thumbnails(name, delete_file=False)
+                os.remove(path)
+        self.stdout.write(self.style.SUCCESS(
+            f"Переименовано: {moved}, слито дубликатов: {merged}, освобождено байт: {freed}"))
+
+    @transaction.atomic
+    def repoint(self, name, target):
+        posts = Post.objects.filter(image=name)
+        feeds = set()
+        for author_id, group_id in posts.values_list("author_id", "group_id"):
+            feeds.update(cache.post_feeds(Post(author_id=author_id, group_id=group_id)))
+        # update() без сигналов: версию для кеша карточек поднимаем сами
+        posts.update(image=target, version=F("version") + 1)
+        cache.bump(*feeds)
@@ -0,0 +1,35 @@
+import gzip
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import export
+from posts.models import User
+
+
+class Command(BaseCommand):
+    help = ("Выгружает посты пользователя с группами, ссылками на изображения и комментариями "
+            "в JSON Lines или CSV потоком; файл .gz сжимается")
+
+    def add_arguments(self, parser):
+        parser.add_argument("username")
+        parser.add_argument("--format", choices=sorted(export.FORMATS), default="jsonl")
+        parser.add_argument("--output", metavar="FILE", help="файл выгрузки, по умолчанию stdout")
+        parser.add_argument("--base-url", default="", help="адрес сайта для полных ссылок на изображения")
+
+    def handle(self, *args, username, format, output, base_url, **options):
+        try:
+            author = User.objects.get(username=username)
+        except User.DoesNotExist:
+            raise CommandError(f"Нет пользователя {username}")
+        if output is None:
+            target = self.stdout
+        elif output.endswith(".gz"):
+            target = gzip.open(output, "wt", encoding="utf-8", newline="")
+        else:
+            target = open(output, "w", encoding="utf-8", newline="")
+        try:
+            for line in export.lines(author, format, lambda url: base_url.rstrip("/") + url):
+                target.write(line)
+        finally:
+            if output is not None:
+                target.close()
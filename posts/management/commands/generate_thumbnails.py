@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from posts import thumbnails
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = "Делает недостающие миниатюры изображений постов, например для постов до пула миниатюр"
+
+    def handle(self, *args, **options):
+        names = (Post.objects.exclude(image="").exclude(image=None)
+                 .order_by().values_list("image", flat=True).distinct())
+        made = 0
+        for name in names.iterator():
+            if not thumbnails.complete(name):
+                thumbnails.generate(name)
+                made += 1
+        self.stdout.write(self.style.SUCCESS(f"Сделано миниатюр: {made}"))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+
+from posts.importer import BATCH_SIZE, FORMATS, KINDS, Importer, InvalidRecord, open_rows
+
+
+class Command(BaseCommand):
+    help = ("Импортирует пользователей, группы, посты, подписки и комментарии из файлов "
+            "JSONL или CSV (можно .gz) пачками через executemany; с --state прерванный импорт продолжается")
+
+    def add_arguments(self, parser):
+        for kind in KINDS:
+            parser.add_argument(f"--{kind}", metavar="FILE", help=f"файл с записями {kind}")
+        parser.add_argument("--format", choices=FORMATS, help="формат файлов, если расширение другое")
+        parser.add_argument("--state", metavar="FILE", help="файл состояния для продолжения импорта")
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="строк в одной транзакции")
+
+    def handle(self, *args, state, batch_size, **options):
+        paths = [(kind, options[kind]) for kind in KINDS if options[kind]]
+        if not paths:
+            raise CommandError(f"Укажите хотя бы один файл: {', '.join('--' + kind for kind in KINDS)}")
+        importer = Importer(state, batch_size, progress=self.report)
+        try:
+            for kind, path in paths:
+                stream, rows = open_rows(path, options["format"])
+                with stream:
+                    written = importer.run(kind, rows)
+                self.stdout.write(f"{kind}: записано {written}")
+            importer.finish()
+        except (InvalidRecord, IntegrityError, OSError) as error:
+            # пачка с ошибкой откатилась целиком, --state продолжит с неё
+            raise CommandError(error)
+        self.stdout.write(self.style.SUCCESS("Импорт завершён"))
+
+    def report(self, kind, done, rate):
+        self.stdout.write(f"{kind}: {done} строк, {rate:.0f} строк/с")
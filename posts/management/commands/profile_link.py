@@ -0,0 +1,20 @@
+from urllib.parse import urlencode
+
+from django.core.management.base import BaseCommand
+
+from yatube import profiling
+
+
+class Command(BaseCommand):
+    help = ("Печатает ссылку, по которой запрос к пути снимется под профилировщиком; "
+            "действует PROFILE_LINK_MAX_AGE секунд")
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="путь страницы, например /volkov/")
+        parser.add_argument("--mode", choices=profiling.MODES, help="по умолчанию PROFILE_MODE")
+
+    def handle(self, *args, path, mode, **options):
+        query = {profiling.PARAMETER: profiling.sign(path)}
+        if mode:
+            query["_profile_mode"] = mode
+        self.stdout.write(f"{path}?{urlencode(query)}")
@@ -0,0 +1,100 @@
+import io
+import json
+import os
+import pstats
+import statistics
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = ("Сводит профили из PROFILE_DIR: по каждому маршруту - время ответа, SQL и шаблоны, "
+            "затем самые горячие функции по pstats и collapsed stacks")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--view", help="только этот маршрут, например profile или follow_index")
+        parser.add_argument("--top", type=int, default=20)
+        parser.add_argument("--sort", choices=("cumulative", "tottime"), default="cumulative",
+                            help="порядок для pstats")
+        parser.add_argument("--flamegraph", metavar="FILE",
+                            help="записать все collapsed stacks в один файл для flamegraph.pl или speedscope")
+        parser.add_argument("--dir", default=None, help="по умолчанию PROFILE_DIR")
+
+    def handle(self, *args, view, top, sort, flamegraph, dir, **options):
+        root = dir or settings.PROFILE_DIR
+        files = self.files(root, view)
+        if not files:
+            raise CommandError(f"В {root} нет профилей")
+        self.summary(files)
+        prof = [path for path in files if path.endswith(".prof")]
+        collapsed = [path for path in files if path.endswith(".collapsed")]
+        if prof:
+            self.pstats_report(prof, top, sort)
+        if collapsed:
+            stacks = self.merge_stacks(collapsed)
+            self.stacks_report(stacks, top)
+            if flamegraph:
+                with open(flamegraph, "w") as output:
+                    output.writelines(f"{stack} {count}\n" for stack, count in stacks.most_common())
+                self.stdout.write(self.style.SUCCESS(f"Collapsed stacks: {flamegraph}"))
+
+    def files(self, root, view):
+        if not os.path.isdir(root):
+            return []
+        views = [view.replace(":", ".")] if view else sorted(os.listdir(root))
+        return sorted(os.path.join(root, name, filename) for name in views
+                      if os.path.isdir(os.path.join(root, name))
+                      for filename in os.listdir(os.path.join(root, name)))
+
+    def summary(self, files):
+        by_view = defaultdict(list)
+        for path in files:
+            if path.endswith(".json"):
+                with open(path) as meta:
+                    tags = json.load(meta)
+                by_view[tags["view"]].append(tags)
+        self.stdout.write(self.style.MIGRATE_HEADING("Маршруты"))
+        for view, samples in sorted(by_view.items()):
+            def mean(field):
+                values = [sample[field] for sample in samples if sample.get(field) is not None]
+                return statistics.mean(values) if values else 0
+            self.stdout.write(
+                f"{view:24} профилей {len(samples):4}  ответ {mean('seconds') * 1000:8.1f} мс "
+                f"(макс {max(sample['seconds'] for sample in samples) * 1000:.1f})  "
+                f"SQL {mean('queries'):5.1f} запросов {mean('query_seconds') * 1000:7.1f} мс  "
+                f"шаблоны {mean('template_seconds') * 1000:7.1f} мс")
+
+    def pstats_report(self, paths, top, sort):
+        output = io.StringIO()
+        stats = pstats.Stats(paths[0], stream=output)
+        for path in paths[1:]:
+            stats.add(path)
+        stats.sort_stats(sort).print_stats(top)
+        self.stdout.write(self.style.MIGRATE_HEADING(f"cProfile, {len(paths)} профилей, по {sort}"))
+        self.stdout.write(output.getvalue())
+
+    def merge_stacks(self, paths):
+        stacks = Counter()
+        for path in paths:
+            with open(path) as collapsed:
+                for line in collapsed:
+                    stack, _, count = line.rstrip("\n").rpartition(" ")
+                    if stack:
+                        stacks[stack] += int(count)
+        return stacks
+
+    def stacks_report(self, stacks, top):
+        total = sum(stacks.values())
+        own, inclusive = Counter(), Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            # рекурсивная функция считается в стеке один раз
+            for frame in set(frames):
+                inclusive[frame] += count
+        self.stdout.write(self.style.MIGRATE_HEADING(f"Сэмплер, {total} снимков стека"))
+        self.stdout.write(f"{'своё':>7} {'всего':>7}  функция")
+        for frame, count in own.most_common(top):
+            self.stdout.write(f"{count / total:7.1%} {inclusive[frame] / total:7.1%}  {frame}")
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import fulltext
+
+
+class Command(BaseCommand):
+    help = "Заполняет заново полнотекстовый индекс постов (FTS5) и восстанавливает его триггеры"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default="default")
+
+    def handle(self, *args, database, **options):
+        if not fulltext.available(database):
+            raise CommandError("Полнотекстовый индекс есть только в SQLite")
+        total = fulltext.rebuild(database)
+        self.stdout.write(self.style.SUCCESS(f"Проиндексировано постов: {total}"))
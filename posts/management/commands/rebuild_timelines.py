@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import timeline
+
+
+class Command(BaseCommand):
+    help = "Пересобирает материализованные ленты подписок"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user", type=int, action="append", dest="user_ids",
+            help="id пользователя, можно указать несколько раз; по умолчанию все",
+        )
+
+    def handle(self, *args, user_ids=None, **options):
+        with transaction.atomic():
+            total = timeline.rebuild(user_ids)
+        self.stdout.write(self.style.SUCCESS(f"Записей в лентах: {total}"))
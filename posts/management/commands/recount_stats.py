@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from posts import stats
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает счётчики профилей (посты, подписчики, подписки)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=stats.BATCH_SIZE)
+
+    def handle(self, *args, batch_size, **options):
+        fixed = stats.recount(batch_size)
+        self.stdout.write(self.style.SUCCESS(f"Исправлено счётчиков: {fixed}"))
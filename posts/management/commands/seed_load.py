@@ -0,0 +1,40 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from posts import cache, follows, stats
+from posts.seed import seed
+
+
+class Command(BaseCommand):
+    help = ("Наполняет базу по умолчанию синтетической сетью для замеров: подписки и авторство "
+            "по закону Ципфа, посты по группам, комментарии и изображения")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=2000)
+        parser.add_argument("--posts", type=int, default=100000)
+        parser.add_argument("--groups", type=int, default=50)
+        parser.add_argument("--follows", type=int, default=30, help="подписок на пользователя")
+        parser.add_argument("--comments", type=int, default=50000)
+        parser.add_argument("--images", type=int, default=20, help="разных изображений")
+        parser.add_argument("--image-share", type=float, default=0.2, help="доля постов с изображением")
+        parser.add_argument("--uniform", action="store_true", help="равномерные подписки и авторство")
+        parser.add_argument("--seed", type=int, default=0, help="зерно генератора")
+
+    def handle(self, *args, **options):
+        user_ids = seed(users=options["users"], posts=options["posts"], groups=options["groups"],
+                        follows=options["follows"], comments=options["comments"],
+                        random_seed=options["seed"], power_law=not options["uniform"],
+                        images=options["images"], image_share=options["image_share"])
+        # bulk_create обходит сигналы: счётчики и кеш лент обновляем сами
+        stats.recount()
+        cache.bump(cache.INDEX)
+        follows.reset()
+        if options["images"]:
+            call_command("generate_thumbnails", stdout=self.stdout)
+        if connection.vendor == "sqlite":
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE")
+        self.stdout.write(self.style.SUCCESS(
+            f"Создано пользователей: {len(user_ids)}, постов: {options['posts']}, "
+            f"комментариев: {options['comments']}"))
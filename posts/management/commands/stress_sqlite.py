@@ -0,0 +1,141 @@
+import multiprocessing
+import random
+import statistics
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connections, transaction
+from django.test import Client
+from django.urls import reverse
+
+from posts.models import Group, Post, User
+
+PREFIX = "stress_"
+
+
+def run_thread(process, number, plan):
+    """Операции одного потока до истечения plan['seconds']: (вид, секунды, ошибка)"""
+    rnd = random.Random(f"{plan['seed']}-{process}-{number}")
+    client = Client()
+    records = []
+    deadline = time.monotonic() + plan["seconds"]
+    try:
+        while time.monotonic() < deadline:
+            kind = "write" if rnd.random() < plan["write_share"] else "read"
+            error = None
+            start = time.perf_counter()
+            try:
+                if kind == "write":
+                    # как new_post: пост и всё, что делают сигналы, в одной транзакции
+                    with transaction.atomic():
+                        Post.objects.create(text=f"{PREFIX}{process}-{number}", group_id=plan["group"],
+                                            author_id=rnd.choice(plan["authors"]))
+                else:
+                    status = client.get(rnd.choice(plan["urls"])).status_code
+                    if status != 200:
+                        error = f"HTTP {status}"
+            except DatabaseError as exc:
+                error = f"{type(exc).__name__}: {exc}"
+            records.append((kind, time.perf_counter() - start, error))
+    finally:
+        connections.close_all()
+    return records
+
+
+def run_process(task):
+    process, plan = task
+    with ThreadPoolExecutor(plan["threads"]) as pool:
+        threads = pool.map(lambda number: run_thread(process, number, plan), range(plan["threads"]))
+        return [record for records in threads for record in records]
+
+
+class Command(BaseCommand):
+    help = ("Нагрузка на базу по умолчанию: процессы с потоками вперемешку создают посты и читают "
+            "ленты, в конце - задержки и ошибки вроде \"database is locked\". --pragma и "
+            "--transaction-mode позволяют сравнить с другими настройками соединения")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=2)
+        parser.add_argument("--threads", type=int, default=4, help="потоков в каждом процессе")
+        parser.add_argument("--seconds", type=float, default=10)
+        parser.add_argument("--write-share", type=float, default=0.2, help="доля операций записи")
+        parser.add_argument("--authors", type=int, default=5)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--pragma", action="append", default=[], metavar="NAME=VALUE",
+                            help="прагма поверх настроек базы, можно несколько раз")
+        parser.add_argument("--transaction-mode", choices=("DEFERRED", "IMMEDIATE", "EXCLUSIVE"))
+        parser.add_argument("--keep", action="store_true", help="не удалять созданные посты и авторов")
+        parser.add_argument("--fail-on-errors", action="store_true", help="завершиться с ошибкой, если были ошибки")
+
+    def handle(self, *args, **options):
+        if connections["default"].vendor != "sqlite":
+            raise CommandError("Нагрузка рассчитана на SQLite")
+        if options["processes"] < 1 or options["threads"] < 1:
+            raise CommandError("Нужен хотя бы один процесс и один поток")
+        self.configure(options)
+        plan = self.plan(options)
+        # дочерние процессы не должны унаследовать открытые соединения
+        connections.close_all()
+        started = time.monotonic()
+        context = multiprocessing.get_context("fork")
+        with context.Pool(options["processes"]) as pool:
+            records = [record for chunk in pool.map(run_process, [(n, plan) for n in range(options["processes"])])
+                       for record in chunk]
+        elapsed = time.monotonic() - started
+        errors = self.report(records, elapsed)
+        if not options["keep"]:
+            User.objects.filter(username__startswith=PREFIX).delete()
+            Group.objects.filter(slug=f"{PREFIX}group").delete()
+        if errors and options["fail_on_errors"]:
+            raise CommandError(f"Ошибок: {errors}")
+
+    def configure(self, options):
+        settings_dict = connections["default"].settings_dict
+        pragmas = dict(settings_dict["OPTIONS"].get("pragmas", {}))
+        for item in options["pragma"]:
+            name, _, value = item.partition("=")
+            if not value:
+                raise CommandError(f"Прагма задаётся как NAME=VALUE: {item}")
+            pragmas[name.strip().lower()] = value.strip()
+        settings_dict["OPTIONS"] = {**settings_dict["OPTIONS"], "pragmas": pragmas}
+        if options["transaction_mode"]:
+            settings_dict["OPTIONS"]["transaction_mode"] = options["transaction_mode"]
+        # journal_mode переключается только без других соединений: сейчас, до нагрузки
+        connection = connections["default"]
+        connection.close()
+        with connection.cursor() as cursor:
+            mode = cursor.execute("PRAGMA journal_mode").fetchone()[0]
+        begin = connection.transaction_mode() if hasattr(connection, "transaction_mode") else "DEFERRED"
+        self.stdout.write(f"journal_mode={mode}, BEGIN {begin}, прагмы: {pragmas or 'по умолчанию'}")
+
+    def plan(self, options):
+        authors = [User.objects.get_or_create(username=f"{PREFIX}{n}")[0] for n in range(options["authors"])]
+        group, _ = Group.objects.get_or_create(slug=f"{PREFIX}group", defaults={"title": "Нагрузка"})
+        urls = [reverse("index"), reverse("group", kwargs={"slug": group.slug})]
+        urls += [reverse("profile", kwargs={"username": author.username}) for author in authors]
+        return {
+            "seconds": options["seconds"], "threads": options["threads"], "seed": options["seed"],
+            "write_share": options["write_share"], "authors": [author.pk for author in authors],
+            "group": group.pk, "urls": urls,
+        }
+
+    def report(self, records, elapsed):
+        errors = Counter(error for _, _, error in records if error)
+        for kind in ("read", "write"):
+            timings = [seconds * 1000 for record_kind, seconds, error in records
+                       if record_kind == kind and error is None]
+            failed = sum(1 for record_kind, _, error in records if record_kind == kind and error)
+            if len(timings) > 1:
+                cuts = statistics.quantiles(timings, n=100, method="inclusive")
+                latency = f"p50 {cuts[49]:8.2f}  p99 {cuts[98]:8.2f} мс"
+            else:
+                latency = "замеров мало"
+            self.stdout.write(f"{kind:6} {len(timings) / elapsed:8.1f} оп/с  {latency}  ошибок {failed}")
+        for error, count in errors.most_common(5):
+            self.stdout.write(self.style.WARNING(f"{count}x {error}"))
+        total = sum(errors.values())
+        style = self.style.ERROR if total else self.style.SUCCESS
+        self.stdout.write(style(f"Операций: {len(records)} за {elapsed:.1f} с, ошибок: {total}"))
+        return total
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from yatube import db_router
+
+
+class Command(BaseCommand):
+    help = ("Обновляет файловые реплики SQLite снимком основной базы и печатает отставание "
+            "каждой реплики; для настоящей репликации с --measure-only только пишет heartbeat и меряет лаг")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=0,
+                            help="повторять каждые столько секунд; 0 - один раз")
+        parser.add_argument("--measure-only", action="store_true", help="не копировать файлы")
+
+    def handle(self, *args, interval, measure_only, **options):
+        aliases = db_router.replicas()
+        if not aliases:
+            raise CommandError("Реплик нет: задайте YATUBE_REPLICAS или DATABASE_REPLICAS")
+        while True:
+            self.round(aliases, measure_only)
+            if not interval:
+                return
+            time.sleep(interval)
+
+    def round(self, aliases, measure_only):
+        copies = [] if measure_only else [alias for alias in aliases if connections[alias].vendor == "sqlite"]
+        if len(copies) < len(aliases):
+            # настоящим репликам heartbeat приходит сам, с обычной репликацией
+            db_router.beat()
+        for alias in aliases:
+            lag = db_router.sync_replica(alias) if alias in copies else db_router.measure(alias)
+            shown = "heartbeat не дошёл" if lag is None else f"отставание {lag:.3f} с"
+            self.stdout.write(f"{alias}: {shown}")
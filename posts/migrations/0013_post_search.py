@@ -0,0 +1,29 @@
+from django.db import migrations
+
+from posts import fulltext
+
+TRIGGERS = ("insert", "update", "delete", "username", "group")
+
+
+def create_search_index(apps, schema_editor):
+    """FTS5-индекс постов с триггерами, заполненный текущими постами"""
+    fulltext.rebuild(schema_editor.connection.alias)
+
+
+def drop_search_index(apps, schema_editor):
+    if not fulltext.available(schema_editor.connection.alias):
+        return
+    for trigger in TRIGGERS:
+        schema_editor.execute(f"DROP TRIGGER IF EXISTS {fulltext.TABLE}_{trigger}")
+    schema_editor.execute(f"DROP TABLE IF EXISTS {fulltext.TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0012_content_addressed_images'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
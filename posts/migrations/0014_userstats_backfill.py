@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.db import migrations
+
+
+def create_missing_stats(apps, schema_editor):
+    """Строки UserStats для всех пользователей: чтение профиля больше их не создаёт"""
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    Post = apps.get_model("posts", "Post")
+    Follow = apps.get_model("posts", "Follow")
+    UserStats = apps.get_model("posts", "UserStats")
+    quote = schema_editor.quote_name
+    users, posts, follows, stats = (quote(model._meta.db_table) for model in (User, Post, Follow, UserStats))
+    schema_editor.execute(
+        f"INSERT INTO {stats} (user_id, post_count, follower_count, following_count) "
+        f"SELECT u.id, "
+        f"(SELECT COUNT(*) FROM {posts} p WHERE p.author_id = u.id), "
+        f"(SELECT COUNT(*) FROM {follows} f WHERE f.author_id = u.id), "
+        f"(SELECT COUNT(*) FROM {follows} f WHERE f.user_id = u.id) "
+        f"FROM {users} u WHERE NOT EXISTS (SELECT 1 FROM {stats} s WHERE s.user_id = u.id)"
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0013_post_search'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_missing_stats, migrations.RunPython.noop),
+    ]
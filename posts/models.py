@@ -1,7 +1,10 @@
 from django.db import models
+from django.db.models.functions import Coalesce
 
 from django.contrib.auth import get_user_model
 
+from .storage import ContentAddressedStorage
+
 User = get_user_model()
 
 
@@ -14,12 +17,53 @@ class Group(models.Model):
         return self.description
 
 
+class PostQuerySet(models.QuerySet):
+    def for_feed(self):
+        """Записи для лент: автор и группа одним JOIN, число комментариев
+        подзапросом, без колонок, которые шаблоны не показывают"""
+        comments = (
+            Comment.objects.filter(post=models.OuterRef("pk"))
+            .order_by()
+            .values("post")
+            .annotate(total=models.Count("pk"))
+            .values("total")
+        )
+        return (
+            self.select_related("author", "group")
+            .annotate(comment_count=Coalesce(models.Subquery(comments), models.Value(0)))
+            .defer(
+                "author__password", "author__last_login", "author__is_superuser",
+                "author__email", "author__is_staff", "author__is_active",
+                "author__date_joined", "group__description",
+            )
+        )
+
+
 class Post(models.Model):
     text = models.TextField()
     pub_date = models.DateTimeField("date published", auto_now_add=True)
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name="author_posts")
     group = models.ForeignKey(Group, on_delete=models.SET_NULL, blank=True, null=True)
-    image = models.ImageField(upload_to='posts/', blank=True, null=True)
+    # одинаковые изображения хранятся одним файлом, см. posts.storage
+    image = models.ImageField(upload_to='posts/', storage=ContentAddressedStorage(), blank=True, null=True)
+    # размеры заполняет posts.images.ingest; width_field у ImageField
+    # открывал бы файл при каждой загрузке поста из базы
+    image_width = models.PositiveIntegerField(blank=True, null=True, editable=False)
+    image_height = models.PositiveIntegerField(blank=True, null=True, editable=False)
+    # растёт при каждой правке, входит в ключ кеша отрисованной записи
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    objects = PostQuerySet.as_manager()
+
+    class Meta:
+        # ленты читаются по (pub_date, id); id в SQLite входит в индекс неявно
+        indexes = [
+            models.Index(fields=["pub_date"], name="post_pub_date_idx"),
+            models.Index(fields=["author", "pub_date"], name="post_author_date_idx"),
+            models.Index(fields=["group", "pub_date"], name="post_group_date_idx"),
+            # счётчик ссылок на файл изображения, см. posts.storage.references
+            models.Index(fields=["image"], name="post_image_idx"),
+        ]
 
 
 class Comment(models.Model):
@@ -32,7 +76,29 @@ class Comment(models.Model):
 class Follow(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="follower")
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name="following")
-    
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["user", "author"], name="unique_follow")]
+
     def __str__(self):
         return f'follower - {self.user} following - {self.author}'
-        
\ No newline at end of file
+
+
+class TimelineEntry(models.Model):
+    """Запись в ленте подписчика, раскладывается при публикации поста"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="timeline")
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="timeline_entries")
+    # копия Post.pub_date, чтобы лента читалась одним проходом по индексу
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        unique_together = ("user", "post")
+        indexes = [models.Index(fields=["user", "-pub_date", "-post"], name="timeline_user_date_idx")]
+
+
+class UserStats(models.Model):
+    """Счётчики профиля, обновляются вместе с постами и подписками"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name="stats")
+    post_count = models.PositiveIntegerField(default=0)
+    follower_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
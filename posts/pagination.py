@@ -0,0 +1,146 @@
+import base64
+import binascii
+from collections import namedtuple
+
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+POSTS_PER_PAGE = 10
+
+# Источник записей для ленты: queryset и поля, по которым идёт курсор.
+# Queryset может выбирать не сами записи, а строки со ссылкой на них
+# (например, ленту подписок): тогда id_field указывает на id записи,
+# а сами записи догружаются одним запросом из posts.
+# Значения полей ключа обязаны совпадать с pub_date и id записи.
+Source = namedtuple('Source', 'queryset date_field id_field posts')
+
+
+def source(queryset, date_field='pub_date', id_field='pk', posts=None):
+    return Source(queryset, date_field, id_field, posts)
+
+
+def encode_cursor(post):
+    """Непрозрачный курсор из пары (pub_date, id) записи"""
+    raw = f'{post.pub_date.isoformat()}|{post.pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Возвращает (pub_date, id) или None, если курсор испорчен"""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        pub_date, pk = raw.split('|')
+        pub_date = parse_datetime(pub_date)
+        pk = int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+    if pub_date is None:
+        return None
+    return pub_date, pk
+
+
+def _newer(src, cursor):
+    """Строки источника новее курсора, по возрастанию ключа"""
+    queryset, date_field, id_field, _ = src
+    pub_date, pk = cursor
+    return queryset.filter(
+        Q(**{f'{date_field}__gte': pub_date}),
+        Q(**{f'{date_field}__gt': pub_date}) | Q(**{f'{id_field}__gt': pk}),
+    ).order_by(date_field, id_field)
+
+
+def _window(src, after, before, limit):
+    """Не больше limit записей источника по одну сторону от курсора.
+
+    Условие (date, id) < курсора записано как date <= d AND (date < d OR id < i):
+    отдельное ограничение по дате SQLite превращает в диапазон по индексу,
+    а чистое OR планировщик разбивает на MULTI-INDEX OR и теряет порядок.
+    """
+    queryset, date_field, id_field, posts = src
+    if before is not None:
+        queryset = _newer(src, before)
+    else:
+        if after is not None:
+            pub_date, pk = after
+            queryset = queryset.filter(
+                Q(**{f'{date_field}__lte': pub_date}),
+                Q(**{f'{date_field}__lt': pub_date}) | Q(**{f'{id_field}__lt': pk}),
+            )
+        queryset = queryset.order_by(f'-{date_field}', f'-{id_field}')
+    if posts is None:
+        return list(queryset[:limit])
+    ids = list(queryset.values_list(id_field, flat=True)[:limit])
+    by_id = posts.in_bulk(ids)
+    return [by_id[pk] for pk in ids if pk in by_id]
+
+
+def paginate(request, *sources, per_page=POSTS_PER_PAGE):
+    """Постраничный вывод по ключу (pub_date, id) без COUNT и OFFSET.
+
+    Страница выбирается параметрами ?after= / ?before= с курсорами
+    из page.next_cursor и page.previous_cursor. Любая страница стоит
+    одного запроса с LIMIT на источник, сколько бы записей ни было в таблице.
+    Источником служит queryset записей или source(...) с другими полями
+    ключа; записи нескольких источников сливаются в одну ленту.
+    Paginator и Page остаются стандартными, чтобы шаблоны и тесты
+    получали привычный контекст, но количество записей они не считают.
+    """
+    sources = [src if isinstance(src, Source) else source(src) for src in sources]
+    after = decode_cursor(request.GET.get('after'))
+    before = decode_cursor(request.GET.get('before'))
+
+    # одна лишняя запись показывает, есть ли что-то дальше
+    posts = {}
+    for src in sources:
+        for post in _window(src, after, before, per_page + 1):
+            posts[post.pk] = post
+    posts = sorted(posts.values(), key=lambda post: (post.pub_date, post.pk),
+                   reverse=before is None)
+    has_more = len(posts) > per_page
+    posts = posts[:per_page]
+    if before is not None:
+        posts.reverse()
+        has_next, has_previous = True, has_more
+    else:
+        has_next, has_previous = has_more, after is not None
+
+    first = sources[0]
+    paginator = Paginator(first.queryset.order_by(f'-{first.date_field}', f'-{first.id_field}'), per_page)
+    page = Page(posts, 1, paginator)
+    page.next_cursor = encode_cursor(posts[-1]) if has_next and posts else None
+    page.previous_cursor = encode_cursor(posts[0]) if has_previous and posts else None
+    return paginator, page
+
+
+def newer(*sources, since, limit=POSTS_PER_PAGE):
+    """Не больше limit записей новее курсора since, от старых к новым,
+    и признак, что новых записей больше limit"""
+    sources = [src if isinstance(src, Source) else source(src) for src in sources]
+    posts = {}
+    for src in sources:
+        for post in _window(src, None, since, limit + 1):
+            posts[post.pk] = post
+    posts = sorted(posts.values(), key=lambda post: (post.pub_date, post.pk))
+    return posts[:limit], len(posts) > limit
+
+
+def count_newer(*sources, since, limit=POSTS_PER_PAGE):
+    """Число записей новее курсора since, но не больше limit + 1:
+    точное число ленте не нужно, а подсчёт идёт по индексу только до предела"""
+    sources = [src if isinstance(src, Source) else source(src) for src in sources]
+    ids = set()
+    for src in sources:
+        ids.update(_newer(src, since).values_list(src.id_field, flat=True)[:limit + 1])
+    return min(len(ids), limit + 1)
+
+
+def newest(*sources):
+    """Курсор самой новой записи источников или None, если записей нет"""
+    sources = [src if isinstance(src, Source) else source(src) for src in sources]
+    posts = [post for src in sources for post in _window(src, None, None, 1)]
+    if not posts:
+        return None
+    return encode_cursor(max(posts, key=lambda post: (post.pub_date, post.pk)))
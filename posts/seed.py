@@ -0,0 +1,174 @@
+"""Наполнение базы синтетическими данными для замеров производительности"""
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+from io import BytesIO
+from itertools import accumulate
+
+from PIL import Image, ImageDraw
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .models import Comment, Follow, Group, Post, TimelineEntry, User
+from .timeline import fanout_limit
+
+# словарь текстов: частоты слов убывают как в живом языке (закон Ципфа),
+# чтобы в замерах поиска были и частые, и редкие слова
+VOCABULARY = [f'слово{i}' for i in range(5000)]
+WORDS_PER_POST = 12
+
+
+@contextmanager
+def temporary_database(alias, path):
+    """Отдельная база SQLite под alias на время замера, со всеми миграциями"""
+    connections.databases[alias] = dict(connections.databases['default'], NAME=path)
+    connections.ensure_defaults(alias)
+    connections.prepare_test_settings(alias)
+    try:
+        call_command('migrate', database=alias, verbosity=0, interactive=False)
+        yield connections[alias]
+    finally:
+        connections[alias].close()
+        del connections.databases[alias]
+
+
+@contextmanager
+def preserve_auto_now(*fields):
+    """Отключает auto_now_add у полей, чтобы bulk_create сохранил свои даты"""
+    saved = [(field, field.auto_now_add) for field in fields]
+    for field, _ in saved:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now_add in saved:
+            field.auto_now_add = auto_now_add
+
+
+def _bulk(model, rows, using):
+    # размер пачки выбирает бэкенд: у SQLite он ограничен числом параметров
+    model.objects.using(using).bulk_create(rows)
+
+
+def zipf_weights(size):
+    """Накопленные веса 1/ранг для random.choices: первые элементы самые частые"""
+    return list(accumulate(1 / rank for rank in range(1, size + 1)))
+
+
+def make_images(count, rnd):
+    """count разных JPEG в хранилище изображений постов: [(имя, ширина, высота)]"""
+    storage = Post._meta.get_field('image').storage
+    images = []
+    for i in range(count):
+        width, height = rnd.choice(((1600, 1200), (1200, 1600), (1920, 1080), (800, 800)))
+        image = Image.new('RGB', (width, height), tuple(rnd.randrange(256) for _ in range(3)))
+        draw = ImageDraw.Draw(image)
+        for _ in range(8):
+            x, y = rnd.randrange(width), rnd.randrange(height)
+            draw.ellipse((x, y, x + width // 4, y + height // 4), fill=tuple(rnd.randrange(256) for _ in range(3)))
+        output = BytesIO()
+        image.save(output, 'JPEG', quality=85)
+        images.append((storage.save(f'posts/seed-{i}.jpg', ContentFile(output.getvalue())), width, height))
+    return images
+
+
+def seed(users=1000, posts=50000, groups=20, follows=20, comments=0, using='default', random_seed=0,
+         power_law=False, images=0, image_share=0.0):
+    """Пользователи, группы, посты за последний год, подписки и ленты подписок.
+
+    С power_law авторы постов и подписок выбираются по закону Ципфа: у
+    немногих пользователей большинство постов и подписчиков, как в живой
+    сети. images разных картинок достаются доле постов image_share.
+
+    Все строки пишутся bulk_create в одной транзакции, сигналы не срабатывают,
+    поэтому ленты подписок заполняются здесь же; счётчики профилей
+    пересчитываются лениво. Возвращает id созданных пользователей.
+    """
+    with transaction.atomic(using=using):
+        return _seed(users, posts, groups, follows, comments, using, random_seed, power_law, images, image_share)
+
+
+def _seed(users, posts, groups, follows, comments, using, random_seed, power_law, images, image_share):
+    rnd = random.Random(random_seed)
+    now = timezone.now()
+    cum_weights = zipf_weights(len(VOCABULARY))
+    password = make_password(None)
+
+    first_user = User.objects.using(using).order_by('-pk').values_list('pk', flat=True).first() or 0
+    _bulk(User, (User(username=f'seed_{first_user + i}', password=password) for i in range(users)), using)
+    user_ids = list(User.objects.using(using).filter(pk__gt=first_user).values_list('pk', flat=True))
+
+    _bulk(Group, (Group(title=f'Группа {i}', slug=f'seed-{first_user}-{i}', description='')
+                  for i in range(groups)), using)
+    group_ids = list(Group.objects.using(using).filter(slug__startswith=f'seed-{first_user}-')
+                     .values_list('pk', flat=True)) or [None]
+
+    if power_law:
+        # свой случайный порядок для авторства и для популярности: если самый
+        # плодовитый автор ещё и самый читаемый, ленты подписок вырастают в разы
+        prolific = rnd.sample(user_ids, len(user_ids))
+        popular = rnd.sample(user_ids, len(user_ids))
+        user_weights = zipf_weights(len(user_ids))
+
+        def pick_author():
+            return rnd.choices(prolific, cum_weights=user_weights)[0]
+
+        def pick_follows(k):
+            return rnd.choices(popular, cum_weights=user_weights, k=k)
+    else:
+        def pick_author():
+            return rnd.choice(user_ids)
+
+        def pick_follows(k):
+            return rnd.sample(user_ids, min(k, len(user_ids)))
+
+    pictures = make_images(images, rnd) if images else []
+
+    def picture():
+        if pictures and rnd.random() < image_share:
+            return rnd.choice(pictures)
+        return None, None, None
+
+    with preserve_auto_now(Post._meta.get_field('pub_date'), Comment._meta.get_field('created')):
+        _bulk(Post, (
+            Post(text=f'Запись {i} ' + ' '.join(rnd.choices(VOCABULARY, cum_weights=cum_weights, k=WORDS_PER_POST)),
+                 author_id=pick_author(),
+                 group_id=rnd.choice(group_ids + [None]),
+                 image=image, image_width=width, image_height=height,
+                 pub_date=now - timedelta(seconds=rnd.randrange(365 * 24 * 3600)))
+            for i, (image, width, height) in enumerate(picture() for _ in range(posts))
+        ), using)
+        if comments:
+            post_ids = list(Post.objects.using(using).filter(author_id__in=user_ids)
+                            .values_list('pk', flat=True))
+            _bulk(Comment, (
+                Comment(post_id=rnd.choice(post_ids), author_id=rnd.choice(user_ids),
+                        text='Комментарий', created=now)
+                for _ in range(comments)
+            ), using)
+
+    pairs = set()
+    for user_id in user_ids:
+        for author_id in pick_follows(follows):
+            if author_id != user_id:
+                pairs.add((user_id, author_id))
+    _bulk(Follow, (Follow(user_id=user_id, author_id=author_id) for user_id, author_id in pairs), using)
+
+    followers = {}
+    for user_id, author_id in pairs:
+        followers.setdefault(author_id, []).append(user_id)
+    # посты «звёзд» лента подмешивает при чтении, их не раскладываем
+    for author_id in [author_id for author_id, users in followers.items() if len(users) > fanout_limit()]:
+        del followers[author_id]
+    posts_by_author = Post.objects.using(using).filter(author_id__in=user_ids) \
+        .values_list('pk', 'author_id', 'pub_date')
+    _bulk(TimelineEntry, (
+        TimelineEntry(user_id=user_id, post_id=post_id, pub_date=pub_date)
+        for post_id, author_id, pub_date in posts_by_author.iterator()
+        for user_id in followers.get(author_id, ())
+    ), using)
+    return user_ids
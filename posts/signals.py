@@ -0,0 +1,101 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import cache, follows, fulltext, stats, storage, thumbnails, timeline
+from .models import Comment, Follow, Group, Post, User
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, raw=False, **kwargs):
+    # строка счётчиков есть заранее: чтение профиля в базу не пишет
+    if created and not raw:
+        stats.user_created(instance.pk)
+
+
+@receiver(pre_save, sender=Post)
+def post_changing(sender, instance, **kwargs):
+    # при правке пост может уйти из прежней группы, её ленту тоже сбросим,
+    # новая версия сбросит кеш отрисованной записи, а прежнее изображение
+    # удалим, если на него больше никто не ссылается
+    instance._previous_group_id = instance._previous_image = None
+    if instance.pk is None:
+        return
+    previous = Post.objects.filter(pk=instance.pk).values_list("group_id", "version", "image").first()
+    if previous is not None:
+        instance._previous_group_id, version, instance._previous_image = previous
+        instance.version = version + 1
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, **kwargs):
+    feeds = cache.post_feeds(instance, getattr(instance, "_previous_group_id", None))
+    if created:
+        stats.increment(instance.author_id, "post_count")
+        timeline.fanout_post(instance)
+        feeds.append(cache.author_stats(instance.author_id))
+    cache.bump_on_commit(*feeds)
+    if instance.image:
+        # пост в базе - ссылки на файл хватает, отметка загрузки больше не нужна
+        name = instance.image.name
+        transaction.on_commit(lambda: storage.settle(name))
+        # пул читает файл и kvstore, пост должен быть уже в базе
+        transaction.on_commit(lambda: thumbnails.schedule(instance))
+    previous_image = getattr(instance, "_previous_image", None)
+    if previous_image and previous_image != instance.image.name:
+        transaction.on_commit(lambda: storage.release(previous_image))
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    stats.decrement(instance.author_id, "post_count")
+    cache.bump_on_commit(cache.author_stats(instance.author_id), *cache.post_feeds(instance))
+    if instance.image:
+        name = instance.image.name
+        transaction.on_commit(lambda: storage.release(name))
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, **kwargs):
+    # в лентах показывается число комментариев
+    cache.bump_on_commit(*cache.post_feeds(instance.post))
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    # при каскадном удалении поста его самого может уже не быть
+    post = Post.objects.filter(pk=instance.post_id).only("author_id", "group_id").first()
+    if post is not None:
+        cache.bump_on_commit(*cache.post_feeds(post))
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, **kwargs):
+    if created:
+        stats.increment(instance.author_id, "follower_count")
+        stats.increment(instance.user_id, "following_count")
+        timeline.backfill(instance.user_id, instance.author_id)
+        follows.changed(instance.user_id, instance.author_id)
+        cache.bump_on_commit(cache.following_feed(instance.user_id),
+                             cache.author_stats(instance.user_id), cache.author_stats(instance.author_id))
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    stats.decrement(instance.author_id, "follower_count")
+    stats.decrement(instance.user_id, "following_count")
+    timeline.prune(instance.user_id, instance.author_id)
+    timeline.author_unfollowed(instance.author_id)
+    follows.changed(instance.user_id, instance.author_id)
+    cache.bump_on_commit(cache.following_feed(instance.user_id),
+                         cache.author_stats(instance.user_id), cache.author_stats(instance.author_id))
+
+
+@receiver(post_save, sender=Group)
+def group_saved(sender, instance, **kwargs):
+    # название и описание группы - в шапке её ленты
+    cache.bump_on_commit(cache.group_feed(instance.pk))
+
+
+def install_search(using, **kwargs):
+    fulltext.install(using)
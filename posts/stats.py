@@ -0,0 +1,104 @@
+"""Денормализованные счётчики профиля (UserStats).
+
+Счётчики меняются F-выражениями в той же транзакции, что и пост или
+подписка, поэтому конкурентные запросы не теряют обновления. Строка
+создаётся вместе с пользователем (сигнал, для старых - миграция 0014),
+а пользователям, загруженным в обход сигналов, - при первом увеличении
+счётчика или recount(). Чтение строку не создаёт: запись из GET
+профиля пометила бы реплики отставшими и закрепила бы читателя за
+основной базой. Уменьшение строку тоже не создаёт, иначе каскадное
+удаление пользователя оставило бы за ним статистику.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import Follow, Post, User, UserStats
+
+BATCH_SIZE = 1000
+
+
+def _count(model, field):
+    counted = (
+        model.objects.filter(**{field: OuterRef("pk")})
+        .order_by()
+        .values(field)
+        .annotate(total=Count("pk"))
+        .values("total")
+    )
+    return Coalesce(Subquery(counted), Value(0))
+
+
+def counted_users():
+    """Пользователи с посчитанными post_count, follower_count, following_count"""
+    return User.objects.annotate(
+        post_count=_count(Post, "author"),
+        follower_count=_count(Follow, "author"),
+        following_count=_count(Follow, "user"),
+    )
+
+
+def _create(user_id):
+    user = counted_users().get(pk=user_id)
+    try:
+        with transaction.atomic():
+            return UserStats.objects.create(
+                user_id=user_id,
+                post_count=user.post_count,
+                follower_count=user.follower_count,
+                following_count=user.following_count,
+            )
+    except IntegrityError:
+        # строку успел создать параллельный запрос
+        return UserStats.objects.get(user_id=user_id)
+
+
+def user_created(user_id):
+    # у нового пользователя ещё нет ни постов, ни подписок
+    UserStats.objects.create(user_id=user_id)
+
+
+def increment(user_id, field):
+    updated = UserStats.objects.filter(user_id=user_id).update(**{field: F(field) + 1})
+    if not updated:
+        _create(user_id)
+
+
+def decrement(user_id, field):
+    UserStats.objects.filter(user_id=user_id, **{f"{field}__gt": 0}).update(**{field: F(field) - 1})
+
+
+def stats_for(user):
+    """Счётчики пользователя; без строки - посчитанные запросом, без записи"""
+    try:
+        return UserStats.objects.get(user_id=user.pk)
+    except UserStats.DoesNotExist:
+        counted = counted_users().get(pk=user.pk)
+        return UserStats(user_id=user.pk, post_count=counted.post_count,
+                         follower_count=counted.follower_count, following_count=counted.following_count)
+
+
+def recount(batch_size=BATCH_SIZE):
+    """Пересчитать счётчики всех пользователей пачками, возвращает число исправленных"""
+    fixed = 0
+    last_pk = 0
+    while True:
+        users = list(counted_users().filter(pk__gt=last_pk).order_by("pk")[:batch_size])
+        if not users:
+            return fixed
+        last_pk = users[-1].pk
+        with transaction.atomic():
+            existing = UserStats.objects.in_bulk([user.pk for user in users])
+            missing, changed = [], []
+            for user in users:
+                values = (user.post_count, user.follower_count, user.following_count)
+                stats = existing.get(user.pk)
+                if stats is None:
+                    missing.append(UserStats(user_id=user.pk, post_count=values[0],
+                                             follower_count=values[1], following_count=values[2]))
+                elif (stats.post_count, stats.follower_count, stats.following_count) != values:
+                    stats.post_count, stats.follower_count, stats.following_count = values
+                    changed.append(stats)
+            UserStats.objects.bulk_create(missing)
+            UserStats.objects.bulk_update(changed, ["post_count", "follower_count", "following_count"])
+            fixed += len(missing) + len(changed)
@@ -0,0 +1,159 @@
+"""Хранилище изображений постов с адресацией по содержимому.
+
+Файл называется sha256 своего содержимого: posts/ab/abcd....jpg.
+Одинаковые загрузки получают одно имя, поэтому на диске лежит один
+оригинал, и sorl делает для него один набор миниатюр. Счётчик ссылок -
+число постов с этим именем в базе: delete() и release() удаляют файл,
+только когда на него больше никто не ссылается.
+
+Пока пост загрузки не зафиксирован, ссылки на файл в базе нет, и
+release() другого запроса мог бы удалить файл, который загрузка только
+что переиспользовала. Поэтому save() оставляет рядом с файлом отметку
+.claim-*, её снимает settle() после фиксации поста; delete() под той же
+блокировкой каталога, что и save(), проверяет ссылки и свежие отметки
+прямо перед удалением. Отметки загрузок, чей пост так и не сохранился,
+перестают учитываться через CLAIM_TIMEOUT секунд.
+"""
+import glob
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.apps import apps
+from django.core.files import File, locks
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+from sorl.thumbnail import delete as delete_thumbnails
+
+HASHED_NAME = re.compile(r"(^|/)[0-9a-f]{2}/[0-9a-f]{64}\.\w+$")
+CLAIM_TIMEOUT = 10 * 60
+
+# отметки загрузок этого потока: {имя файла: [пути отметок]}
+_local = threading.local()
+
+
+def content_hash(content):
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hashed_name(name, digest):
+    """posts/photo.JPG -> posts/ab/ab....jpg"""
+    directory, filename = os.path.split(name)
+    extension = os.path.splitext(filename)[1].lower()
+    return os.path.join(directory, digest[:2], digest + extension)
+
+
+def references(name):
+    Post = apps.get_model("posts", "Post")
+    return Post.objects.filter(image=name).count()
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, "chunks"):
+            content = File(content, name)
+        name = hashed_name(self.generate_filename(name), content_hash(content))
+        with self._locked(name):
+            if not self.exists(name):
+                self._save(name, content)
+            self._claim(name)
+        return name
+
+    @contextmanager
+    def _locked(self, name):
+        """Блокировка каталога файла: загрузка и удаление не идут одновременно"""
+        directory = os.path.dirname(self.path(name))
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, ".lock"), "wb") as lock_file:
+            locks.lock(lock_file, locks.LOCK_EX)
+            try:
+                yield
+            finally:
+                locks.unlock(lock_file)
+
+    def _claim_prefix(self, name):
+        directory, filename = os.path.split(self.path(name))
+        return os.path.join(directory, f".claim-{filename}-")
+
+    def _claim(self, name):
+        prefix = self._claim_prefix(name)
+        fd, claim = tempfile.mkstemp(dir=os.path.dirname(prefix), prefix=os.path.basename(prefix))
+        os.close(fd)
+        if not hasattr(_local, "claims"):
+            _local.claims = {}
+        _local.claims.setdefault(name, []).append(claim)
+
+    def claimed(self, name):
+        """Есть ли незафиксированная загрузка этого файла; устаревшие отметки удаляются"""
+        found = False
+        for claim in glob.glob(glob.escape(self._claim_prefix(name)) + "*"):
+            try:
+                if time.time() - os.path.getmtime(claim) < CLAIM_TIMEOUT:
+                    found = True
+                else:
+                    os.remove(claim)
+            except FileNotFoundError:
+                pass
+        return found
+
+    def _save(self, name, content):
+        # через временный файл и os.replace: одновременные загрузки одного
+        # содержимого пишут одинаковые байты, а читатель не видит половину файла
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".upload-")
+        try:
+            with os.fdopen(fd, "wb") as temp:
+                for chunk in content.chunks():
+                    temp.write(chunk)
+            if self.file_permissions_mode is not None:
+                os.chmod(temp_path, self.file_permissions_mode)
+            os.replace(temp_path, full_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return name
+
+    def delete(self, name):
+        """Файл, на который ещё ссылаются посты или загрузки, не удаляется;
+        возвращает, удалён ли он"""
+        with self._locked(name):
+            if references(name) or self.claimed(name):
+                return False
+            super().delete(name)
+        return True
+
+
+def settle(name):
+    """Пост с изображением name зафиксирован: снять отметки загрузок этого потока"""
+    for claim in getattr(_local, "claims", {}).pop(name, []):
+        try:
+            os.remove(claim)
+        except FileNotFoundError:
+            pass
+
+
+def release(name):
+    """Удаляет оригинал и его миниатюры, если на него не ссылается ни один пост.
+
+    Файлы со старыми именами (до dedupe_images) не трогаем: их имена
+    могли задать как угодно, в том числе вне MEDIA_ROOT.
+    """
+    Post = apps.get_model("posts", "Post")
+    storage = Post._meta.get_field("image").storage
+    if not name or not HASHED_NAME.search(name):
+        return
+    if storage.delete(name):
+        delete_thumbnails(name, delete_file=False)
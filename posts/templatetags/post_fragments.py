@@ -0,0 +1,130 @@
+"""Кеш отрисованных записей для лент.
+
+Карточка записи (posts/post_item.html) одинакова для всех читателей,
+поэтому хранится в кеше под ключом из id, версии поста, числа
+комментариев и отпечатка имени автора и группы: переименование меняет
+ключ. Карточки живут не дольше FRAGMENT_CACHE_TIMEOUT. Лента собирает карточки одним cache.get_many и рисует
+только недостающие. Всё, что зависит от читателя, в карточке заменено
+меткой, которую {% viewer_controls %} заполняет уже после кешей.
+Карточка с исходным изображением вместо миниатюры не кешируется.
+Миниатюры недостающих карточек ищутся одним thumbnails.variants_many().
+Подписки читателя на авторов карточек проверяются одним обращением к
+графу подписок (posts.follows), без запроса на карточку.
+"""
+import hashlib
+import re
+
+from django import template
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import get_template, render_to_string
+from django.utils.safestring import mark_safe
+
+from posts import follows, thumbnails
+
+register = template.Library()
+
+CONTROLS = re.compile(r'<!--post-controls:(\d+):(\d+):([\w.@+-]+)-->')
+
+
+def fragment_key(post):
+    shown = [post.author.username]
+    if post.group_id:
+        shown += [post.group.slug, post.group.title]
+    names = hashlib.md5('\n'.join(shown).encode()).hexdigest()[:12]
+    return f'post_fragment:{post.pk}:{post.version}:{getattr(post, "comment_count", "")}:{post.group_id}:{names}'
+
+
+def render_posts(posts):
+    posts = list(posts)
+    keys = [fragment_key(post) for post in posts]
+    cached = cache.get_many(keys)
+    missing = {}
+    pictures = [post for key, post in zip(keys, posts) if key not in cached and post.image]
+    if pictures:
+        found = thumbnails.variants_many(post.image.name for post in pictures)
+        for post in pictures:
+            post._thumbnail_variants = found[post.image.name]
+    for key, post in zip(keys, posts):
+        if key not in cached:
+            cached[key] = render_to_string('posts/post_item.html', {'post': post})
+            if not getattr(post, '_thumbnail_pending', False):
+                missing[key] = cached[key]
+    if missing:
+        cache.set_many(missing, settings.FRAGMENT_CACHE_TIMEOUT)
+    return mark_safe(''.join(cached[key] for key in keys))
+
+
+# карточка во всю ширину колонки, но не шире большого варианта
+PICTURE_SIZES = f'(max-width: {thumbnails.WIDTHS[-1]}px) 100vw, {thumbnails.WIDTHS[-1]}px'
+MIME_TYPES = {'WEBP': 'image/webp', 'JPEG': 'image/jpeg'}
+
+
+def _srcset(variants):
+    return ', '.join(f'{thumbnail.url} {width}w' for width, thumbnail in variants)
+
+
+@register.inclusion_tag('posts/post_picture.html')
+def post_picture(post):
+    """<picture> с вариантами миниатюр; пока пул их делает - исходное изображение"""
+    if not post.image:
+        return {}
+    if hasattr(post, '_thumbnail_variants'):
+        found = post._thumbnail_variants
+    else:
+        found = thumbnails.variants(post.image.name)
+    if found is None:
+        post._thumbnail_pending = True
+        return {'original': post.image, 'width': post.image_width, 'height': post.image_height}
+    *alternatives, (fallback_format, fallback) = found.items()
+    width, height = thumbnails.FRAME
+    return {
+        'sources': [(MIME_TYPES[image_format], _srcset(variants)) for image_format, variants in alternatives],
+        'src': fallback[-1][1].url,
+        'srcset': _srcset(fallback),
+        'sizes': PICTURE_SIZES,
+        'width': width,
+        'height': height,
+    }
+
+
+@register.simple_tag
+def post_list(posts):
+    """Карточки записей ленты из кеша, недостающие дорисовываются"""
+    return render_posts(posts)
+
+
+@register.simple_tag
+def post_card(post):
+    return render_posts([post])
+
+
+class ViewerControlsNode(template.Node):
+    def __init__(self, nodelist):
+        self.nodelist = nodelist
+
+    def render(self, context):
+        user = context.get('user')
+        content = self.nodelist.render(context)
+        if user is None or not user.is_authenticated:
+            return CONTROLS.sub('', content)
+        following = follows.following_map(user.pk, {int(author_id) for _, author_id, _ in CONTROLS.findall(content)})
+        controls_template = get_template('posts/post_controls.html')
+
+        def controls(match):
+            post_id, author_id, username = match.groups()
+            return controls_template.render({'post_id': post_id, 'username': username,
+                                             'own': int(author_id) == user.pk,
+                                             'following': following[int(author_id)]})
+
+        return CONTROLS.sub(controls, content)
+
+
+@register.tag
+def viewer_controls(parser, token):
+    """{% viewer_controls %}...{% endviewer_controls %}: подставляет в карточки
+    ссылки, зависящие от читателя: «Редактировать» для автора, остальным -
+    «Подписаться» или «Отписаться»"""
+    nodelist = parser.parse(('endviewer_controls',))
+    parser.delete_first_token()
+    return ViewerControlsNode(nodelist)
@@ -1,9 +1,45 @@
-from django.test import TestCase, override_settings
-from django.test import Client
-from .models import User
+import csv
+import datetime
+import gzip
+import json
+import multiprocessing
+import os
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO, StringIO
+from unittest import mock
+
+from PIL import Image
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, router, transaction
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test import Client, RequestFactory
+from django.test.utils import CaptureQueriesContext
+from .models import User, Post, Group, Comment, Follow, TimelineEntry, UserStats
+from . import cache as feed_cache
+from . import delta
+from . import follows
+from . import fulltext
+from . import thumbnails
+from . import urls
+from .templatetags.post_fragments import post_card
+from .pagination import paginate as views_paginate
 from . import views
 from django.urls import reverse
-from yatube import settings
+from yatube import metrics, profiling, settings
+from yatube.filecache import FileCache
+from yatube.db_router import PIN_COOKIE, ReplicaMiddleware, copy_database, read_beat, read_replica
+from yatube.querybudget import QueryBudgetExceeded, QueryBudgetMiddleware, QueryRecorder, query_budget, unmetered
 
 
 @override_settings(CACHES=settings.TEST_CACHES)
@@ -62,10 +98,13 @@ class ImageTestCase(TestCase):
        
     def test_img(self):
         self.client.login(username='sarah', password='12345')
-        with open('media/posts/image.png', 'rb') as fp:
-            self.client.post(reverse('new_post'), {'text': 'FirstPost', 'image': fp})
-            response = self.client.get('/')
-            self.assertContains(response, 'img', status_code=200, msg_prefix="")
+        fp = BytesIO()
+        Image.new('RGB', (50, 50), 'red').save(fp, 'PNG')
+        fp.name = 'image.png'
+        fp.seek(0)
+        self.client.post(reverse('new_post'), {'text': 'FirstPost', 'image': fp})
+        response = self.client.get('/')
+        self.assertContains(response, 'img', status_code=200, msg_prefix="")
 
 
 @override_settings(CACHES=settings.TEST_CACHES)
@@ -121,3 +160,1245 @@ class TestError404(TestCase):
     def test_404(self):
         response = self.client.get("/not_found/")
         self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CACHES=settings.TEST_CACHES)
+class CursorPaginatorTestCase(TestCase):
+    """Постраничный вывод по курсору без COUNT и OFFSET"""
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+                        username="sarah", email="connor.s@skynet.com", password="12345")
+        for i in range(25):
+            Post.objects.create(text=f'Пост {i}', author=self.user)
+
+    def test_walk_pages(self):
+        seen = []
+        response = self.client.get(reverse('index'))
+        while True:
+            page = response.context['page']
+            seen.extend(post.pk for post in page)
+            if not page.next_cursor:
+                break
+            response = self.client.get(reverse('index'), {'after': page.next_cursor})
+        expected = list(Post.objects.order_by('-pub_date', '-pk').values_list('pk', flat=True))
+        self.assertEqual(seen, expected)
+        previous = self.client.get(reverse('index'), {'before': page.previous_cursor})
+        self.assertEqual([post.pk for post in previous.context['page']], expected[10:20])
+
+    def test_no_count_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('index'), {'after': 'испорчен'})
+        self.assertEqual(len(response.context['page']), 10)
+        for query in queries:
+            self.assertNotIn('COUNT(*)', query['sql'])
+            self.assertNotIn('OFFSET', query['sql'])
+
+
+@override_settings(CACHES=settings.TEST_CACHES)
+class TimelineTestCase(TestCase):
+    """Лента подписок раскладывается при записи и читается по индексу"""
+    def setUp(self):
+        self.client = Client()
+        self.reader = User.objects.create_user(
+                        username="sarah", email="connor.s@skynet.com", password="12345")
+        self.author = User.objects.create_user(
+                        username="volkov", email="volkov@skynet.com", password="12345")
+        self.old_post = Post.objects.create(text='Старый пост', author=self.author)
+        self.client.force_login(self.reader)
+
+    def feed(self):
+        response = self.client.get(reverse('follow_index'))
+        return [post.pk for post in response.context['page']]
+
+    def test_fanout(self):
+        self.client.get(reverse('profile_follow', kwargs={'username': 'volkov'}))
+        self.assertEqual(TimelineEntry.objects.filter(user=self.reader).count(), 1)
+        new_post = Post.objects.create(text='Новый пост', author=self.author)
+        self.assertEqual(self.feed(), [new_post.pk, self.old_post.pk])
+        self.client.get(reverse('profile_unfollow', kwargs={'username': 'volkov'}))
+        self.assertFalse(TimelineEntry.objects.filter(user=self.reader).exists())
+        self.assertEqual(self.feed(), [])
+
+    @override_settings(FEED_FANOUT_LIMIT=0)
+    def test_fanout_on_read(self):
+        Follow.objects.create(user=self.reader, author=self.author)
+        new_post = Post.objects.create(text='Новый пост', author=self.author)
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertEqual(self.feed(), [new_post.pk, self.old_post.pk])
+
+    def test_rebuild_command(self):
+        Follow.objects.create(user=self.reader, author=self.author)
+        TimelineEntry.objects.all().delete()
+        call_command('rebuild_timelines', stdout=StringIO())
+        self.assertEqual(self.feed(), [self.old_post.pk])
+
+
+@override_settings(FEED_FANOUT_LIMIT=1)
+class TimelineRestoreTestCase(TransactionTestCase):
+    """Автор, вернувшийся к пределу, снова раскладывается по лентам"""
+    def test_restore_after_unfollow(self):
+        author = User.objects.create_user(username="volkov")
+        reader, other = User.objects.create_user(username="sarah"), User.objects.create_user(username="john")
+        Follow.objects.create(user=reader, author=author)
+        Follow.objects.create(user=other, author=author)
+        post = Post.objects.create(text='Пост звезды', author=author)
+        self.assertFalse(TimelineEntry.objects.filter(post=post).exists())
+        Follow.objects.filter(user=other).delete()
+        self.assertEqual(list(TimelineEntry.objects.filter(post=post).values_list('user_id', flat=True)), [reader.pk])
+
+
+@override_settings(CACHES=settings.TEST_CACHES)
+class UserStatsTestCase(TestCase):
+    """Счётчики профиля обновляются вместе с постами и подписками"""
+    def setUp(self):
+        self.client = Client()
+        self.reader = User.objects.create_user(
+                        username="sarah", email="connor.s@skynet.com", password="12345")
+        self.author = User.objects.create_user(
+                        username="volkov", email="volkov@skynet.com", password="12345")
+        self.client.force_login(self.reader)
+
+    def counters(self, user):
+        user_stats = UserStats.objects.get(user=user)
+        return user_stats.post_count, user_stats.follower_count, user_stats.following_count
+
+    def test_counters(self):
+        post = Post.objects.create(text='Пост', author=self.author)
+        Post.objects.create(text='Ещё пост', author=self.author)
+        self.client.get(reverse('profile_follow', kwargs={'username': 'volkov'}))
+        self.assertEqual(self.counters(self.author), (2, 1, 0))
+        self.assertEqual(self.counters(self.reader), (0, 0, 1))
+        post.delete()
+        self.client.get(reverse('profile_unfollow', kwargs={'username': 'volkov'}))
+        self.assertEqual(self.counters(self.author), (1, 0, 0))
+        self.assertEqual(self.counters(self.reader), (0, 0, 0))
+
+    def test_cascade(self):
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.author.delete()
+        self.assertEqual(self.counters(self.reader), (0, 0, 0))
+        self.assertFalse(UserStats.objects.filter(user_id=self.author.pk).exists())
+
+    def test_created_with_user(self):
+        self.assertEqual(self.counters(User.objects.create_user(username="john")), (0, 0, 0))
+
+    @override_settings(CACHES=settings.TEST_CACHES)
+    def test_profile_read_does_not_write(self):
+        # пользователь загружен в обход сигналов, строки счётчиков нет
+        Post.objects.create(text='Пост', author=self.author)
+        UserStats.objects.filter(user=self.author).delete()
+        response = Client().get(reverse('profile', kwargs={'username': 'volkov'}))
+        self.assertEqual(response.context['count'], 1)
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+        self.assertFalse(UserStats.objects.filter(user=self.author).exists())
+
+    def test_profile_uses_counters(self):
+        Post.objects.create(text='Пост', author=self.author)
+        UserStats.objects.filter(user=self.author).update(post_count=42)
+        response = self.client.get(reverse('profile', kwargs={'username': 'volkov'}))
+        self.assertEqual(response.context['count'], 42)
+        call_command('recount_stats', batch_size=1, stdout=StringIO())
+        self.assertEqual(self.counters(self.author), (1, 0, 0))
+
+
+@override_settings(CACHES=settings.TEST_CACHES)
+class FeedQueriesTestCase(TestCase):
+    """Число запросов на страницу ленты не зависит от числа записей на ней"""
+    def setUp(self):
+        self.client = Client()
+        self.reader = User.objects.create_user(
+                        username="sarah", email="connor.s@skynet.com", password="12345")
+        self.group = Group.objects.create(title='Группа', slug='group', description='Описание')
+        self.client.force_login(self.reader)
+        self.add_posts(1)
+
+    def add_posts(self, count):
+        for i in range(count):
+            author = User.objects.create_user(username=f'author_{User.objects.count()}')
+            Follow.objects.create(user=self.reader, author=author)
+            post = Post.objects.create(text=f'Пост {i}', author=author, group=self.group)
+            Comment.objects.create(post=post, author=self.reader, text='Комментарий')
+
+    def count_queries(self):
+        urls = [reverse('index'), reverse('follow_index'),
+                reverse('group', kwargs={'slug': 'group'}),
+                reverse('profile', kwargs={'username': Post.objects.last().author.username})]
+        counts = []
+        for url in urls:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertContains(response, 'Пост')
+            counts.append(len(queries))
+        return counts
+
+    def test_constant_queries(self):
+        one_post = self.count_queries()
+        self.add_posts(14)
+        self.assertEqual(self.count_queries(), one_post)
+
+
+@override_settings(CACHES=settings.TEST_CACHES, QUERY_BUDGET_RAISE=True)
+class QueryBudgetTestCase(TestCase):
+    """Представления укладываются в объявленный бюджет запросов"""
+    def setUp(self):
+        self.client = Client()
+        self.reader = User.objects.create_user(
+                        username="sarah", email="connor.s@skynet.com", password="12345")
+        self.author = User.objects.create_user(
+                        username="volkov", email="volkov@skynet.com", password="12345")
+        self.group = Group.objects.create(title='Группа', slug='group', description='Описание')
+        for i in range(12):
+            post = Post.objects.create(text=f'Пост {i}', author=self.author, group=self.group)
+            Comment.objects.create(post=post, author=self.reader, text='Комментарий')
+        self.client.force_login(self.reader)
+
+    def test_views_within_budget(self):
+        post = Post.objects.last()
+        self.client.get(reverse('profile_follow', kwargs={'username': 'volkov'}))
+        self.client.post(reverse('new_post'), {'text': 'Новый пост'})
+        self.client.post(reverse('add_comment', kwargs={'username': 'volkov', 'post_id': post.pk}),
+                         {'text': 'Ещё комментарий'})
+        for url in [reverse('index'), reverse('follow_index'),
+                    reverse('group', kwargs={'slug': 'group'}),
+                    reverse('profile', kwargs={'username': 'volkov'}),
+                    reverse('post', kwargs={'username': 'volkov', 'post_id': post.pk})]:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.client.get(reverse('profile_unfollow', kwargs={'username': 'volkov'}))
+
+    def test_fresh_connection_in_request(self):
+        # первое соединение процесса открывается внутри запроса
+        def paginate(*args, **kwargs):
+            connection_created.send(sender=type(connection), connection=connection)
+            return views_paginate(*args, **kwargs)
+        with mock.patch('posts.views.paginate', side_effect=paginate):
+            self.assertEqual(Client().get(reverse('index')).status_code, 200)
+
+    def test_budget_exceeded(self):
+        @query_budget(1)
+        def view(request):
+            return HttpResponse(f'{Post.objects.count()} {Group.objects.count()}')
+
+        def get_response(request):
+            middleware.process_view(request, view, (), {})
+            return view(request)
+
+        middleware = QueryBudgetMiddleware(get_response)
+        with self.assertRaisesMessage(QueryBudgetExceeded, '2 queries, budget is 1'):
+            middleware(RequestFactory().get('/'))
+
+    def test_repeated_queries(self):
+        with QueryRecorder() as recorder:
+            for post in Post.objects.all():
+                post.author.username
+        repeated = recorder.repeated()
+        self.assertEqual(len(repeated), 1)
+        shape, queries = repeated.popitem()
+        self.assertIn('FROM "auth_user"', shape)
+        self.assertEqual(len(queries), 12)
+        self.assertTrue(queries[0].origin.startswith('posts/tests.py:'))
+        # единственный запрос списка постов стек не обходил
+        self.assertIsNone(recorder.queries[0].origin)
+
+
+class FeedIndexesTestCase(TestCase):
+    """Подписка на автора уникальна, запросы лент идут по составным индексам"""
+    def test_unique_follow(self):
+        reader = User.objects.create_user(username="sarah")
+        author = User.objects.create_user(username="volkov")
+        Follow.objects.create(user=reader, author=author)
+        with self.assertRaises(IntegrityError):
+            Follow.objects.create(user=reader, author=author)
+
+    def test_bench_indexes(self):
+        out = StringIO()
+        call_command('bench_indexes', users=20, posts=200, comments=20, repeat=1, stdout=out)
+        self.assertIn('USING INDEX post_pub_date_idx', out.getvalue())
+        self.assertIn('USING INDEX post_group_date_idx', out.getvalue())
+
+
+class FeedGenerationCacheTestCase(TestCase):
+    """Фрагменты лент живут до смены поколения и сбрасываются ровно при изменениях"""
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.author = User.objects.create_user(
+                        username="volkov", email="volkov@skynet.com", password="12345")
+        self.group = Group.objects.create(title='Группа', slug='group', description='Описание')
+        self.other_group = Group.objects.create(title='Другая', slug='other', description='Описание')
+        self.post = Post.objects.create(text='Первый пост', author=self.author, group=self.group)
+
+    def test_new_post_visible_at_once(self):
+        self.assertContains(self.client.get(reverse('index')), 'Первый пост')
+        Post.objects.create(text='Второй пост', author=self.author)
+        self.assertContains(self.client.get(reverse('index')), 'Второй пост')
+
+    def test_cached_until_changed(self):
+        self.client.get(reverse('group', kwargs={'slug': 'group'}))
+        Post.objects.filter(pk=self.post.pk).update(text='Изменён в обход сигналов')
+        self.assertContains(self.client.get(reverse('group', kwargs={'slug': 'group'})), 'Первый пост')
+
+    def test_edit_bumps_affected_feeds_only(self):
+        before = feed_cache.generations(
+            feed_cache.INDEX, feed_cache.group_feed(self.group.pk),
+            feed_cache.group_feed(self.other_group.pk), feed_cache.profile_feed(self.author.pk))
+        unrelated = User.objects.create_user(username="sarah")
+        unrelated_before = feed_cache.generations(feed_cache.profile_feed(unrelated.pk))
+        self.post.text = 'Исправленный пост'
+        self.post.group = self.other_group
+        self.post.save()
+        after = feed_cache.generations(*before)
+        self.assertTrue(all(after[feed] > before[feed] for feed in before))
+        self.assertEqual(feed_cache.generations(feed_cache.profile_feed(unrelated.pk)), unrelated_before)
+        self.assertContains(self.client.get(reverse('group', kwargs={'slug': 'other'})), 'Исправленный пост')
+        self.assertNotContains(self.client.get(reverse('group', kwargs={'slug': 'group'})), 'Исправленный пост')
+
+    def test_follow_feed(self):
+        reader = User.objects.create_user(username="sarah")
+        self.client.force_login(reader)
+        self.assertNotContains(self.client.get(reverse('follow_index')), 'Первый пост')
+        Follow.objects.create(user=reader, author=self.author)
+        self.assertContains(self.client.get(reverse('follow_index')), 'Первый пост')
+        Post.objects.create(text='Второй пост', author=self.author)
+        self.assertContains(self.client.get(reverse('follow_index')), 'Второй пост')
+
+
+class FeedBumpOnCommitTestCase(TransactionTestCase):
+    """Поколение меняется ещё раз, когда запись зафиксирована"""
+    def setUp(self):
+        cache.clear()
+
+    def test_bump_after_commit(self):
+        author = User.objects.create_user(username="volkov")
+        with transaction.atomic():
+            Post.objects.create(text='Первый пост', author=author)
+            inside = feed_cache.generations(feed_cache.INDEX)[feed_cache.INDEX]
+        self.assertGreater(feed_cache.generations(feed_cache.INDEX)[feed_cache.INDEX], inside)
+
+
+class PostFragmentCacheTestCase(TestCase):
+    """Карточка поста кешируется одна на всех, ссылки автора подставляются отдельно"""
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.author = User.objects.create_user(
+                        username="volkov", email="volkov@skynet.com", password="12345")
+        self.reader = User.objects.create_user(username="sarah", password="12345")
+        self.post = Post.objects.create(text='Первый пост', author=self.author)
+        self.edit_url = reverse('post_edit', kwargs={'username': 'volkov', 'post_id': self.post.pk})
+
+    def test_edit_link_only_for_author(self):
+        self.assertNotContains(self.client.get(reverse('index')), self.edit_url)
+        self.client.force_login(self.author)
+        self.assertContains(self.client.get(reverse('index')), self.edit_url)
+        self.assertContains(self.client.get(reverse('post', kwargs={'username': 'volkov', 'post_id': self.post.pk})),
+                            self.edit_url)
+        self.client.force_login(self.reader)
+        self.assertNotContains(self.client.get(reverse('index')), self.edit_url)
+        self.assertNotContains(self.client.get(reverse('post', kwargs={'username': 'volkov', 'post_id': self.post.pk})),
+                               self.edit_url)
+
+    def test_edit_bumps_version(self):
+        self.client.get(reverse('index'))
+        self.post.text = 'Исправленный пост'
+        self.post.save()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.version, 2)
+        response = self.client.get(reverse('post', kwargs={'username': 'volkov', 'post_id': self.post.pk}))
+        self.assertContains(response, 'Исправленный пост')
+
+    def test_rename_changes_card(self):
+        group = Group.objects.create(title='Группа', slug='group', description='Описание')
+        Post.objects.filter(pk=self.post.pk).update(group=group)
+        post = Post.objects.for_feed().get(pk=self.post.pk)
+        self.assertIn('#Группа', post_card(post))
+        User.objects.filter(pk=self.author.pk).update(username='volkov_new')
+        Group.objects.filter(pk=group.pk).update(title='Новая группа')
+        card = post_card(Post.objects.for_feed().get(pk=self.post.pk))
+        self.assertIn('@volkov_new', card)
+        self.assertIn('#Новая группа', card)
+
+    def test_cards_reused_between_pages(self):
+        self.client.get(reverse('index'))
+        Post.objects.filter(pk=self.post.pk).update(text='Изменён в обход сигналов')
+        Post.objects.create(text='Второй пост', author=self.reader)
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, 'Второй пост')
+        self.assertContains(response, 'Первый пост')
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ConditionalGetTestCase(TestCase):
+    """Анониму публичные страницы отдаются с валидаторами и 304 без отрисовки"""
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.author = User.objects.create_user(
+                        username="volkov", email="volkov@skynet.com", password="12345")
+        self.group = Group.objects.create(title='Группа', slug='group', description='Описание')
+        self.post = Post.objects.create(text='Первый пост', author=self.author, group=self.group)
+        self.urls = [
+            reverse('index'),
+            reverse('group', kwargs={'slug': 'group'}),
+            reverse('profile', kwargs={'username': 'volkov'}),
+            reverse('post', kwargs={'username': 'volkov', 'post_id': self.post.pk}),
+        ]
+
+    def test_not_modified(self):
+        for url in self.urls:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('public', response['Cache-Control'])
+            with self.assertNumQueries(1 if url != reverse('index') else 0):
+                again = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(again.status_code, 304)
+            again = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+            self.assertEqual(again.status_code, 304)
+
+    def test_changes_invalidate(self):
+        etags = {url: self.client.get(url)['ETag'] for url in self.urls}
+        Comment.objects.create(post=self.post, author=self.author, text='Комментарий')
+        for url in self.urls:
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etags[url]).status_code, 200)
+        url = reverse('profile', kwargs={'username': 'volkov'})
+        etag = self.client.get(url)['ETag']
+        Follow.objects.create(user=User.objects.create_user(username="sarah"), author=self.author)
+        self.assertContains(self.client.get(url, HTTP_IF_NONE_MATCH=etag), 'Первый пост')
+
+    def test_authenticated_private(self):
+        self.client.force_login(self.author)
+        response = self.client.get(reverse('index'))
+        self.assertNotIn('ETag', response)
+        self.assertIn('private', response['Cache-Control'])
+
+
+@override_settings(CACHES=settings.TEST_CACHES, THUMBNAIL_WORKERS=0)
+class ThumbnailTestCase(TestCase):
+    """Миниатюры делаются после сохранения поста, до этого показывается оригинал"""
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="sarah", password="12345")
+        image = BytesIO()
+        Image.new('RGB', (50, 50), 'red').save(image, 'PNG')
+        self.post = Post.objects.create(text='Пост с картинкой', author=self.user,
+                                        image=SimpleUploadedFile('image.png', image.getvalue()))
+
+    def test_original_until_ready(self):
+        self.assertContains(self.client.get('/'), self.post.image.url)
+        thumbnails.schedule(self.post)
+        self.assertTrue(thumbnails.complete(self.post.image.name))
+        response = self.client.get('/')
+        self.assertNotContains(response, self.post.image.url)
+        self.assertContains(response, '<source type="image/webp"')
+        self.assertContains(response, 'loading="lazy"')
+        self.assertContains(response, ' 320w, ')
+        self.assertContains(response, thumbnails.ready(self.post.image.name, *thumbnails.GEOMETRIES[0][:1],
+                                                       **thumbnails.GEOMETRIES[0][1]).url)
+
+    def test_variants_in_one_query(self):
+        image = BytesIO()
+        Image.new('RGB', (50, 50), 'green').save(image, 'PNG')
+        other = Post.objects.create(text='Ещё картинка', author=self.user,
+                                    image=SimpleUploadedFile('other.png', image.getvalue()))
+        for post in (self.post, other):
+            thumbnails.schedule(post)
+        names = [self.post.image.name, other.image.name]
+        with self.assertNumQueries(1):
+            found = thumbnails.variants_many(names)
+        self.assertEqual(sorted(found), sorted(names))
+        self.assertEqual([len(found[name]['WEBP']) for name in names], [3, 3])
+
+    @override_settings(THUMBNAIL_WORKERS=2, CACHES={'default': {'BACKEND': 'yatube.filecache.FileCache',
+                                                                'LOCATION': settings.CACHE_DIR}})
+    def test_scheduled_once(self):
+        # задачу этого изображения уже взял другой воркер
+        cache.add(thumbnails._lock_key(self.post.image.name), 1)
+        with mock.patch('posts.thumbnails._pool') as pool:
+            thumbnails.schedule(self.post)
+        pool.assert_not_called()
+        cache.delete(thumbnails._lock_key(self.post.image.name))
+
+    def test_command(self):
+        out = StringIO()
+        call_command('generate_thumbnails', stdout=out)
+        self.assertIn('1', out.getvalue())
+        self.assertTrue(thumbnails.complete(self.post.image.name))
+
+
+@override_settings(CACHES=settings.TEST_CACHES, IMAGE_MAX_SIDE=400)
+class ImageIngestTestCase(TestCase):
+    """Загрузка уменьшается, теряет метаданные, размеры сохраняются в посте"""
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="sarah", password="12345")
+        self.client.force_login(self.user)
+
+    def upload(self, name, image, **params):
+        buffer = BytesIO()
+        image.save(buffer, **params)
+        return SimpleUploadedFile(name, buffer.getvalue())
+
+    def test_jpeg_downscaled_without_exif(self):
+        exif = Image.Exif()
+        exif[0x010f] = 'Camera'
+        photo = self.upload('photo.jpeg', Image.new('RGB', (1600, 1200), 'red'), format='JPEG', exif=exif)
+        self.client.post(reverse('new_post'), {'text': 'Фото', 'image': photo})
+        post = Post.objects.get(text='Фото')
+        self.assertEqual((post.image_width, post.image_height), (400, 300))
+        self.assertTrue(post.image.name.endswith('.jpg'))
+        with Image.open(post.image.path) as stored:
+            self.assertEqual(stored.size, (400, 300))
+            self.assertFalse(stored.getexif())
+
+    def test_transparent_png_kept(self):
+        logo = self.upload('logo.png', Image.new('RGBA', (50, 80), (0, 0, 0, 0)), format='PNG')
+        self.client.post(reverse('new_post'), {'text': 'Лого', 'image': logo})
+        post = Post.objects.get(text='Лого')
+        self.assertEqual((post.image_width, post.image_height), (50, 80))
+        with Image.open(post.image.path) as stored:
+            self.assertEqual(stored.mode, 'RGBA')
+
+
+@override_settings(CACHES=settings.TEST_CACHES, THUMBNAIL_WORKERS=0)
+class ContentAddressedStorageTestCase(TransactionTestCase):
+    """Одинаковые изображения - один файл, он удаляется вместе с последним постом"""
+    def setUp(self):
+        self.user = User.objects.create_user(username="sarah")
+        picture = BytesIO()
+        Image.new('RGB', (30, 30), 'blue').save(picture, 'PNG')
+        self.picture = picture.getvalue()
+
+    def create(self, name):
+        return Post.objects.create(text=name, author=self.user, image=SimpleUploadedFile(name, self.picture))
+
+    def test_shared_file_refcounted(self):
+        first, second = self.create('first.PNG'), self.create('second.png')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertRegex(first.image.name, r'^posts/[0-9a-f]{2}/[0-9a-f]{64}\.png$')
+        storage = first.image.storage
+        first.image.delete(save=False)
+        self.assertTrue(storage.exists(second.image.name))
+        first.delete()
+        self.assertTrue(storage.exists(second.image.name))
+        second.delete()
+        self.assertFalse(storage.exists(second.image.name))
+
+    def test_upload_in_progress_keeps_file(self):
+        post = self.create('first.png')
+        storage = post.image.storage
+        # вторая загрузка того же файла, её пост ещё не зафиксирован
+        name = storage.save('posts/second.png', ContentFile(self.picture))
+        self.assertEqual(name, post.image.name)
+        post.delete()
+        self.assertTrue(storage.exists(name))
+        Post.objects.create(text='second', author=self.user, image=name)
+        Post.objects.all().delete()
+        self.assertFalse(storage.exists(name))
+
+    def test_dedupe_command(self):
+        storage = Post._meta.get_field('image').storage
+        os.makedirs(storage.path('posts'), exist_ok=True)
+        for name in ('posts/old_one.png', 'posts/old_two.png'):
+            with open(storage.path(name), 'wb') as old:
+                old.write(self.picture)
+            Post.objects.create(text=name, author=self.user, image=name)
+        call_command('dedupe_images', stdout=StringIO())
+        names = set(Post.objects.values_list('image', flat=True))
+        self.assertEqual(len(names), 1)
+        name = names.pop()
+        self.assertTrue(storage.exists(name))
+        self.assertFalse(storage.exists('posts/old_one.png'))
+        self.assertFalse(storage.exists('posts/old_two.png'))
+        Post.objects.all().delete()
+        self.assertFalse(storage.exists(name))
+
+
+@override_settings(CACHES=settings.TEST_CACHES)
+class SearchTestCase(TestCase):
+    """Поиск по тексту, автору и группе, индекс следует за правками"""
+    def setUp(self):
+        self.client = Client()
+        self.author = User.objects.create_user(username="volkov")
+        self.group = Group.objects.create(title='Котики', slug='cats', description='Описание')
+        self.post = Post.objects.create(text='Полосатый кот спит', author=self.author, group=self.group)
+        Post.objects.create(text='Собака лает', author=self.author)
+
+    def found(self, query):
+        return [pk for _, pk in fulltext.find(query)]
+
+    def test_search_view(self):
+        response = self.client.get(reverse('search'), {'q': 'полосат'})
+        self.assertContains(response, 'Полосатый кот спит')
+        self.assertNotContains(response, 'Собака лает')
+        self.assertContains(self.client.get(reverse('search'), {'q': 'NEAR("кот' }), 'Ничего не найдено')
+
+    def test_index_follows_changes(self):
+        self.assertEqual(self.found('котики'), [self.post.pk])
+        self.post.text = 'Рыжий кот'
+        self.post.save()
+        self.assertEqual(self.found('полосатый'), [])
+        self.assertEqual(self.found('рыжий'), [self.post.pk])
+        self.group.title = 'Коты'
+        self.group.save()
+        self.assertEqual(self.found('котики'), [])
+        self.author.username = 'sarah'
+        self.author.save()
+        self.assertEqual(len(self.found('sarah')), 2)
+        self.post.delete()
+        self.assertEqual(self.found('рыжий'), [])
+
+    def test_install_restores_insert_trigger(self):
+        # импорт выключил триггер вставки и был прерван
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TRIGGER {fulltext.TABLE}_insert')
+        post = Post.objects.create(text='Пропущенный пост', author=self.author)
+        self.assertEqual(self.found('пропущенный'), [])
+        fulltext.install()
+        self.assertEqual(self.found('пропущенный'), [post.pk])
+        later = Post.objects.create(text='Пропущенный тоже нет', author=self.author)
+        self.assertEqual(sorted(self.found('пропущенный')), [post.pk, later.pk])
+
+    def test_ranked_keyset_pages(self):
+        for i in range(12):
+            Post.objects.create(text='кот ' * (i + 1), author=self.author)
+        first = self.client.get(reverse('search'), {'q': 'кот'}).context['page']
+        self.assertEqual(len(first), 10)
+        second = self.client.get(reverse('search'), {'q': 'кот', 'after': first.next_cursor}).context['page']
+        self.assertEqual(len(second), 3)
+        back = self.client.get(reverse('search'), {'q': 'кот', 'before': second.previous_cursor}).context['page']
+        self.assertEqual([post.pk for post in back], [post.pk for post in first])
+
+    def test_rebuild_and_bench(self):
+        call_command('rebuild_search', stdout=StringIO())
+        self.assertEqual(self.found('собака'), [Post.objects.get(text='Собака лает').pk])
+        out = StringIO()
+        call_command('bench_search', users=5, posts=200, repeat=1, stdout=out)
+        self.assertIn('FTS5', out.getvalue())
+
+
+@override_settings(CACHES=settings.TEST_CACHES)
+class AdminTestCase(TestCase):
+    """Список постов в админке без COUNT(*) по таблице и N+1, действия пачками"""
+    def setUp(self):
+        self.client = Client()
+        self.admin = User.objects.create_superuser(username="admin", email="admin@skynet.com", password="12345")
+        self.client.force_login(self.admin)
+        self.group = Group.objects.create(title='Группа', slug='group', description='Описание')
+        self.posts = [Post.objects.create(text=f'Пост {i}', author=self.admin) for i in range(5)]
+
+    def test_changelists(self):
+        url = reverse('admin:posts_post_changelist')
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(url)
+        Post.objects.create(text='Ещё пост', author=User.objects.create_user(username="sarah"), group=self.group)
+        with CaptureQueriesContext(connection) as more:
+            response = self.client.get(url)
+        self.assertEqual(len(few), len(more))
+        self.assertFalse([query for query in more.captured_queries if 'COUNT(*)' in query['sql']])
+        self.assertContains(response, 'Ещё пост')
+        Comment.objects.create(post=self.posts[0], author=self.admin, text='Комментарий')
+        Follow.objects.create(user=self.admin, author=User.objects.get(username="sarah"))
+        self.assertContains(self.client.get(reverse('admin:posts_comment_changelist')), 'Комментарий')
+        self.assertEqual(self.client.get(reverse('admin:posts_follow_changelist')).status_code, 200)
+        self.assertContains(self.client.get(url, {'q': 'ещё'}), 'Ещё пост')
+
+    def test_date_range_filter(self):
+        old = self.posts[0]
+        Post.objects.filter(pk=old.pk).update(pub_date=datetime.datetime(2019, 5, 1, tzinfo=datetime.timezone.utc))
+        url = reverse('admin:posts_post_changelist')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertFalse([query for query in queries.captured_queries if 'DISTINCT' in query['sql']])
+        self.assertContains(response, '?published=2019')
+        for value, shown in (('2019', [old.pk]), ('2019-05', [old.pk]), ('2019-06', [])):
+            response = self.client.get(url, {'published': value})
+            self.assertEqual([post.pk for post in response.context['cl'].result_list], shown)
+        self.assertContains(self.client.get(url, {'published': '2019'}), '?published=2019-05')
+        self.assertEqual(self.client.get(url, {'published': 'весна'}).status_code, 302)
+
+    def test_move_to_group(self):
+        self.client.post(reverse('admin:posts_post_changelist'), {
+            'action': 'move_to_group', 'group': self.group.pk, 'select_across': 1, 'index': 0,
+            '_selected_action': [self.posts[0].pk]})
+        self.assertEqual(Post.objects.filter(group=self.group).count(), 5)
+        self.assertEqual(Post.objects.get(pk=self.posts[0].pk).version, 2)
+
+    def test_move_without_group(self):
+        url = reverse('admin:posts_post_changelist')
+        Post.objects.update(group=self.group)
+        selected = [post.pk for post in self.posts[:3]]
+        # группа не выбрана и «Без группы» не отмечено - ничего не меняем
+        for data in ({'group': ''}, {'group': self.group.pk, 'without_group': 'on'}):
+            self.client.post(url, {'action': 'move_to_group', 'index': 0, '_selected_action': selected, **data})
+            self.assertEqual(Post.objects.filter(group=self.group).count(), 5)
+            self.assertEqual(Post.objects.get(pk=self.posts[0].pk).version, 1)
+        self.client.post(url, {'action': 'move_to_group', 'group': '', 'without_group': 'on', 'index': 0,
+                               '_selected_action': selected})
+        self.assertEqual(Post.objects.filter(group=None).count(), 3)
+        self.assertEqual(Post.objects.get(pk=self.posts[0].pk).version, 2)
+
+    def test_delete_in_batches(self):
+        url = reverse('admin:posts_post_changelist')
+        selected = [post.pk for post in self.posts[:3]]
+        self.client.post(url, {'action': 'delete_in_batches', 'index': 0, '_selected_action': selected})
+        self.assertEqual(Post.objects.count(), 5)
+        self.client.post(url, {'action': 'delete_in_batches', 'confirm': 'on', 'index': 0,
+                               '_selected_action': selected})
+        self.assertEqual(Post.objects.count(), 2)
+        self.assertEqual(UserStats.objects.get(user=self.admin).post_count, 2)
+
+
+@override_settings(CACHES=settings.TEST_CACHES)
+class ImportTestCase(TestCase):
+    """import_yatube: внешние id сдвигаются за существующие, даты сохраняются, импорт продолжается"""
+    def setUp(self):
+        self.user = User.objects.create_user(username="sarah")
+        self.post = Post.objects.create(text='Старый пост', author=self.user)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, rows):
+        path = os.path.join(self.directory.name, name)
+        with (gzip.open(path, 'wt') if name.endswith('.gz') else open(path, 'w')) as output:
+            if name.endswith('.csv'):
+                output.write(','.join(rows[0]) + '\n')
+                output.writelines(','.join(str(value) for value in row.values()) + '\n' for row in rows)
+            else:
+                output.writelines(json.dumps(row) + '\n' for row in rows)
+        return path
+
+    def test_import(self):
+        users = self.write('users.jsonl', [{'id': 1, 'username': 'ivan'}, {'id': 2, 'username': 'olga'}])
+        groups = self.write('groups.csv', [{'id': 1, 'title': 'Котики', 'slug': 'cats', 'description': ''}])
+        posts = self.write('posts.jsonl.gz', [
+            {'id': 1, 'text': 'Импортный пост', 'author': 1, 'group': 1, 'pub_date': '2019-05-01T10:00:00Z'},
+            {'id': 2, 'text': 'Второй', 'author': 2, 'group': None, 'pub_date': '2019-05-02T10:00:00'}])
+        follows = self.write('follows.jsonl', [{'user': 2, 'author': 1}, {'user': 2, 'author': 1}])
+        comments = self.write('comments.csv', [
+            {'id': 1, 'post': 1, 'author': 2, 'text': 'Мяу', 'created': '2019-05-03T10:00:00Z'}])
+        call_command('import_yatube', users=users, groups=groups, posts=posts, follows=follows,
+                     comments=comments, stdout=StringIO())
+        ivan, olga = User.objects.get(username='ivan'), User.objects.get(username='olga')
+        self.assertEqual(ivan.pk, self.user.pk + 1)
+        imported = Post.objects.get(text='Импортный пост')
+        self.assertEqual(imported.pk, self.post.pk + 1)
+        self.assertEqual((imported.author, imported.group.slug), (ivan, 'cats'))
+        self.assertEqual(imported.pub_date.isoformat(), '2019-05-01T10:00:00+00:00')
+        self.assertEqual(Comment.objects.get(text='Мяу').created.day, 3)
+        self.assertEqual(Follow.objects.filter(user=olga).count(), 1)
+        self.assertEqual(list(TimelineEntry.objects.filter(user=olga).values_list('post_id', flat=True)),
+                         [imported.pk])
+        self.assertEqual(UserStats.objects.get(user=ivan).follower_count, 1)
+        self.assertEqual(fulltext.find('импортный')[0][1], imported.pk)
+        self.assertEqual(fulltext.find('старый')[0][1], self.post.pk)
+        self.assertEqual(Post.objects.create(text='Новый', author=ivan).pk, self.post.pk + 3)
+
+    def test_repairs_killed_import(self):
+        # прерванный импорт оставил базу без триггера вставки
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TRIGGER {fulltext.TABLE}_insert')
+        lost = Post.objects.create(text='Потерянный пост', author=self.user)
+        posts = self.write('posts.jsonl', [{'id': 1, 'text': 'Импортный пост', 'author': self.user.pk}])
+        call_command('import_yatube', posts=posts, stdout=StringIO())
+        self.assertEqual(fulltext.find('потерянный')[0][1], lost.pk)
+        self.assertEqual(len(fulltext.find('импортный')), 1)
+        newer = Post.objects.create(text='Потерянный больше не', author=self.user)
+        self.assertIn(newer.pk, [pk for _, pk in fulltext.find('потерянный')])
+
+    def test_resume(self):
+        users = self.write('users.jsonl', [{'id': 1, 'username': 'ivan'}])
+        rows = [{'id': i, 'text': f'Пост {i}', 'author': 1} for i in range(1, 6)]
+        broken = self.write('posts.jsonl', rows[:3] + [{'id': 4, 'text': 'Без автора'}] + rows[4:])
+        state = os.path.join(self.directory.name, 'state.json')
+        with self.assertRaises(CommandError):
+            call_command('import_yatube', users=users, posts=broken, state=state, batch_size=2, stdout=StringIO())
+        self.assertEqual(Post.objects.filter(author__username='ivan').count(), 2)
+        # триггер вернулся, записанные пачки уже в индексе
+        self.assertEqual(len(fulltext.find('пост')), 3)
+        posts = self.write('posts.jsonl', rows)
+        with open(state) as saved:
+            progress = json.load(saved)
+        # сбой между commit пачки и записью состояния: пачка придёт повторно
+        progress['done']['posts'] = 0
+        with open(state, 'w') as output:
+            json.dump(progress, output)
+        call_command('import_yatube', users=users, posts=posts, state=state, batch_size=2, stdout=StringIO())
+        self.assertEqual(Post.objects.filter(author__username='ivan').count(), 5)
+        self.assertEqual(User.objects.filter(username='ivan').count(), 1)
+        self.assertEqual(UserStats.objects.get(user__username='ivan').post_count, 5)
+
+
+@override_settings(CACHES=settings.TEST_CACHES)
+class BenchViewsTestCase(TransactionTestCase):
+    """seed_load + bench_views: каждый адрес posts/urls.py измерен, данные после прогона прежние"""
+    def test_bench(self):
+        call_command('seed_load', users=30, posts=200, groups=3, follows=5, comments=50, images=0,
+                     stdout=StringIO())
+        self.assertGreater(UserStats.objects.filter(post_count__gt=0).count(), 0)
+        follows = set(Follow.objects.values_list('user_id', 'author_id'))
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'bench.json')
+            call_command('bench_views', repeat=2, output=output, stdout=StringIO())
+            call_command('bench_views', repeat=2, output=output, compare=output, stdout=StringIO())
+            with open(output) as saved:
+                views = json.load(saved)['views']
+        self.assertEqual(set(Follow.objects.values_list('user_id', 'author_id')), follows)
+        self.assertEqual({key.split('[')[0] for key in views}, {pattern.name for pattern in urls.urlpatterns})
+        result = views['index[reader]']
+        self.assertEqual(result['status'], 200)
+        self.assertLessEqual(result['queries'], result['budget'])
+        self.assertLessEqual(result['p50'], result['p99'])
+        self.assertGreater(result['bytes'], 0)
+        self.assertEqual(views['add_comment[reader]']['status'], 302)
+
+
+@override_settings(CACHES=settings.TEST_CACHES)
+class ExportTestCase(TestCase):
+    """Выгрузка постов автора потоком: комментарии при своих постах, число запросов не растёт"""
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="sarah")
+        self.reader = User.objects.create_user(username="john")
+        self.group = Group.objects.create(title='Группа', slug='group', description='Описание')
+        self.first = Post.objects.create(text='Первый', author=self.user, group=self.group)
+        self.second = Post.objects.create(text='Второй, с запятой', author=self.user)
+        Post.objects.create(text='Чужой', author=self.reader)
+        Comment.objects.create(post=self.second, author=self.reader, text='Ответ')
+        Comment.objects.create(post=self.first, author=self.user, text='Сам себе')
+        self.client.force_login(self.user)
+        self.url = reverse('profile_export', kwargs={'username': 'sarah'})
+
+    def read(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_jsonl(self):
+        response = self.client.get(self.url)
+        self.assertTrue(response.streaming)
+        records = [json.loads(line) for line in self.read(response).decode().splitlines()]
+        self.assertEqual([record['text'] for record in records], ['Первый', 'Второй, с запятой'])
+        self.assertEqual(records[0]['group'], {'slug': 'group', 'title': 'Группа'})
+        self.assertEqual([comment['author'] for comment in records[1]['comments']], ['john'])
+        self.assertEqual(records[0]['comments'][0]['text'], 'Сам себе')
+
+    def test_csv_gzip_and_access(self):
+        response = self.client.get(self.url, {'format': 'csv'}, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        rows = list(csv.reader(StringIO(gzip.decompress(self.read(response)).decode())))
+        self.assertEqual([row[0] for row in rows], ['type', 'post', 'comment', 'post', 'comment'])
+        self.assertEqual(rows[3][-1], 'Второй, с запятой')
+        self.client.force_login(self.reader)
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+
+    def test_queries_constant(self):
+        with CaptureQueriesContext(connection) as few:
+            self.read(self.client.get(self.url))
+        for i in range(5):
+            post = Post.objects.create(text=f'Ещё {i}', author=self.user)
+            Comment.objects.create(post=post, author=self.reader, text='Ответ')
+        with CaptureQueriesContext(connection) as more:
+            self.read(self.client.get(self.url))
+        self.assertEqual(len(few), len(more))
+
+    def test_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'sarah.jsonl.gz')
+            call_command('export_posts', 'sarah', output=output)
+            with gzip.open(output, 'rt') as saved:
+                self.assertEqual(len(saved.readlines()), 2)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class FeedsTestCase(TestCase):
+    """RSS и Atom: готовый XML берётся из кеша, пока лента не изменится"""
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.author = User.objects.create_user(username="volkov", first_name="Иван")
+        self.group = Group.objects.create(title='Группа', slug='group', description='Описание')
+        self.post = Post.objects.create(text='Первый пост', author=self.author, group=self.group)
+        self.urls = [reverse(name, kwargs=kwargs) for kwargs, names in (
+            ({}, ('index_rss', 'index_atom')),
+            ({'slug': 'group'}, ('group_rss', 'group_atom')),
+            ({'username': 'volkov'}, ('profile_rss', 'profile_atom')),
+        ) for name in names]
+
+    def test_content(self):
+        response = self.client.get(reverse('group_rss', kwargs={'slug': 'group'}))
+        self.assertEqual(response['Content-Type'], 'application/rss+xml; charset=utf-8')
+        self.assertContains(response, '<title>Yatube: Группа</title>')
+        self.assertContains(response, '<category>Группа</category>')
+        self.assertContains(response, reverse('post', kwargs={'username': 'volkov', 'post_id': self.post.pk}))
+        response = self.client.get(reverse('profile_atom', kwargs={'username': 'volkov'}))
+        self.assertTrue(response['Content-Type'].startswith('application/atom+xml'))
+        self.assertContains(response, '<name>Иван</name>')
+        self.assertContains(response, '<subtitle>Записи volkov</subtitle>')
+        self.assertEqual(self.client.get(reverse('group_rss', kwargs={'slug': 'none'})).status_code, 404)
+
+    def test_cached_and_not_modified(self):
+        for url in self.urls:
+            response = self.client.get(url)
+            with self.assertNumQueries(0 if url.startswith('/feed/') else 1):
+                cached = self.client.get(url)
+            self.assertEqual(cached.content, response.content)
+            self.assertEqual(cached['Last-Modified'], response['Last-Modified'])
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_changes_invalidate(self):
+        etags = {url: self.client.get(url)['ETag'] for url in self.urls}
+        self.post.text = 'Исправленный пост'
+        self.post.save()
+        for url in self.urls:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etags[url])
+            self.assertContains(response, 'Исправленный пост')
+        # подписка не меняет ленту автора
+        url = reverse('profile_rss', kwargs={'username': 'volkov'})
+        etag = self.client.get(url)['ETag']
+        Follow.objects.create(user=User.objects.create_user(username="sarah"), author=self.author)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                   QUERY_BUDGET_RAISE=True, DELTA_POLL_INTERVAL=0.01)
+class DeltaTestCase(TestCase):
+    """Новые записи после курсора: JSON вместо страницы, long-poll до появления записи"""
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.author = User.objects.create_user(username="volkov")
+        self.reader = User.objects.create_user(username="sarah")
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.group = Group.objects.create(title='Группа', slug='group', description='Описание')
+        self.old = Post.objects.create(text='Старый пост', author=self.author, group=self.group)
+
+    def since(self, url):
+        return self.client.get(url).json()['cursor']
+
+    def test_new_posts(self):
+        self.client.force_login(self.reader)
+        urls = [reverse('index_delta'), reverse('group_delta', kwargs={'slug': 'group'}),
+                reverse('follow_delta')]
+        cursors = {url: self.since(url) for url in urls}
+        self.assertEqual(self.client.get(urls[0], {'since': cursors[urls[0]]}).json()['count'], 0)
+        new = Post.objects.create(text='Новый пост', author=self.author, group=self.group)
+        Post.objects.create(text='Чужой пост', author=self.reader)
+        for url in urls:
+            data = self.client.get(url, {'since': cursors[url]}).json()
+            self.assertEqual(data['posts'][0]['id'], new.pk)
+            self.assertEqual(data['count'], 2 if url == urls[0] else 1)
+            self.assertEqual(self.client.get(url, {'since': data['cursor']}).json()['count'], 0)
+        data = self.client.get(urls[0], {'since': cursors[urls[0]], 'count': 1}).json()
+        self.assertEqual((data['count'], data['cursor']), (2, cursors[urls[0]]))
+        self.assertNotIn('posts', data)
+        self.assertEqual(self.client.get(urls[0], {'since': 'испорчен'}).status_code, 400)
+
+    def test_limit(self):
+        since = self.since(reverse('index_delta'))
+        for i in range(delta.DELTA_LIMIT + 1):
+            Post.objects.create(text=f'Пост {i}', author=self.author)
+        data = self.client.get(reverse('index_delta'), {'since': since}).json()
+        self.assertEqual((data['count'], data['more']), (delta.DELTA_LIMIT, True))
+        self.assertEqual(data['posts'][-1]['text'], f'Пост {delta.DELTA_LIMIT - 1}')
+        data = self.client.get(reverse('index_delta'), {'since': data['cursor']}).json()
+        self.assertEqual((data['count'], data['more']), (1, False))
+
+    def test_long_poll(self):
+        url = reverse('group_delta', kwargs={'slug': 'group'})
+        since = self.since(url)
+        started = time.monotonic()
+        self.assertEqual(self.client.get(url, {'since': since, 'wait': 0.1}).json()['count'], 0)
+        self.assertGreaterEqual(time.monotonic() - started, 0.1)
+
+        def publish(seconds):
+            # пока запрос ждёт, в группе появляется пост; его запросы не в бюджете
+            with unmetered():
+                Post.objects.create(text='Пока ждали', author=self.author, group=self.group)
+        with mock.patch('posts.delta.time.sleep', side_effect=publish) as sleep:
+            data = self.client.get(url, {'since': since, 'wait': 20}).json()
+        self.assertEqual(sleep.call_count, 1)
+        self.assertEqual(data['posts'][0]['text'], 'Пока ждали')
+
+    def test_long_poll_edits(self):
+        url = reverse('group_delta', kwargs={'slug': 'group'})
+        since = self.since(url)
+
+        def edit(seconds):
+            # правки меняют поколение ленты, но новых записей не добавляют
+            with unmetered():
+                self.old.text = f'Правка {sleep.call_count}'
+                self.old.save()
+                if sleep.call_count == 6:
+                    Post.objects.create(text='Наконец новый', author=self.author, group=self.group)
+        with mock.patch('posts.delta.time.sleep', side_effect=edit) as sleep:
+            data = self.client.get(url, {'since': since, 'wait': 20}).json()
+        self.assertEqual(sleep.call_count, 6)
+        self.assertEqual([post['text'] for post in data['posts']], ['Наконец новый'])
+
+
+def plain_view(request):
+    if request.method == 'POST':
+        Group.objects.create(title='Новая', slug='new', description='')
+    return HttpResponse(router.db_for_read(Post))
+
+
+@read_replica
+def replica_view(request):
+    return plain_view(request)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                   DATABASE_REPLICAS=['replica'])
+class ReplicaRouterTestCase(TestCase):
+    """Чтения с реплики, только если она догнала записи, и не для того, кто только что писал"""
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.middleware = ReplicaMiddleware(self.handle)
+
+    def handle(self, request):
+        self.middleware.process_view(request, request.view, (), {})
+        return request.view(request)
+
+    def get(self, view=replica_view, method='get', **cookies):
+        request = getattr(self.factory, method)('/')
+        request.COOKIES.update(cookies)
+        request.view = view
+        return self.middleware(request)
+
+    def test_routing(self):
+        # реплика ещё ни разу не синхронизирована
+        self.assertEqual(self.get().content, b'default')
+        cache.set('db_router:synced:replica', time.time())
+        # отметка о последней записи вытеснена: реплике не верим
+        self.assertEqual(self.get().content, b'default')
+        cache.set('db_router:last_write', time.time() - 1)
+        self.assertEqual(self.get().content, b'replica')
+        self.assertEqual(self.get(view=plain_view).content, b'default')
+        self.assertEqual(router.db_for_read(Post), 'default')
+
+        response = self.get(method='post')
+        self.assertEqual(response.content, b'default')
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], settings.REPLICA_PIN_SECONDS)
+        # реплика отстала от записи, а писавший закреплён за основной базой и после синхронизации
+        self.assertEqual(self.get().content, b'default')
+        cache.set('db_router:synced:replica', time.time())
+        self.assertEqual(self.get().content, b'replica')
+        self.assertEqual(self.get(**{PIN_COOKIE: '1'}).content, b'default')
+
+
+class ReplicaCopyTestCase(TransactionTestCase):
+    """Файловая реплика - снимок основной базы с heartbeat; снимок не снять
+    из открытой транзакции TestCase"""
+    def test_copy_and_lag(self):
+        Post.objects.create(text='Скопированный пост', author=User.objects.create_user(username='volkov'))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'replica.sqlite3')
+            copy_database(path)
+            copied = sqlite3.connect(path)
+            try:
+                self.assertEqual(copied.execute('SELECT text FROM posts_post').fetchall(),
+                                 [('Скопированный пост',)])
+                self.assertLess(time.time() - read_beat(copied.cursor()), 5)
+            finally:
+                copied.close()
+
+
+class SqliteBackendTestCase(TestCase):
+    """Соединения SQLite: WAL и прагмы, транзакции с BEGIN IMMEDIATE, нагрузка без блокировок"""
+    def test_pragmas(self):
+        with connection.cursor() as cursor:
+            self.assertEqual(cursor.execute('PRAGMA synchronous').fetchone()[0], 1)
+            self.assertEqual(cursor.execute('PRAGMA busy_timeout').fetchone()[0], 5000)
+        self.assertEqual(connection.transaction_mode(), 'IMMEDIATE')
+
+    def test_form_page_without_transaction(self):
+        # BEGIN IMMEDIATE держит блокировку записи: GET формы без транзакции
+        self.client.force_login(User.objects.create_user(username='volkov'))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(reverse('new_post')).status_code, 200)
+        self.assertFalse([query for query in queries if query['sql'].startswith('SAVEPOINT')])
+
+    def test_stress(self):
+        with tempfile.TemporaryDirectory() as directory:
+            env = dict(os.environ, YATUBE_DB=os.path.join(directory, 'stress.sqlite3'),
+                       YATUBE_CACHE_DIR=os.path.join(directory, 'cache'))
+            manage = [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py')]
+            subprocess.run(manage + ['migrate', '-v0'], env=env, check=True)
+            done = subprocess.run(
+                manage + ['stress_sqlite', '--processes', '2', '--threads', '3', '--seconds', '1',
+                          '--write-share', '0.5', '--fail-on-errors'],
+                env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+            self.assertEqual(done.returncode, 0, done.stdout)
+            self.assertIn('journal_mode=wal, BEGIN IMMEDIATE', done.stdout)
+            self.assertIn('ошибок: 0', done.stdout)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'yatube.metrics.MeteredLocMemCache'}})
+class MetricsTestCase(TestCase):
+    """Метрики копятся по процессам в файлах и суммируются на /metrics"""
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        override = override_settings(METRICS_DIR=self.directory)
+        override.enable()
+        self.addCleanup(override.disable)
+        metrics.registry.clear()
+        self.client = Client()
+        self.staff = User.objects.create_user(username='admin', is_staff=True)
+        Post.objects.create(text='Первый пост', author=User.objects.create_user(username='volkov'))
+
+    def value(self, text, sample):
+        found = re.search(re.escape(sample) + r' (\S+)', text)
+        return float(found.group(1)) if found else None
+
+    def test_exposition(self):
+        for _ in range(2):
+            self.client.get(reverse('index'))
+        # значения соседнего процесса
+        with open(os.path.join(self.directory, '1-0.json'), 'w') as other:
+            json.dump([['yatube_requests_total', {'view': 'index', 'method': 'GET', 'status': '200'}, 3]], other)
+        self.assertEqual(self.client.get('/metrics').status_code, 302)
+        self.client.force_login(self.staff)
+        response = self.client.get('/metrics')
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = response.content.decode()
+        self.assertIn('# TYPE yatube_request_duration_seconds histogram', text)
+        self.assertEqual(self.value(text, 'yatube_requests_total{method="GET",status="200",view="index"}'), 5)
+        self.assertEqual(self.value(text, 'yatube_request_duration_seconds_bucket{view="index",le="+Inf"}'), 2)
+        self.assertEqual(self.value(text, 'yatube_fragment_cache_total{fragment="index_page",result="miss"}'), 1)
+        self.assertEqual(self.value(text, 'yatube_fragment_cache_total{fragment="index_page",result="hit"}'), 1)
+        self.assertGreater(self.value(text, 'yatube_db_queries_total{view="index"}'), 0)
+        self.assertGreater(self.value(text, 'yatube_template_render_seconds_total{view="index"}'), 0)
+        self.assertGreater(self.value(text, 'yatube_response_size_bytes_sum{view="index"}'), 1000)
+
+
+class ProfilingTestCase(TestCase):
+    """Профиль снимается по ссылке, для сотрудника и сводится командой"""
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        override = override_settings(PROFILE_DIR=self.directory, PROFILE_SAMPLER_INTERVAL=0.0005)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.client = Client()
+        self.author = User.objects.create_user(username='volkov')
+        Post.objects.create(text='Первый пост', author=self.author)
+
+    def saved(self, view):
+        directory = os.path.join(self.directory, view)
+        return sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+
+    def test_signed_link(self):
+        path = reverse('profile', kwargs={'username': 'volkov'})
+        self.client.get(path)
+        self.client.get(path, {'_profile': '1'})
+        self.client.get(path, {'_profile': profiling.sign('/other/')})
+        self.assertEqual(os.listdir(self.directory), [])
+        out = StringIO()
+        call_command('profile_link', path, '--mode', 'cprofile', stdout=out)
+        for _ in range(2):
+            self.assertEqual(self.client.get(out.getvalue().strip()).status_code, 200)
+        files = self.saved('profile')
+        self.assertEqual([name.rsplit('.', 1)[1] for name in files], ['json', 'prof'] * 2)
+        with open(os.path.join(self.directory, 'profile', files[0])) as meta:
+            tags = json.load(meta)
+        self.assertEqual((tags['reason'], tags['mode'], tags['status']), ('link', 'cprofile', 200))
+        self.assertGreater(tags['queries'], 0)
+        self.assertGreater(tags['template_seconds'], 0)
+
+    def test_staff_sampler_and_report(self):
+        staff = User.objects.create_user(username='admin', is_staff=True)
+        self.client.force_login(staff)
+        self.client.get(reverse('follow_index'), {'_profile': '1'})
+        self.assertEqual([name.rsplit('.', 1)[1] for name in self.saved('follow_index')], ['collapsed', 'json'])
+        with override_settings(PROFILE_SAMPLE_RATE=1):
+            self.client.get(reverse('index'), {'_profile_mode': 'cprofile'})
+        self.assertEqual(len(self.saved('index')), 2)
+        flamegraph = os.path.join(self.directory, 'flame.txt')
+        out = StringIO()
+        call_command('profile_report', '--flamegraph', flamegraph, stdout=out)
+        report = out.getvalue()
+        self.assertIn('follow_index', report)
+        self.assertIn('index', report)
+        self.assertIn('function calls', report)
+        self.assertTrue(os.path.exists(flamegraph))
+        with self.assertRaises(CommandError):
+            call_command('profile_report', '--view', 'group', stdout=StringIO())
+
+
+class FollowGraphTestCase(TestCase):
+    """Подписки проверяются по множествам в кеше, без запросов на каждого автора"""
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.reader = User.objects.create_user(username='sarah')
+        self.client.force_login(self.reader)
+        self.authors = [User.objects.create_user(username=f'author_{n}') for n in range(3)]
+        for author in self.authors + [self.reader]:
+            Post.objects.create(text=f'Пост {author.username}', author=author)
+
+    def test_follow_and_unfollow(self):
+        volkov = self.authors[0]
+        self.client.get(reverse('profile_follow', kwargs={'username': volkov.username}))
+        self.assertTrue(follows.is_following(self.reader.pk, volkov.pk))
+        with self.assertNumQueries(0):
+            self.assertEqual(follows.following_map(self.reader.pk, [author.pk for author in self.authors]),
+                             {volkov.pk: True, self.authors[1].pk: False, self.authors[2].pk: False})
+        response = self.client.get(reverse('profile', kwargs={'username': volkov.username}))
+        self.assertContains(response, 'Отписаться')
+        self.client.get(reverse('profile_unfollow', kwargs={'username': volkov.username}))
+        self.assertFalse(follows.is_following(self.reader.pk, volkov.pk))
+
+    def test_feed_buttons(self):
+        Follow.objects.create(user=self.reader, author=self.authors[0])
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, reverse('profile_unfollow', kwargs={'username': 'author_0'}))
+        for author in self.authors[1:]:
+            self.assertContains(response, reverse('profile_follow', kwargs={'username': author.username}))
+        self.assertContains(response, 'Редактировать', count=1)
+        self.assertNotContains(Client().get(reverse('index')), 'Подписаться')
+
+    def test_bulk_load(self):
+        self.assertFalse(follows.is_following(self.reader.pk, self.authors[1].pk))
+        Follow.objects.bulk_create([Follow(user=self.reader, author=self.authors[1])])
+        # устаревшее множество не ломает подписку
+        response = self.client.get(reverse('profile_follow', kwargs={'username': 'author_1'}))
+        self.assertEqual(response.status_code, 302)
+        follows.reset()
+        self.assertTrue(follows.is_following(self.reader.pk, self.authors[1].pk))
+
+
+def _increment(location):
+    cache_backend = FileCache(location, {})
+    for _ in range(50):
+        cache_backend.incr('counter')
+
+
+class FileCacheTestCase(TestCase):
+    """Файловый кеш общий для процессов: add() и incr() не теряют гонку"""
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.location = directory.name
+        self.cache = FileCache(self.location, {})
+
+    def test_add(self):
+        self.assertTrue(self.cache.add('lock', 1, 60))
+        self.assertFalse(FileCache(self.location, {}).add('lock', 2, 60))
+        self.assertEqual(self.cache.get('lock'), 1)
+        self.cache.set('lock', 1, -1)
+        self.assertTrue(self.cache.add('lock', 3, 60))
+        self.assertEqual(self.cache.get('lock'), 3)
+
+    def test_incr_from_processes(self):
+        self.cache.set('counter', 0, None)
+        processes = [multiprocessing.get_context('fork').Process(target=_increment, args=(self.location,))
+                     for _ in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        self.assertEqual(self.cache.get('counter'), 200)
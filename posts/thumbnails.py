@@ -0,0 +1,225 @@
+"""Миниатюры изображений постов заранее, в пуле процессов.
+
+Каждое изображение режется один раз в набор ширин WIDTHS в форматах
+WebP и JPEG для <picture>/srcset: телефон берёт узкий вариант.
+
+sorl делает миниатюру при первой отрисовке {% thumbnail %}, и Pillow
+работает внутри запроса первого читателя, а одновременные читатели
+режут одно изображение по нескольку раз. Здесь размеры из шаблонов
+(GEOMETRIES) готовятся сразу после сохранения поста в ограниченном пуле
+процессов, одно изображение - одна задача. Пока миниатюры нет, шаблоны
+показывают исходное изображение (тег post_picture из post_fragments).
+
+Готовность всех вариантов всех изображений страницы проверяет
+variants_many(): одно чтение кеша sorl и один запрос к kvstore вместо
+запроса на каждый размер каждой карточки.
+"""
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import EMPTY_VALUE
+from sorl.thumbnail.kvstores.cached_db_kvstore import KVStore as CachedDBKVStore
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from yatube import metrics
+from yatube.querybudget import unmetered
+
+from . import cache as feed_cache
+
+logger = logging.getLogger(__name__)
+
+# варианты для srcset: ширины, пропорции кадра и форматы по убыванию предпочтения
+WIDTHS = (320, 640, 960)
+FRAME = (960, 339)
+FORMATS = ("WEBP", "JPEG")
+QUALITY = 80
+
+
+def geometry_for(width):
+    return f"{width}x{round(width * FRAME[1] / FRAME[0])}"
+
+
+def options_for(image_format):
+    return {"crop": "center", "upscale": True, "format": image_format, "quality": QUALITY}
+
+
+GEOMETRIES = [(geometry_for(width), options_for(image_format))
+              for image_format in FORMATS for width in WIDTHS]
+# сколько держится отметка о задаче, если процесс с ней упал
+LOCK_TIMEOUT = 300
+
+_executor = None
+_pending = set()
+_lock = threading.Lock()
+
+
+def workers():
+    """Размер пула; 0 - делать миниатюры сразу, в том же процессе"""
+    return getattr(settings, "THUMBNAIL_WORKERS", 2)
+
+
+def _thumbnail_file(name, geometry, options):
+    # имя файла и параметры такие же, как у sorl.get_thumbnail
+    backend = default.backend
+    source = ImageFile(name)
+    options = dict(options)
+    if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault("format", backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(sorl_settings, attr)
+        if value != getattr(sorl_defaults, attr):
+            options.setdefault(key, value)
+    name = backend._get_thumbnail_filename(source, geometry, options)
+    return ImageFile(name, default.storage), options
+
+
+def ready(name, geometry, **options):
+    """Готовая миниатюра из kvstore sorl или None, пока её нет"""
+    return default.kvstore.get(_thumbnail_file(name, geometry, options)[0])
+
+
+def _raw_values(keys):
+    """Значения kvstore по ключам: get_many кеша sorl, недостающие - одним запросом"""
+    kvstore = default.kvstore
+    if not isinstance(kvstore, CachedDBKVStore):
+        return {key: kvstore._get_raw(key) for key in keys}
+    values = kvstore.cache.get_many(keys)
+    missing = set(keys) - values.keys()
+    if missing:
+        stored = dict(KVStoreModel.objects.filter(key__in=missing).values_list("key", "value"))
+        # как и sorl, запоминаем и отсутствие ключа: generate() его перезапишет
+        kvstore.cache.set_many({key: stored.get(key, EMPTY_VALUE) for key in missing},
+                               sorl_settings.THUMBNAIL_CACHE_TIMEOUT)
+        values.update(stored)
+    return {key: value for key, value in values.items() if value != EMPTY_VALUE}
+
+
+def _lookup(names):
+    files = {
+        name: [(image_format, width, _thumbnail_file(name, geometry_for(width), options_for(image_format))[0])
+               for image_format in FORMATS for width in WIDTHS]
+        for name in names
+    }
+    values = _raw_values([add_prefix(thumbnail.key) for found in files.values() for *_, thumbnail in found])
+    result = {}
+    for name, found in files.items():
+        result[name] = {}
+        for image_format, width, thumbnail in found:
+            value = values.get(add_prefix(thumbnail.key))
+            if not value:
+                result[name] = None
+                break
+            result[name].setdefault(image_format, []).append((width, deserialize_image_file(value)))
+    return result
+
+
+def variants_many(names):
+    """{имя изображения: variants()} для всех изображений сразу"""
+    result = _lookup(set(names))
+    for found in result.values():
+        metrics.registry.inc("yatube_thumbnail_lookups_total", {"result": "miss" if found is None else "hit"})
+    return result
+
+
+def variants(name):
+    """{формат: [(ширина, миниатюра), ...]} или None, пока готовы не все"""
+    return variants_many([name])[name]
+
+
+def complete(name):
+    """Все ли размеры из GEOMETRIES уже есть"""
+    return _lookup([name])[name] is not None
+
+
+def generate(name):
+    """Все размеры из GEOMETRIES; готовые файлы sorl только заносит в kvstore"""
+    for geometry, options in GEOMETRIES:
+        get_thumbnail(name, geometry, **options)
+
+
+def _render(name):
+    # в процессе пула только Pillow и файлы; kvstore в базе заполняет
+    # родитель через generate(), когда файлы уже есть
+    source = ImageFile(name)
+    for geometry, options in GEOMETRIES:
+        thumbnail, options = _thumbnail_file(name, geometry, options)
+        if thumbnail.exists():
+            continue
+        image = default.engine.get_image(source)
+        try:
+            options["image_info"] = default.engine.get_image_info(image)
+            default.backend._create_thumbnail(image, geometry, options, thumbnail)
+        finally:
+            default.engine.cleanup(image)
+
+
+def _pool():
+    global _executor
+    with _lock:
+        if _executor is None:
+            # spawn, а не fork: веб-сервер многопоточный
+            _executor = ProcessPoolExecutor(
+                max_workers=workers(), mp_context=multiprocessing.get_context("spawn"),
+                initializer=django.setup)
+        return _executor
+
+
+def _lock_key(name):
+    return f"thumbnail_job:{name}"
+
+
+def schedule(post):
+    """Поставить миниатюры изображения поста в пул; повторные задачи отбрасываются"""
+    name = post.image.name
+    if not name or complete(name):
+        return
+    feeds = feed_cache.post_feeds(post)
+    if not workers():
+        # как и в пуле: без миниатюр лента покажет исходное изображение;
+        # в бюджет запроса эта работа не входит, обычно её делает пул
+        try:
+            with unmetered():
+                generate(name)
+        except Exception:
+            logger.exception("Thumbnail generation failed for %s", name)
+            return
+        feed_cache.bump(*feeds)
+        return
+    with _lock:
+        # _pending - задачи этого процесса, ключ в общем кеше - задачи других
+        # воркеров; cache.add атомарен и в FileCache, и в memcached
+        if name in _pending or not cache.add(_lock_key(name), 1, LOCK_TIMEOUT):
+            return
+        _pending.add(name)
+    future = _pool().submit(_render, name)
+    future.add_done_callback(lambda done: _finished(done, name, feeds))
+
+
+def _finished(future, name, feeds):
+    try:
+        future.result()
+        # файлы уже на диске, sorl только запишет их в kvstore
+        generate(name)
+        # ленты с исходным изображением закешированы, сбросим их
+        feed_cache.bump(*feeds)
+    except Exception:
+        logger.exception("Thumbnail generation failed for %s", name)
+    finally:
+        with _lock:
+            _pending.discard(name)
+        cache.delete(_lock_key(name))
+        # колбэк идёт в служебном потоке пула, его соединение больше не нужно
+        connections.close_all()
@@ -0,0 +1,145 @@
+"""Лента подписок, материализованная при записи (fan-out-on-write).
+
+Новый пост сразу раскладывается в TimelineEntry всех подписчиков автора,
+поэтому follow_index читает ленту диапазоном по индексу (user, pub_date).
+Авторов, у которых подписчиков больше FEED_FANOUT_LIMIT, не раскладываем:
+их посты подмешиваются в ленту при чтении (fan-out-on-read). Когда такой
+автор теряет подписчиков и возвращается к пределу, посты, вышедшие без
+раскладки, раскладываются по лентам всех его подписчиков (restore_author).
+"""
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count
+
+from .models import Follow, Post, TimelineEntry, UserStats
+from .pagination import source
+
+BATCH_SIZE = 500
+
+
+def fanout_limit():
+    return getattr(settings, "FEED_FANOUT_LIMIT", 1000)
+
+
+def is_fanout_author(author_id):
+    # счётчик из UserStats вместо COUNT по таблице подписок
+    return not UserStats.objects.filter(user_id=author_id, follower_count__gt=fanout_limit()).exists()
+
+
+def _insert(entries):
+    TimelineEntry.objects.bulk_create(entries, batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+
+def fanout_post(post):
+    """Разложить новый пост по лентам подписчиков автора"""
+    if not is_fanout_author(post.author_id):
+        return
+    followers = Follow.objects.filter(author_id=post.author_id).values_list("user_id", flat=True)
+    entries = []
+    for user_id in followers.iterator():
+        entries.append(TimelineEntry(user_id=user_id, post_id=post.pk, pub_date=post.pub_date))
+        if len(entries) >= BATCH_SIZE:
+            _insert(entries)
+            entries = []
+    _insert(entries)
+
+
+def backfill(user_id, author_id):
+    """Добавить в ленту нового подписчика уже опубликованные посты автора"""
+    if is_fanout_author(author_id):
+        _copy_posts(user_id, author_id)
+
+
+def _copy_posts(user_id, author_id):
+    posts = Post.objects.filter(author_id=author_id).values_list("pk", "pub_date")
+    entries = []
+    for post_id, pub_date in posts.iterator():
+        entries.append(TimelineEntry(user_id=user_id, post_id=post_id, pub_date=pub_date))
+        if len(entries) >= BATCH_SIZE:
+            _insert(entries)
+            entries = []
+    _insert(entries)
+
+
+def prune(user_id, author_id):
+    """Убрать посты автора из ленты отписавшегося пользователя"""
+    TimelineEntry.objects.filter(user_id=user_id, post__author_id=author_id).delete()
+
+
+def author_unfollowed(author_id):
+    """Подписка на автора удалена. Если он перестал быть «звездой», его посты больше
+    не подмешиваются при чтении - разложим их после фиксации: при каскадном удалении
+    автора к тому времени не останется ни постов, ни подписок"""
+    transaction.on_commit(lambda: _restore_if_fanout(author_id))
+
+
+def _restore_if_fanout(author_id):
+    if UserStats.objects.filter(user_id=author_id, follower_count=fanout_limit()).exists():
+        restore_author(author_id)
+
+
+def restore_author(author_id):
+    """Разложить все посты автора по лентам его подписчиков, пропуская уже
+    разложенные; возвращает число добавленных записей"""
+    quote = connection.ops.quote_name
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f"{connection.ops.insert_statement(ignore_conflicts=True)} {quote(TimelineEntry._meta.db_table)} "
+            f"(user_id, post_id, pub_date) "
+            f"SELECT f.user_id, p.id, p.pub_date FROM {quote(Follow._meta.db_table)} f "
+            f"JOIN {quote(Post._meta.db_table)} p ON p.author_id = f.author_id "
+            f"WHERE f.author_id = %s ORDER BY f.user_id, p.id "
+            f"{connection.ops.ignore_conflicts_suffix_sql(ignore_conflicts=True)}",
+            [author_id],
+        )
+        return cursor.rowcount
+
+
+def rebuild(user_ids=None):
+    """Пересобрать ленты пользователей с нуля, возвращает число записей"""
+    follows = Follow.objects.all()
+    entries = TimelineEntry.objects.all()
+    if user_ids is not None:
+        follows = follows.filter(user_id__in=user_ids)
+        entries = entries.filter(user_id__in=user_ids)
+    entries.delete()
+    celebrities = set(
+        Follow.objects.values("author_id")
+        .annotate(followers=Count("id"))
+        .filter(followers__gt=fanout_limit())
+        .values_list("author_id", flat=True)
+    )
+    follows = follows.exclude(author_id__in=celebrities).values_list("user_id", "author_id")
+    # одним INSERT ... SELECT в базе: строки лент не проходят через Python,
+    # а порядок по user_id держит вставку в индексы лент локальной
+    sql, params = follows.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {TimelineEntry._meta.db_table} (user_id, post_id, pub_date) "
+            f"SELECT f.user_id, p.id, p.pub_date FROM ({sql}) f "
+            f"JOIN {Post._meta.db_table} p ON p.author_id = f.author_id ORDER BY f.user_id, p.id",
+            params,
+        )
+    return entries.count()
+
+
+def celebrity_authors(user):
+    """Авторы из подписок пользователя, чьи посты читаются при запросе"""
+    followees = Follow.objects.filter(user=user).values("author_id")
+    return list(
+        UserStats.objects.filter(user_id__in=followees, follower_count__gt=fanout_limit())
+        .values_list("user_id", flat=True)
+    )
+
+
+def follow_feed_sources(user):
+    """Источники для paginate(): материализованная лента и посты «звёзд»"""
+    sources = [source(
+        TimelineEntry.objects.filter(user=user),
+        id_field="post_id",
+        posts=Post.objects.for_feed(),
+    )]
+    celebrities = celebrity_authors(user)
+    if celebrities:
+        sources.append(Post.objects.for_feed().filter(author_id__in=celebrities))
+    return sources
@@ -1,12 +1,22 @@
 from django.urls import path
 
-from . import views
+from . import delta, feeds, views
 
 urlpatterns = [   
     path("", views.index, name="index"),
     path("group/<slug>/", views.group_posts, name="group"),
     path("new/", views.new_post, name="new_post"),
     path("follow/", views.follow_index, name="follow_index"),
+    path("search/", views.search, name="search"),
+    # новые записи лент в JSON
+    path("delta/", delta.index_delta, name="index_delta"),
+    path("group/<slug>/delta/", delta.group_delta, name="group_delta"),
+    path("follow/delta/", delta.follow_delta, name="follow_delta"),
+    # RSS и Atom
+    path("feed/rss/", feeds.index_rss, name="index_rss"),
+    path("feed/atom/", feeds.index_atom, name="index_atom"),
+    path("group/<slug>/rss/", feeds.group_rss, name="group_rss"),
+    path("group/<slug>/atom/", feeds.group_atom, name="group_atom"),
     path("<username>/", views.profile, name="profile"),
     # Просмотр записи  
     path("<username>/<int:post_id>/", views.post_view, name="post"),
@@ -14,4 +24,7 @@ urlpatterns = [
     path("<username>/<int:post_id>/comment/", views.add_comment, name="add_comment"),    
     path("<username>/follow", views.profile_follow, name="profile_follow"), 
     path("<username>/unfollow", views.profile_unfollow, name="profile_unfollow"),
+    path("<username>/export/", views.profile_export, name="profile_export"),
+    path("<username>/rss/", feeds.profile_rss, name="profile_rss"),
+    path("<username>/atom/", feeds.profile_atom, name="profile_atom"),
 ]
@@ -1,28 +1,53 @@
-from django.core.paginator import Paginator
 from django.shortcuts import render, get_object_or_404
 from django.shortcuts import redirect
+from django.http import Http404, StreamingHttpResponse
+from django.middleware.gzip import re_accepts_gzip
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence
 from .models import Post, Group, User, Comment, Follow
 from .forms import PostForm, CommentForm
+from .pagination import paginate
+from . import cache, export, follows, fulltext, stats, timeline
+from .conditional import group_feeds, index_feeds, profile_feeds, public_page
 from django.contrib.auth.decorators import login_required
+from django.db import IntegrityError, transaction
+from yatube.db_router import read_replica
+from yatube.querybudget import query_budget
 
 
+# сессия и читатель, посты, миниатюры страницы одним запросом, подписки читателя
+@read_replica
+@query_budget(5)
+@public_page(index_feeds)
 def index(request):
-    post_list = Post.objects.order_by("-pub_date").all()
-    paginator = Paginator(post_list, 10) # показывать по 10 записей на странице.
-    page_number = request.GET.get('page') # переменная в URL с номером запрошенной страницы
-    page = paginator.get_page(page_number) # получить записи с нужным смещением
-    return render(request, 'posts/index.html', {'page': page, 'paginator': paginator})
+    # поколение - до чтения постов: запись между ними попадёт в следующее
+    feed_version = cache.feed_version(cache.INDEX)
+    post_list = Post.objects.for_feed()
+    paginator, page = paginate(request, post_list) # по 10 записей, курсор в ?after= / ?before=
+    return render(request, 'posts/index.html', {'page': page, 'paginator': paginator, 'feed_version': feed_version})
 
 
+@read_replica
+@query_budget(6)
+@public_page(group_feeds)
 def group_posts(request, slug): 
     group = get_object_or_404(Group, slug=slug)
-    posts = Post.objects.filter(group=group).order_by("-pub_date")[:12]
-    paginator = Paginator(posts, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
-    return render(request, "group.html", {"group": group, 'page': page, 'paginator': paginator}) 
+    feed_version = cache.feed_version(cache.group_feed(group.pk))
+    posts = Post.objects.for_feed().filter(group=group)
+    paginator, page = paginate(request, posts)
+    return render(request, "group.html", {"group": group, 'page': page, 'paginator': paginator,
+                                          'feed_version': feed_version}) 
 
 
+# поиск и посты по id, дальше как у index
+@query_budget(6)
+def search(request):
+    query = request.GET.get("q", "").strip()
+    paginator, page = fulltext.paginate(request, query)
+    return render(request, "posts/search.html", {"query": query, "page": page, "paginator": paginator})
+
+
+@query_budget(15)
 def new_post(request):
     user = request.user
     form = PostForm(request.POST or None, files=request.FILES or None)
@@ -30,46 +55,48 @@ def new_post(request):
         return redirect(index)
     if request.method == 'POST':
         if form.is_valid():
-            n_post = form.save(commit=False)
-            n_post.author = user
-            n_post.save()
+            # в транзакции только запись: разбор и уменьшение изображения в
+            # clean_image идут до неё и не держат блокировку записи SQLite
+            with transaction.atomic():
+                n_post = form.save(commit=False)
+                n_post.author = user
+                n_post.save()
             return redirect('index')
         return render(request, 'posts/new_post.html', {'form': form})        
     form = PostForm()
     return render(request, 'posts/new_post.html', {'form': form})   
     
 
+@read_replica
+@query_budget(9)
+@public_page(profile_feeds)
 def profile(request, username):   
     author = get_object_or_404(User, username = username)
-    post_list = Post.objects.filter(author = author).order_by('-pub_date')
-    paginator = Paginator(post_list, 10) # показывать по 10 записей на странице.
-    page_number = request.GET.get('page') # переменная в URL с номером запрошенной страницы
-    page = paginator.get_page(page_number) # получить записи с нужным смещением
+    feed_version = cache.feed_version(cache.profile_feed(author.pk))
+    post_list = Post.objects.for_feed().filter(author = author)
+    paginator, page = paginate(request, post_list)
     first_post = Post.objects.filter(author = author).order_by('-pub_date')[:1]
-    followers = Follow.objects.filter()
-    count_followers = Follow.objects.filter(author=author).count()
-    count_followering = Follow.objects.filter(user=author).count()   
-    if request.user.is_authenticated:
-        following = Follow.objects.filter(author=author, user=request.user)     
-    else:
-        following = []
-    count = post_list.count
-    return render(request, "posts/profile.html", {'count':count, 'author':author, 'page': page, 
-                  'paginator': paginator, 'count_followers': count_followers, 
-                  "following": following, 'count_followering': count_followering, 'first_post': first_post})
+    author_stats = stats.stats_for(author)
+    following = request.user.is_authenticated and follows.is_following(request.user.pk, author.pk)
+    return render(request, "posts/profile.html", {'count': author_stats.post_count, 'author':author, 'page': page, 
+                  'paginator': paginator, 'count_followers': author_stats.follower_count, 
+                  "following": following, 'count_followering': author_stats.following_count, 'first_post': first_post,
+                  'feed_version': feed_version})
 
    
+@read_replica
+@query_budget(9)
+@public_page(profile_feeds)
 def post_view(request, username, post_id):
     profile = get_object_or_404(User, username=username)
-    post = get_object_or_404(Post, author=profile.pk, id=post_id)
-    count = Post.objects.filter(author = profile).count
+    post = get_object_or_404(Post.objects.for_feed(), author=profile.pk, id=post_id)
+    profile_stats = stats.stats_for(profile)
     form = CommentForm()
-    comments = Comment.objects.filter(post=post_id)
-    count_followers = Follow.objects.filter(author=profile).count()
-    count_followering = Follow.objects.filter(user=profile).count()
-    return render(request, "posts/post.html", {"profile":profile, 'post':post, "count":count, 'form': form, 'comments' : comments, "count_followers": count_followers, "count_followering": count_followering})
+    comments = Comment.objects.filter(post=post_id).select_related("author")
+    return render(request, "posts/post.html", {"profile":profile, 'post':post, "count": profile_stats.post_count, 'form': form, 'comments' : comments, "count_followers": profile_stats.follower_count, "count_followering": profile_stats.following_count})
 
 
+@query_budget(8)
 def post_edit(request, username, post_id):
     post = get_object_or_404(Post, id = post_id)
     if request.user != post.author:
@@ -82,10 +109,10 @@ def post_edit(request, username, post_id):
     return render(request, "posts/post_edit.html", {"form": form, 'post':post})    
 
 
+@query_budget(6)
 @login_required
 def add_comment(request, username, post_id):
     post = get_object_or_404(Post, pk=post_id)
-    comments = Comment.objects.filter(post=post).all()
     if request.method == 'POST':
         form = CommentForm(request.POST)
         if form.is_valid():
@@ -95,10 +122,33 @@ def add_comment(request, username, post_id):
             comment.save()
             return redirect('post', username=post.author.username, post_id=post_id,)
         return render(request, "posts/post.html", {'form': form, 'post':post})    
-    form = CommentForm()
-    return render(request, "posts/comment.html", {"post": post, "form": form, 'comments': comments})
+    # форма комментария - на странице поста
+    return redirect('post', username=post.author.username, post_id=post_id)
     
 
+@query_budget(4)
+@login_required
+def profile_export(request, username):
+    author = get_object_or_404(User, username=username)
+    if request.user != author and not request.user.is_staff:
+        return redirect("profile", username=username)
+    fmt = request.GET.get("format", "jsonl")
+    if fmt not in export.FORMATS:
+        raise Http404
+    # строки читаются из базы, пока ответ уходит клиенту, список не собирается
+    lines = export.lines(author, fmt, request.build_absolute_uri)
+    compressed = re_accepts_gzip.search(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+    if compressed:
+        lines = compress_sequence(line.encode() for line in lines)
+    response = StreamingHttpResponse(lines,
+                                     content_type=f"{export.FORMATS[fmt]}; charset=utf-8")
+    if compressed:
+        response["Content-Encoding"] = "gzip"
+    patch_vary_headers(response, ("Accept-Encoding",))
+    response["Content-Disposition"] = f'attachment; filename="{author.username}.{fmt}"'
+    return response
+
+
 def page_not_found(request, exception):
     # Переменная exception содержит отладочную информацию, 
     # выводить её в шаблон пользователской страницы 404 мы не станем
@@ -109,32 +159,33 @@ def server_error(request):
     return render(request, "misc/500.html", status=500)
 
 
+@query_budget(7)
 @login_required
 def follow_index(request):   
-    authors = Follow.objects.filter(user=request.user).values_list('author', flat=True)
-    post_list = Post.objects.filter(author__in=authors).order_by("-pub_date").all()
-    paginator = Paginator(post_list, 10) # показывать по 10 записей на странице.
-    page_number = request.GET.get('page') # переменная в URL с номером запрошенной страницы
-    page = paginator.get_page(page_number) # получить записи с нужным смещением
-    return render(request, 'posts/follow.html', {'page': page, 'paginator': paginator})
+    feed_version = cache.follow_feed_version(request.user)
+    paginator, page = paginate(request, *timeline.follow_feed_sources(request.user))
+    return render(request, 'posts/follow.html', {'page': page, 'paginator': paginator, 'feed_version': feed_version})
 
 
+@query_budget(16)
 @login_required
+@transaction.atomic
 def profile_follow(request, username):
     author = get_object_or_404(User, username = username)
-    user = request.user   
-    following = Follow.objects.filter(user=user).filter(author=author)
-    if not following: 
-        if user != author:
-            Follow.objects.create(user=user, author=author)   
-            return redirect("profile", username=username)
-        else:
-            return redirect("profile", username=username)
-    else:
-        return redirect("profile", username=username)                
+    user = request.user
+    if user != author and not follows.is_following(user.pk, author.pk):
+        try:
+            with transaction.atomic():
+                Follow.objects.create(user=user, author=author)
+        except IntegrityError:
+            # подписку уже создал повторный запрос
+            pass
+    return redirect("profile", username=username)
     
 
+@query_budget(12)
 @login_required
+@transaction.atomic
 def profile_unfollow(request, username):
     author = get_object_or_404(User, username = username)
     user = request.user
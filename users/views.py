@@ -9,3 +9,4 @@ class SignUp(CreateView):
     form_class = CreationForm
     success_url = "/auth/login/"
     template_name = "signup.html"
+    query_budget = 6
@@ -0,0 +1,169 @@
+"""Чтение с реплик и read-your-writes.
+
+Представления, помеченные @read_replica (главная, группа, профиль,
+пост), читают с одной из реплик DATABASE_REPLICAS; остальные
+представления и все записи идут в основную базу default.
+
+Реплика годится для чтения, только если догнала последнюю запись:
+ReplicaMiddleware после запроса с записью отмечает её время в кеше, а
+measure() - время основной базы, до которого дошла каждая реплика.
+Иначе страница, прочитанная с отставшей реплики, попала бы в кеш
+фрагментов под новым поколением ленты (posts.cache) и осталась бы там.
+Обе отметки лежат в общем кеше (settings.CACHES), их видят все воркеры
+и команда sync_replicas. Если отметки о последней записи нет (кеш
+очищен или ключ вытеснен), реплики не используются, пока sync_replica()
+не восстановит её временем снимка.
+Сверх того пользователь, который сам что-то записал, REPLICA_PIN_SECONDS
+читает только из основной базы: это держится на cookie и от кеша не зависит.
+
+Отставание меряется по heartbeat: beat() пишет в основную базу текущее
+время, и разница между часами и значением, видимым на реплике, - лаг.
+Без настоящей репликации реплика SQLite - снимок файла основной базы
+через backup API (YATUBE_REPLICAS=n в окружении, см. settings и
+команду sync_replicas).
+"""
+import random
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections, transaction
+
+HEARTBEAT_TABLE = "replica_heartbeat"
+PIN_COOKIE = "primary_pin"
+_LAST_WRITE = "db_router:last_write"
+
+# реплика для чтений текущего запроса и была ли в нём запись
+_state = threading.local()
+
+
+def _synced_key(alias):
+    return f"db_router:synced:{alias}"
+
+
+def replicas():
+    return list(getattr(settings, "DATABASE_REPLICAS", []))
+
+
+def read_replica(view):
+    """Декоратор: чтения представления можно отдать реплике"""
+    view.read_replica = True
+    return view
+
+
+def fresh_replicas():
+    """Реплики, которые уже видят последнюю запись через представления"""
+    aliases = replicas()
+    if not aliases:
+        return []
+    found = cache.get_many([_LAST_WRITE] + [_synced_key(alias) for alias in aliases])
+    if _LAST_WRITE not in found:
+        # неизвестно, когда была последняя запись
+        return []
+    last_write = found[_LAST_WRITE]
+    return [alias for alias in aliases if found.get(_synced_key(alias), -1) >= last_write]
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replica = getattr(_state, "replica", None)
+        if replica is None:
+            return None
+        # после записи в этом же запросе реплика её ещё не видит
+        return DEFAULT_DB_ALIAS if getattr(_state, "wrote", False) else replica
+
+    def db_for_write(self, model, **hints):
+        _state.wrote = True
+        # объект, прочитанный с реплики, сохраняется в основную базу
+        instance = hints.get("instance")
+        if instance is not None and instance._state.db in replicas():
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        pool = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in pool and obj2._state.db in pool:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return False if db in replicas() else None
+
+
+class ReplicaMiddleware:
+    """Выбирает реплику для помеченных представлений и запоминает записи"""
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _state.replica, _state.wrote = None, False
+        try:
+            response = self.get_response(request)
+            if _state.wrote:
+                # после ответа: транзакции запроса уже зафиксированы
+                cache.set(_LAST_WRITE, time.time(), None)
+                response.set_cookie(PIN_COOKIE, "1", max_age=settings.REPLICA_PIN_SECONDS, httponly=True)
+        finally:
+            _state.replica, _state.wrote = None, False
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if getattr(view_func, "read_replica", False) and PIN_COOKIE not in request.COOKIES:
+            fresh = fresh_replicas()
+            _state.replica = random.choice(fresh) if fresh else None
+
+
+def beat(using=DEFAULT_DB_ALIAS):
+    """Записать в основную базу текущее время, возвращает его"""
+    now = time.time()
+    with transaction.atomic(using), connections[using].cursor() as cursor:
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {HEARTBEAT_TABLE} "
+                       f"(id INTEGER PRIMARY KEY, beat DOUBLE PRECISION NOT NULL)")
+        cursor.execute(f"DELETE FROM {HEARTBEAT_TABLE}")
+        cursor.execute(f"INSERT INTO {HEARTBEAT_TABLE} (id, beat) VALUES (1, %s)", [now])
+    return now
+
+
+def read_beat(cursor):
+    """Последний heartbeat, видимый через cursor, или None"""
+    try:
+        cursor.execute(f"SELECT beat FROM {HEARTBEAT_TABLE}")
+    except (DatabaseError, sqlite3.DatabaseError):
+        return None
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def measure(alias):
+    """Отставание реплики в секундах или None, если heartbeat до неё не дошёл.
+    Заодно запоминает, до какого времени реплика догнала основную базу"""
+    with connections[alias].cursor() as cursor:
+        synced = read_beat(cursor)
+    if synced is None:
+        return None
+    cache.set(_synced_key(alias), synced, None)
+    return time.time() - synced
+
+
+def copy_database(path, using=DEFAULT_DB_ALIAS):
+    """Снимок основной базы SQLite в файл path вместе со свежим heartbeat,
+    возвращает время heartbeat"""
+    now = beat(using)
+    connection = connections[using]
+    connection.ensure_connection()
+    target = sqlite3.connect(path)
+    try:
+        connection.connection.backup(target)
+    finally:
+        target.close()
+    return now
+
+
+def sync_replica(alias):
+    """Обновить файловую реплику alias и вернуть её отставание"""
+    copied = copy_database(connections[alias].settings_dict["NAME"])
+    # в снимке все записи до него: без отметки о записи её время не позже снимка
+    cache.add(_LAST_WRITE, copied, None)
+    return measure(alias)
@@ -0,0 +1,55 @@
+"""Файловый кеш, общий для всех процессов сервера.
+
+Каждый ключ - файл в общем каталоге, поэтому поколения лент, сброшенные
+одним воркером или командой manage.py, сразу видят все остальные. У
+FileBasedCache add() и incr() - чтение и запись без блокировки: два
+процесса могут оба «добавить» ключ или потерять увеличение. Здесь add()
+создаёт файл жёсткой ссылкой на готовый временный (os.link не
+перезаписывает существующий файл), а incr() идёт под блокировкой
+каталога.
+"""
+import os
+import tempfile
+from contextlib import contextmanager
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.files import locks
+
+LOCK_FILE = "incr.lock"
+
+
+class FileCache(FileBasedCache):
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._createdir()
+        fname = self._key_to_file(key, version)
+        self._cull()
+        fd, temp_path = tempfile.mkstemp(dir=self._dir)
+        try:
+            with open(fd, "wb") as temp:
+                self._write_content(temp, timeout, value)
+            for _ in range(2):
+                try:
+                    os.link(temp_path, fname)
+                    return True
+                except FileExistsError:
+                    # просроченный файл has_key() удалит, и вторая попытка пройдёт
+                    if self.has_key(key, version):
+                        return False
+            return False
+        finally:
+            os.remove(temp_path)
+
+    def incr(self, key, delta=1, version=None):
+        with self._locked():
+            return super().incr(key, delta, version)
+
+    @contextmanager
+    def _locked(self):
+        self._createdir()
+        with open(os.path.join(self._dir, LOCK_FILE), "ab") as lock:
+            locks.lock(lock, locks.LOCK_EX)
+            try:
+                yield
+            finally:
+                locks.unlock(lock)
@@ -0,0 +1,286 @@
+"""Метрики в текстовом формате Prometheus на /metrics.
+
+MetricsMiddleware записывает по каждому запросу время ответа
+(гистограмма), число и время SQL-запросов, время отрисовки шаблонов и
+размер ответа с меткой view - именем маршрута. Кеш фрагментов
+({% cache %}) считает попадания и промахи по имени фрагмента, а лента -
+найденные и ещё не готовые миниатюры.
+
+Значения копятся в памяти процесса и не реже METRICS_FLUSH_INTERVAL
+секунд сбрасываются в собственный файл процесса в METRICS_DIR; /metrics
+суммирует файлы всех процессов, в том числе завершившихся, поэтому
+счётчики воркеров не теряются при перезапуске. Каталог очищают при
+выкладке, как каталог многопроцессного режима prometheus_client.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.memcached import MemcachedCache
+from django.db import connections
+from django.http import HttpResponse
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+
+from yatube.filecache import FileCache
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576)
+
+# имя: (тип, описание, границы корзин гистограммы)
+METRICS = {
+    "yatube_requests_total": ("counter", "Ответы по представлению, методу и статусу", None),
+    "yatube_request_duration_seconds": ("histogram", "Время ответа представления", DURATION_BUCKETS),
+    "yatube_db_queries_total": ("counter", "SQL-запросы во время запроса", None),
+    "yatube_db_query_seconds_total": ("counter", "Время SQL-запросов", None),
+    "yatube_template_render_seconds_total": ("counter", "Время отрисовки шаблонов", None),
+    "yatube_response_size_bytes": ("histogram", "Размер тела ответа, кроме потоковых", SIZE_BUCKETS),
+    "yatube_fragment_cache_total": ("counter", "Обращения к кешу фрагментов {% cache %}", None),
+    "yatube_thumbnail_lookups_total": ("counter", "Поиск готовых миниатюр изображения поста", None),
+}
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_FRAGMENT_PREFIX = "template.cache."
+_MISSING = object()
+# счётчики запроса, который обрабатывает поток
+_local = threading.local()
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+class Registry:
+    """Значения метрик этого процесса и их файл в METRICS_DIR"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self.values = {}
+            self.pid = os.getpid()
+            self.started = time.time()
+            self.flushed = 0
+
+    def _check_fork(self):
+        # после fork ребёнок начинает с нуля, иначе значения родителя сложатся дважды
+        if os.getpid() != self.pid:
+            self.values = {}
+            self.pid = os.getpid()
+            self.started = time.time()
+
+    def inc(self, name, labels, value=1):
+        with self._lock:
+            self._check_fork()
+            key = _key(name, labels)
+            self.values[key] = self.values.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][2]
+        with self._lock:
+            self._check_fork()
+            key = _key(name, labels)
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = {"buckets": [0] * len(buckets), "sum": 0, "count": 0}
+            for number, bound in enumerate(buckets):
+                if value <= bound:
+                    state["buckets"][number] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    def path(self):
+        return os.path.join(settings.METRICS_DIR, f"{self.pid}-{int(self.started * 1000)}.json")
+
+    def flush(self, force=False):
+        if not force and time.time() - self.flushed < settings.METRICS_FLUSH_INTERVAL:
+            return
+        with self._lock:
+            self._check_fork()
+            rows = [[name, dict(labels), value] for (name, labels), value in self.values.items()]
+            path = self.path()
+            self.flushed = time.time()
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as temp:
+            json.dump(rows, temp)
+        os.replace(temp_path, path)
+
+
+registry = Registry()
+
+
+def collect():
+    """Сумма значений из файлов всех процессов: {(имя, метки): значение}"""
+    registry.flush(force=True)
+    total = {}
+    for filename in os.listdir(settings.METRICS_DIR):
+        if not filename.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(settings.METRICS_DIR, filename)) as saved:
+                rows = json.load(saved)
+        except (OSError, ValueError):
+            # файл исчез или процесс упал посреди записи временного файла
+            continue
+        for name, labels, value in rows:
+            if name not in METRICS:
+                continue
+            key = _key(name, labels)
+            if isinstance(value, dict):
+                found = total.setdefault(key, {"buckets": [0] * len(value["buckets"]), "sum": 0, "count": 0})
+                found["buckets"] = [a + b for a, b in zip(found["buckets"], value["buckets"])]
+                found["sum"] += value["sum"]
+                found["count"] += value["count"]
+            else:
+                total[key] = total.get(key, 0) + value
+    return total
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + sorted(extra.items())
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def exposition(values):
+    """Текст в формате Prometheus для значений из collect()"""
+    lines = []
+    for name, (kind, description, buckets) in METRICS.items():
+        samples = sorted((labels, value) for (metric, labels), value in values.items() if metric == name)
+        if not samples:
+            continue
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            if kind == "histogram":
+                for bound, count in zip(buckets, value["buckets"]):
+                    lines.append(f"{name}_bucket{_labels(labels, le=_number(float(bound)))} {count}")
+                lines.append(f"{name}_bucket{_labels(labels, le='+Inf')} {value['count']}")
+                lines.append(f"{name}_sum{_labels(labels)} {_number(float(value['sum']))}")
+                lines.append(f"{name}_count{_labels(labels)} {value['count']}")
+            else:
+                lines.append(f"{name}{_labels(labels)} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+@staff_member_required
+def metrics_view(request):
+    return HttpResponse(exposition(collect()), content_type=CONTENT_TYPE)
+
+
+def current_request():
+    """Счётчики запроса, который обрабатывает поток: queries, query_seconds,
+    template_seconds; None вне запроса"""
+    return getattr(_local, "request", None)
+
+
+def _count_query(execute, sql, params, many, context):
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        current = getattr(_local, "request", None)
+        if current is not None:
+            current["queries"] += 1
+            current["query_seconds"] += time.perf_counter() - start
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _local.request = current = {"queries": 0, "query_seconds": 0.0, "template_seconds": 0.0}
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(_count_query))
+                response = self.get_response(request)
+        finally:
+            _local.request = None
+        elapsed = time.perf_counter() - start
+        match = getattr(request, "resolver_match", None)
+        view = {"view": match.view_name if match else "unresolved"}
+        registry.inc("yatube_requests_total", dict(view, method=request.method, status=str(response.status_code)))
+        registry.observe("yatube_request_duration_seconds", view, elapsed)
+        registry.inc("yatube_db_queries_total", view, current["queries"])
+        registry.inc("yatube_db_query_seconds_total", view, current["query_seconds"])
+        registry.inc("yatube_template_render_seconds_total", view, current["template_seconds"])
+        if not response.streaming:
+            registry.observe("yatube_response_size_bytes", view, len(response.content))
+        registry.flush()
+        return response
+
+
+@contextmanager
+def _template_timer():
+    # вложенные шаблоны (render_to_string в тегах) уже внутри внешнего замера
+    current = getattr(_local, "request", None)
+    depth = getattr(_local, "template_depth", 0)
+    _local.template_depth = depth + 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _local.template_depth = depth
+        if current is not None and depth == 0:
+            current["template_seconds"] += time.perf_counter() - start
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        with _template_timer():
+            return super().render(context, request)
+
+
+class MeteredTemplates(DjangoTemplates):
+    """Шаблонизатор Django, который замеряет отрисовку для MetricsMiddleware"""
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+
+def fragment_lookup(key, hit):
+    # ключ {% cache %}: template.cache.<имя фрагмента>.<хеш переменных>
+    if key.startswith(_FRAGMENT_PREFIX):
+        fragment = key[len(_FRAGMENT_PREFIX):].split(".", 1)[0]
+        registry.inc("yatube_fragment_cache_total", {"fragment": fragment, "result": "hit" if hit else "miss"})
+
+
+class FragmentMetricsMixin:
+    """Примесь к любому бэкенду кеша: считает попадания в кеш фрагментов"""
+    def get(self, key, default=None, version=None):
+        value = super().get(key, _MISSING, version)
+        fragment_lookup(key, value is not _MISSING)
+        return default if value is _MISSING else value
+
+
+class MeteredLocMemCache(FragmentMetricsMixin, LocMemCache):
+    pass
+
+
+class MeteredFileCache(FragmentMetricsMixin, FileCache):
+    pass
+
+
+class MeteredMemcachedCache(FragmentMetricsMixin, MemcachedCache):
+    pass
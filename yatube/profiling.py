@@ -0,0 +1,163 @@
+"""Профилирование отдельных запросов в бою.
+
+ProfilingMiddleware выполняет запрос под профилировщиком, если:
+
+- его открыл сотрудник с параметром ?_profile=1;
+- в ?_profile= подписанная метка для этого пути (sign(), команда
+  profile_link) - так можно снять профиль у конкретного пользователя,
+  отправив ему ссылку;
+- выпал случай с вероятностью PROFILE_SAMPLE_RATE.
+
+PROFILE_MODE = "cprofile" пишет pstats: точные числа вызовов, но запрос
+замедляется в разы. "sampler" раз в PROFILE_SAMPLER_INTERVAL секунд
+снимает стек потока запроса и пишет collapsed stacks (строка "кадр;кадр;...
+число"), которые понимают flamegraph.pl и speedscope; запрос почти не
+замедляется. Рядом с профилем - JSON с путём, пользователем, временем
+ответа, числом и временем SQL-запросов и временем шаблонов из
+yatube.metrics. Файлы лежат в PROFILE_DIR/<имя маршрута>/, сводку по ним
+печатает команда profile_report.
+"""
+import cProfile
+import itertools
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core import signing
+
+from yatube import metrics
+
+PARAMETER = "_profile"
+MODES = ("cprofile", "sampler")
+_SALT = "yatube.profiling"
+# номер профиля в процессе: несколько профилей за миллисекунду не затрут друг друга
+_sequence = itertools.count()
+
+
+def sign(path):
+    """Метка для ?_profile=, которая включает профилирование пути path"""
+    return signing.TimestampSigner(salt=_SALT).sign(path)[len(path) + 1:]
+
+
+def _signed(path, token):
+    try:
+        signing.TimestampSigner(salt=_SALT).unsign(f"{path}:{token}", max_age=settings.PROFILE_LINK_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return True
+
+
+def requested(request):
+    """Профилировать ли запрос и почему: "staff", "link", "sample" или None"""
+    token = request.GET.get(PARAMETER)
+    if token:
+        if token == "1" and request.user.is_staff:
+            return "staff"
+        if _signed(request.path, token):
+            return "link"
+    if settings.PROFILE_SAMPLE_RATE and random.random() < settings.PROFILE_SAMPLE_RATE:
+        return "sample"
+    return None
+
+
+def frame_name(code):
+    filename = code.co_filename
+    if filename.startswith(settings.BASE_DIR):
+        filename = os.path.relpath(filename, settings.BASE_DIR)
+    elif "site-packages" in filename:
+        filename = filename.split("site-packages" + os.sep, 1)[1]
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """Снимает стек потока, в котором открыт контекст, из отдельного потока"""
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        self._target = threading.get_ident()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                stack.append(frame_name(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def _save(view, mode, profiler, tags):
+    directory = os.path.join(settings.PROFILE_DIR, view.replace(":", "."))
+    os.makedirs(directory, exist_ok=True)
+    now = time.time()
+    stamp = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}.{int(now % 1 * 1000):03d}"
+    base = os.path.join(directory, f"{stamp}-{os.getpid()}-{next(_sequence)}")
+    if mode == "cprofile":
+        profiler.dump_stats(f"{base}.prof")
+    else:
+        with open(f"{base}.collapsed", "w") as collapsed:
+            collapsed.write(profiler.collapsed())
+    with open(f"{base}.json", "w") as meta:
+        json.dump(tags, meta, ensure_ascii=False)
+    return base
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        reason = requested(request)
+        if reason is None:
+            return self.get_response(request)
+        mode = request.GET.get("_profile_mode") or settings.PROFILE_MODE
+        if mode not in MODES:
+            mode = settings.PROFILE_MODE
+        start = time.perf_counter()
+        if mode == "cprofile":
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+        else:
+            with StackSampler(settings.PROFILE_SAMPLER_INTERVAL) as profiler:
+                response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+        match = getattr(request, "resolver_match", None)
+        view = match.view_name if match else "unresolved"
+        current = metrics.current_request() or {}
+        _save(view, mode, profiler, {
+            "view": view,
+            "path": request.get_full_path(),
+            "user": request.user.username if request.user.is_authenticated else None,
+            "reason": reason,
+            "mode": mode,
+            "status": response.status_code,
+            "seconds": elapsed,
+            "queries": current.get("queries"),
+            "query_seconds": current.get("query_seconds"),
+            "template_seconds": current.get("template_seconds"),
+            "time": time.time(),
+        })
+        return response
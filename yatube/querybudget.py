@@ -0,0 +1,180 @@
+"""Бюджет SQL-запросов для представлений и поиск N+1.
+
+Представление объявляет максимум запросов через @query_budget(n)
+(для классов - атрибутом query_budget). QueryBudgetMiddleware
+записывает все запросы запроса, группирует их по форме SQL и сообщает
+о превышении бюджета и о повторяющихся формах (признак N+1) вместе со
+строкой шаблона или кадром кода, откуда запрос пришёл. В бою это
+предупреждение в лог, в тестах с QUERY_BUDGET_RAISE = True - исключение.
+
+Обход стека дорог, поэтому источник ищется только у повторов: когда
+текст запроса встречается второй раз, источник записывается и ему, и
+первому такому запросу. Запросы внутри unmetered() не учитываются - это
+работа, которую в бою делает не запрос (пул миниатюр).
+"""
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.template.base import Node
+
+logger = logging.getLogger(__name__)
+
+Query = namedtuple('Query', 'sql duration origin')
+
+_STRINGS = re.compile(r"'(?:[^']|'')*'")
+_NUMBERS = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LISTS = re.compile(r'\bIN \((?:\s*(?:%s|\?)\s*,?)+\)', re.IGNORECASE)
+_SPACES = re.compile(r'\s+')
+# управление транзакцией - не запросы к данным, их число зависит от вложенности atomic
+_TRANSACTION = re.compile(r'^\s*(SAVEPOINT|RELEASE SAVEPOINT|ROLLBACK TO SAVEPOINT|BEGIN|COMMIT)\b', re.IGNORECASE)
+
+_local = threading.local()
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+@contextmanager
+def unmetered():
+    """Запросы внутри блока не входят в бюджет и отчёт"""
+    _local.depth = getattr(_local, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _local.depth -= 1
+
+
+def query_budget(limit):
+    """Декоратор: представлению разрешено не больше limit запросов"""
+    def decorator(view):
+        view.query_budget = limit
+        return view
+    return decorator
+
+
+def normalize(sql):
+    """Форма запроса без литералов: одинаковые запросы с разными id совпадают"""
+    sql = _STRINGS.sub('?', sql)
+    sql = _NUMBERS.sub('?', sql)
+    sql = _IN_LISTS.sub('IN (...)', sql)
+    return _SPACES.sub(' ', sql).strip()
+
+
+def _origin(depth):
+    """Строка шаблона или кадр кода проекта, из которого выполнен запрос"""
+    frame = sys._getframe(depth)
+    code_frame = None
+    while frame is not None:
+        node = frame.f_locals.get('self')
+        # type(), а не isinstance(): ленивый request.user выполнил бы запрос
+        if issubclass(type(node), Node) and getattr(node, 'token', None) is not None:
+            origin = getattr(node, 'origin', None)
+            name = getattr(origin, 'template_name', None) or getattr(origin, 'name', '?')
+            return f'{name}:{node.token.lineno}'
+        filename = frame.f_code.co_filename
+        if code_frame is None and filename.startswith(settings.BASE_DIR) \
+                and filename != __file__ and 'site-packages' not in filename:
+            code_frame = f'{os.path.relpath(filename, settings.BASE_DIR)}:{frame.f_lineno} ({frame.f_code.co_name})'
+        frame = frame.f_back
+    return code_frame or '?'
+
+
+class QueryRecorder:
+    """Записывает запросы во все базы, пока открыт контекст"""
+
+    def __init__(self):
+        self.queries = []
+        self._first = {}
+        self._stack = None
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            if not getattr(_local, 'depth', 0) and not _TRANSACTION.match(sql):
+                self._record(sql, time.perf_counter() - start)
+
+    def _record(self, sql, duration):
+        first = self._first.setdefault(sql, len(self.queries))
+        origin = None
+        if first < len(self.queries):
+            origin = _origin(3)
+            if self.queries[first].origin is None:
+                self.queries[first] = self.queries[first]._replace(origin=origin)
+        self.queries.append(Query(sql, duration, origin))
+
+    def __len__(self):
+        return len(self.queries)
+
+    def shapes(self):
+        """Форма SQL -> список запросов этой формы, в порядке появления"""
+        grouped = OrderedDict()
+        for query in self.queries:
+            grouped.setdefault(normalize(query.sql), []).append(query)
+        return grouped
+
+    def repeated(self, threshold=None):
+        """SELECT-формы, повторившиеся не меньше threshold раз, - кандидаты в N+1"""
+        if threshold is None:
+            threshold = getattr(settings, 'QUERY_REPEAT_THRESHOLD', 3)
+        return OrderedDict(
+            (shape, queries) for shape, queries in self.shapes().items()
+            if len(queries) >= threshold and shape.upper().startswith('SELECT')
+        )
+
+    def report(self, limit=None):
+        """Текстовый отчёт о превышении бюджета и повторах, пустой если всё хорошо"""
+        lines = []
+        if limit is not None and len(self) > limit:
+            lines.append(f'{len(self)} queries, budget is {limit}')
+        for shape, queries in self.repeated().items():
+            origins = sorted({query.origin or '?' for query in queries})
+            lines.append(f'{len(queries)}x {shape}')
+            lines.extend(f'    from {origin}' for origin in origins)
+        return '\n'.join(lines)
+
+
+def budget_for(view_func):
+    budget = getattr(view_func, 'query_budget', None)
+    if budget is None:
+        budget = getattr(getattr(view_func, 'view_class', None), 'query_budget', None)
+    return budget
+
+
+class QueryBudgetMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.query_budget = None
+        with QueryRecorder() as recorder:
+            response = self.get_response(request)
+        report = recorder.report(request.query_budget)
+        if report:
+            message = f'{request.method} {request.path}: {report}'
+            if getattr(settings, 'QUERY_BUDGET_RAISE', False):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_budget = budget_for(view_func)
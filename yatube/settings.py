@@ -10,11 +10,18 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
+import atexit
 import os
+import shutil
+import sys
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
+# Запуск тестов: manage.py test или pytest
+TESTING = sys.argv[1:2] == ['test'] or 'pytest' in sys.modules
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/2.2/howto/deployment/checklist/
@@ -50,6 +57,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # первым: в замер входит вся обработка запроса
+    'yatube.metrics.MetricsMiddleware',
+    'yatube.querybudget.QueryBudgetMiddleware',
+    # снаружи сессий: запись сессии тоже закрепляет пользователя за основной базой
+    'yatube.db_router.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -57,13 +69,16 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # после аутентификации: сотрудник включает профиль параметром
+    'yatube.profiling.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'yatube.urls'
 TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates с замером отрисовки для /metrics
+        'BACKEND': 'yatube.metrics.MeteredTemplates',
         'DIRS': [TEMPLATES_DIR],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -73,6 +88,7 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'users.context_processors.year',          
+                'posts.context_processors.fragment_cache',
             ],
         },
     },
@@ -84,13 +100,47 @@ WSGI_APPLICATION = 'yatube.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
+# SQLite с WAL и BEGIN IMMEDIATE, см. yatube.sqlite.base. Под окружение
+# настраивается переменными: YATUBE_DB - файл базы, YATUBE_CONN_MAX_AGE -
+# сколько секунд держать соединение, YATUBE_SQLITE_TRANSACTION_MODE и
+# YATUBE_SQLITE_<ПРАГМА> (например YATUBE_SQLITE_SYNCHRONOUS=full)
+SQLITE_OPTIONS = {
+    'timeout': 5,
+    'transaction_mode': os.environ.get('YATUBE_SQLITE_TRANSACTION_MODE', 'IMMEDIATE'),
+    'pragmas': {
+        name[len('YATUBE_SQLITE_'):].lower(): value for name, value in os.environ.items()
+        if name.startswith('YATUBE_SQLITE_') and name != 'YATUBE_SQLITE_TRANSACTION_MODE'
+    },
+}
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'ENGINE': 'yatube.sqlite',
+        'NAME': os.environ.get('YATUBE_DB', os.path.join(BASE_DIR, 'db.sqlite3')),
+        'CONN_MAX_AGE': int(os.environ.get('YATUBE_CONN_MAX_AGE', 600)),
+        'OPTIONS': SQLITE_OPTIONS,
     }
 }
 
+# Реплики для чтения (yatube.db_router). YATUBE_REPLICAS=n добавляет n
+# файловых копий основной базы, которые обновляет команда sync_replicas;
+# в тестах они зеркалируют default
+DATABASE_ROUTERS = ['yatube.db_router.ReplicaRouter']
+DATABASE_REPLICAS = []
+for number in range(1, int(os.environ.get('YATUBE_REPLICAS', 0)) + 1):
+    DATABASES[f'replica{number}'] = {
+        'ENGINE': 'yatube.sqlite',
+        'NAME': os.path.join(BASE_DIR, f'db.replica{number}.sqlite3'),
+        'CONN_MAX_AGE': DATABASES['default']['CONN_MAX_AGE'],
+        # запись в реплику мимо sync_replicas - ошибка, а не тихое расхождение
+        'OPTIONS': {**SQLITE_OPTIONS, 'pragmas': {**SQLITE_OPTIONS['pragmas'], 'query_only': 'on'}},
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{number}')
+
+# Сколько секунд после своей записи пользователь читает только из основной базы
+REPLICA_PIN_SECONDS = 10
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -133,6 +183,10 @@ STATIC_ROOT = os.path.join(BASE_DIR, "static")
 
 MEDIA_URL = "/media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
+if TESTING:
+    # загрузки тестов не остаются в media/
+    MEDIA_ROOT = tempfile.mkdtemp(prefix='yatube-test-media-')
+    atexit.register(shutil.rmtree, MEDIA_ROOT, True)
 # Login
 
 LOGIN_URL = "/auth/login/"
@@ -147,14 +201,96 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, "sent_emails")
 # Идентификатор текущего сайта
 SITE_ID = 1
 
-CACHES = {
-        'default': {
-                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        }
-}
+# Кеш общий для всех воркеров и команд manage.py: поколения лент, отметки
+# реплик и блокировки задач должны быть видны каждому процессу. С
+# YATUBE_MEMCACHED=host:port[,host:port] - memcached, иначе файлы в
+# YATUBE_CACHE_DIR; у каждого прогона тестов свой пустой каталог.
+# Бэкенды со счётчиками попаданий в кеш фрагментов для /metrics
+CACHE_DIR = os.environ.get('YATUBE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'yatube-cache'))
+if TESTING:
+    CACHE_DIR = tempfile.mkdtemp(prefix='yatube-test-cache-')
+    atexit.register(shutil.rmtree, CACHE_DIR, True)
+if os.environ.get('YATUBE_MEMCACHED'):
+    CACHES = {
+            'default': {
+                    'BACKEND': 'yatube.metrics.MeteredMemcachedCache',
+                    'LOCATION': os.environ['YATUBE_MEMCACHED'].split(','),
+            }
+    }
+else:
+    CACHES = {
+            'default': {
+                    'BACKEND': 'yatube.metrics.MeteredFileCache',
+                    'LOCATION': CACHE_DIR,
+                    'OPTIONS': {'MAX_ENTRIES': int(os.environ.get('YATUBE_CACHE_MAX_ENTRIES', 20000))},
+            }
+    }
+
+# Сколько секунд живут отрисованные фрагменты лент и XML фидов. Ключ с
+# поколением ленты устаревает сам; срок лишь ограничивает жизнь
+# фрагмента, если сброс поколения разминулся с записью
+FRAGMENT_CACHE_TIMEOUT = 10 * 60
 
 TEST_CACHES = {
         'default': {
             'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
         }
-}
\ No newline at end of file
+}
+
+# Лента подписок раскладывается по подписчикам при публикации,
+# кроме авторов, у которых подписчиков больше этого числа
+FEED_FANOUT_LIMIT = 1000
+
+# Сколько секунд живут множества подписок в общем кеше (posts.follows);
+# подписка и отписка сбрасывают их сразу, срок лишь страхует от гонки с записью
+FOLLOW_GRAPH_TIMEOUT = 10 * 60
+
+
+# Превышение бюджета запросов и N+1: предупреждение в лог,
+# а в тестах (QUERY_BUDGET_RAISE = True) - исключение
+QUERY_BUDGET_RAISE = TESTING or os.environ.get('YATUBE_QUERY_BUDGET_RAISE') == '1'
+QUERY_REPEAT_THRESHOLD = 3
+
+
+# Сколько секунд обратный прокси и браузер могут отдавать публичную
+# страницу анониму без перепроверки по ETag
+PUBLIC_CACHE_MAX_AGE = 30
+
+
+# Процессов в пуле, который заранее делает миниатюры изображений постов;
+# 0 - делать их сразу, в процессе, сохранившем пост. В тестах пула нет:
+# его колбэк писал бы kvstore из другого потока в общую базу в памяти
+THUMBNAIL_WORKERS = 0 if TESTING else int(os.environ.get('YATUBE_THUMBNAIL_WORKERS', 2))
+
+
+# Загрузки пишутся во временный файл, а не в память процесса
+FILE_UPLOAD_HANDLERS = ['django.core.files.uploadhandler.TemporaryFileUploadHandler']
+
+# Приём изображений постов (posts.images): большая сторона после уменьшения,
+# предел пикселей после draft-декодирования и одновременных декодирований в процессе
+IMAGE_MAX_SIDE = 2048
+IMAGE_MAX_PIXELS = 50_000_000
+IMAGE_INGEST_CONCURRENCY = 2
+IMAGE_JPEG_QUALITY = 85
+
+
+# Живое обновление лент (posts.delta): наибольшее ожидание новых записей
+# в long-poll и как часто при нём проверяются поколения лент, в секундах
+DELTA_MAX_WAIT = 25
+DELTA_POLL_INTERVAL = 1.0
+
+
+# Метрики Prometheus (yatube.metrics): каталог, где процессы оставляют свои
+# значения для /metrics (очищается при выкладке), и как часто они туда пишутся
+METRICS_DIR = os.environ.get('YATUBE_METRICS_DIR', os.path.join(tempfile.gettempdir(), 'yatube-metrics'))
+METRICS_FLUSH_INTERVAL = 1.0
+
+
+# Профилирование запросов (yatube.profiling): куда писать профили, доля
+# случайных запросов под профилировщиком, cprofile или sampler, шаг
+# сэмплера в секундах и сколько секунд действует подписанная ссылка
+PROFILE_DIR = os.environ.get('YATUBE_PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'yatube-profiles'))
+PROFILE_SAMPLE_RATE = float(os.environ.get('YATUBE_PROFILE_SAMPLE_RATE', 0))
+PROFILE_MODE = 'sampler'
+PROFILE_SAMPLER_INTERVAL = 0.002
+PROFILE_LINK_MAX_AGE = 24 * 60 * 60
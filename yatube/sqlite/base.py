@@ -0,0 +1,61 @@
+"""Бэкенд SQLite для работы под нагрузкой (ENGINE = 'yatube.sqlite').
+
+Стандартный бэкенд Django открывает базу в режиме rollback journal, где
+запись блокирует читателей, а atomic начинает транзакцию с BEGIN
+DEFERRED. Такая транзакция сначала читает, а при первой записи пытается
+взять блокировку записи; если её держит другое соединение, SQLite сразу
+отвечает "database is locked", не дожидаясь busy_timeout, - иначе
+вышла бы взаимная блокировка.
+
+Здесь каждое новое соединение получает прагмы PRAGMAS (WAL: читатели не
+ждут писателя; synchronous=NORMAL, которого в WAL достаточно для
+целостности; кеш страниц, mmap, ожидание блокировки), а atomic
+начинает транзакцию с BEGIN IMMEDIATE: писатели встают в очередь через
+busy_timeout в самом начале транзакции. В OPTIONS базы:
+
+- pragmas - словарь прагм поверх PRAGMAS, значение None отменяет прагму;
+- transaction_mode - DEFERRED, IMMEDIATE (по умолчанию) или EXCLUSIVE,
+  как одноимённая опция SQLite в Django 5.1.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+PRAGMAS = {
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "busy_timeout": 5000,
+    # отрицательное значение - КиБ, а не страницы
+    "cache_size": -20000,
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "memory",
+}
+TRANSACTION_MODES = ("DEFERRED", "IMMEDIATE", "EXCLUSIVE")
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        # свои опции не для sqlite3.connect
+        params.pop("pragmas", None)
+        params.pop("transaction_mode", None)
+        return params
+
+    def pragmas(self):
+        options = self.settings_dict["OPTIONS"]
+        pragmas = {**PRAGMAS, **options.get("pragmas", {})}
+        return {name: value for name, value in pragmas.items() if value is not None}
+
+    def transaction_mode(self):
+        mode = str(self.settings_dict["OPTIONS"].get("transaction_mode", "IMMEDIATE")).upper()
+        if mode not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(f"transaction_mode должен быть одним из {', '.join(TRANSACTION_MODES)}")
+        return mode
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas().items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute(f"BEGIN {self.transaction_mode()}")
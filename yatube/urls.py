@@ -20,6 +20,8 @@ from django.conf.urls import handler404, handler500
 from django.conf import settings
 from django.conf.urls.static import static
 
+from yatube import metrics
+
 handler404 = "posts.views.page_not_found"
 handler500 = "posts.views.server_error"
 
@@ -31,6 +33,8 @@ urlpatterns = [
         # регистрация и авторизация
     path("auth/", include("users.urls")),
     path("auth/", include("django.contrib.auth.urls")),
+        # метрики Prometheus, только для персонала
+    path("metrics", metrics.metrics_view, name="metrics"),
         # импорт из приложения posts
     path("", include("posts.urls")),
 ]